@@ -0,0 +1,462 @@
+"""
+End-to-end benchmarks of the ccp.py command line.
+
+Builds scratch directory trees of a configurable shape, runs the real
+CLI in a fresh interpreter for every combination of tree size, --threads
+value and option set, and reports cold-start latency, files and bytes
+per second, p50/p99 per-file latency and scaling efficiency per core.
+Each tree size also gets a breakdown of where the wall time goes:
+interpreter start, module import, CommentRemover construction, file
+discovery and the batch itself.
+
+Usage:
+    python benchmarks/bench_cli.py --files 10 1000 100000 --threads 1 2 4 8
+    python benchmarks/bench_cli.py --option-set backup= --option-set check=--check
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Any
+
+from bench_handlers import CorpusGenerator, SYNTAX
+
+CCP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python')
+CCP = os.path.join(CCP_DIR, 'ccp.py')
+
+EXTENSIONS = {
+    'python': '.py', 'javascript': '.js', 'typescript': '.ts', 'c': '.c', 'cpp': '.cpp',
+    'java': '.java', 'go': '.go', 'rust': '.rs', 'css': '.css', 'html': '.html',
+    'ruby': '.rb', 'php': '.php', 'sql': '.sql', 'bash': '.sh', 'yaml': '.yaml',
+    'lua': '.lua', 'csharp': '.cs', 'kotlin': '.kt', 'swift': '.swift', 'dart': '.dart',
+    'perl': '.pl', 'haskell': '.hs', 'matlab': '.m', 'r': '.r', 'powershell': '.ps1',
+}
+
+# Distinct contents generated per language; files cycle through them
+VARIANTS = 16
+
+# Snippets timed in a fresh interpreter for the start-up breakdown. Each
+# one does the work of the one before it plus one more step.
+STARTUP_STEPS = (
+    ('interpreter', 'pass'),
+    ('import', 'import sys; sys.path.insert(0, {dir!r}); import ccp'),
+    ('construct', 'import sys; sys.path.insert(0, {dir!r}); import ccp; ccp.CommentRemover()'),
+)
+
+DISCOVERY_SNIPPET = '''
+import sys, time
+sys.path.insert(0, {dir!r})
+import ccp
+remover = ccp.CommentRemover()
+started = time.perf_counter()
+finder = ccp.FileFinder(accept=lambda name: remover.identify_language(name) != 'unknown')
+files = ccp.collect_files(['*'], recursive=True, finder=finder)
+print(len(files), time.perf_counter() - started)
+'''
+
+
+class TreeBuilder:
+    """
+    Builds scratch source trees of a given shape.
+    
+    Files are spread over a directory tree with a fixed fan-out, down to a
+    fixed depth, and cycle through the languages and a few generated
+    contents per language. A tree is built once per size as a template
+    and copied before every run, since runs clean the files in place.
+    """
+    
+    def __init__(self, root: str, languages: List[str], file_size: int, depth: int,
+                 fanout: int, seed: int = 0):
+        """
+        Initialize the builder.
+        
+        Args:
+            root: Directory to build trees in
+            languages: Languages of the files
+            file_size: Approximate size of each file in characters
+            depth: Number of directory levels below the tree root
+            fanout: Number of subdirectories per directory
+            seed: Seed for the generated contents
+        """
+        self.root = root
+        self.languages = languages
+        self.depth = depth
+        self.fanout = fanout
+        generator = CorpusGenerator(seed)
+        self.contents = {
+            language: [
+                generator.generate(language, file_size, 0.1 + 0.4 * index / VARIANTS, 0.3, 80)
+                .encode('utf-8')
+                for index in range(VARIANTS)
+            ]
+            for language in languages
+        }
+    
+    def template(self, files: int) -> str:
+        """
+        Build the template tree for a size, if it does not exist yet.
+        
+        Args:
+            files: Number of files in the tree
+        
+        Returns:
+            Path of the template tree
+        """
+        path = os.path.join(self.root, f'template-{files}')
+        if os.path.isdir(path):
+            return path
+        building = path + '.building'
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        for index in range(files):
+            language = self.languages[index % len(self.languages)]
+            directory = building
+            rest = index // len(self.languages)
+            for _ in range(self.depth):
+                directory = os.path.join(directory, f'd{rest % self.fanout}')
+                rest //= self.fanout
+            os.makedirs(directory, exist_ok=True)
+            variants = self.contents[language]
+            with open(os.path.join(directory, f'f{index}{EXTENSIONS[language]}'), 'wb') as f:
+                f.write(variants[index % len(variants)])
+        os.rename(building, path)
+        return path
+    
+    def scratch(self, files: int) -> str:
+        """
+        Make a fresh copy of the template tree for a size.
+        
+        Args:
+            files: Number of files in the tree
+        
+        Returns:
+            Path of the copy
+        """
+        path = os.path.join(self.root, f'run-{files}')
+        shutil.rmtree(path, ignore_errors=True)
+        shutil.copytree(self.template(files), path)
+        return path
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """
+    Get a percentile by the nearest-rank method.
+    
+    Args:
+        values: Measurements
+        fraction: Percentile as a fraction, e.g. 0.99
+    
+    Returns:
+        The percentile, or None for no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def time_snippet(code: str, repeat: int) -> float:
+    """
+    Time a snippet in fresh interpreters.
+    
+    Args:
+        code: Python code to run with -c
+        repeat: Number of runs
+    
+    Returns:
+        Median wall time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def startup_breakdown(repeat: int) -> Dict[str, float]:
+    """
+    Measure interpreter start, module import and CommentRemover construction.
+    
+    Args:
+        repeat: Runs per step
+    
+    Returns:
+        Seconds per step, each excluding the steps before it
+    """
+    breakdown = {}
+    previous = 0.0
+    for name, code in STARTUP_STEPS:
+        total = time_snippet(code.format(dir=CCP_DIR), repeat)
+        breakdown[name] = max(total - previous, 0.0)
+        previous = total
+    return breakdown
+
+
+def measure_discovery(tree: str) -> Dict[str, float]:
+    """
+    Time file discovery in a tree the way the CLI does it.
+    
+    Args:
+        tree: Root of the tree
+    
+    Returns:
+        Number of files found and seconds spent finding them
+    """
+    output = subprocess.run([sys.executable, '-c', DISCOVERY_SNIPPET.format(dir=CCP_DIR)],
+                            cwd=tree, check=True, capture_output=True, text=True).stdout
+    count, seconds = output.split()
+    return {'files': int(count), 'seconds': float(seconds)}
+
+
+def run_cli(tree: str, threads: int, options: List[str]) -> Dict[str, Any]:
+    """
+    Run the CLI over a whole tree.
+    
+    Args:
+        tree: Root of the tree, cleaned in place
+        threads: Value for --threads
+        options: Further command line options
+    
+    Returns:
+        Wall time, exit status and the per-file records of the run
+    """
+    command = [sys.executable, CCP, '*', '--recursive', '--quiet', '--format', 'ndjson',
+               '--threads', str(threads)] + options
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=tree, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    records = []
+    summary = {}
+    for line in completed.stdout.splitlines():
+        message = json.loads(line)
+        if message.get('type') == 'file':
+            records.append(message)
+        elif message.get('type') == 'summary':
+            summary = message
+    return {'wall': wall, 'returncode': completed.returncode, 'records': records, 'summary': summary}
+
+
+def parse_option_sets(values: Optional[List[str]]) -> Dict[str, List[str]]:
+    """
+    Parse --option-set values of the form NAME=OPTIONS.
+    
+    Args:
+        values: Raw values
+    
+    Returns:
+        Option lists by name
+    """
+    if not values:
+        return {'backup': [], 'no-backup': ['--no-backup']}
+    sets = {}
+    for value in values:
+        name, _, options = value.partition('=')
+        sets[name] = options.split()
+    return sets
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run every combination of tree size, thread count and option set.
+    
+    Args:
+        args: Parsed arguments
+    
+    Returns:
+        Results document
+    """
+    languages = args.languages or list(EXTENSIONS)
+    unknown = [language for language in languages if language not in SYNTAX or language not in EXTENSIONS]
+    if unknown:
+        raise SystemExit(f"Unsupported languages: {', '.join(unknown)}")
+    option_sets = parse_option_sets(args.option_set)
+    
+    root = args.workdir or tempfile.mkdtemp(prefix='ccp-bench-')
+    os.makedirs(root, exist_ok=True)
+    builder = TreeBuilder(root, languages, args.file_size, args.depth, args.fanout, args.seed)
+    
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr)
+    
+    try:
+        startup = startup_breakdown(args.repeat)
+        log("start-up: " + ', '.join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in startup.items()))
+        
+        # Cold start: the whole CLI on a one-file tree
+        cold = []
+        for _ in range(args.repeat):
+            cold.append(run_cli(builder.scratch(1), 1, ['--no-backup'])['wall'])
+        cold_start = statistics.median(cold)
+        log(f"cold start: {cold_start * 1000:.1f} ms")
+        
+        results = []
+        for files in args.files:
+            log(f"building a tree of {files} files")
+            template = builder.template(files)
+            total_bytes = sum(entry.stat().st_size for entry in _walk(template))
+            discovery = measure_discovery(template)
+            log(f"  discovery: {discovery['files']} files in {discovery['seconds'] * 1000:.1f} ms")
+            
+            for name, options in option_sets.items():
+                single_rate = None
+                for threads in args.threads:
+                    walls = []
+                    run = None
+                    for _ in range(args.repeat if files <= args.repeat_limit else 1):
+                        tree = builder.scratch(files)
+                        run = run_cli(tree, threads, options)
+                        walls.append(run['wall'])
+                    wall = statistics.median(walls)
+                    latencies = [record['seconds'] for record in run['records'] if 'seconds' in record]
+                    files_per_second = files / wall if wall > 0 else None
+                    if threads == 1:
+                        single_rate = files_per_second
+                    efficiency = None
+                    if single_rate and files_per_second:
+                        efficiency = files_per_second / (single_rate * threads)
+                    
+                    fixed = sum(startup.values()) + discovery['seconds']
+                    result = {
+                        'files': files,
+                        'bytes': total_bytes,
+                        'optionSet': name,
+                        'options': options,
+                        'threads': threads,
+                        'seconds': wall,
+                        'returncode': run['returncode'],
+                        'filesPerSecond': files_per_second,
+                        'bytesPerSecond': total_bytes / wall if wall > 0 else None,
+                        'p50FileSeconds': percentile(latencies, 0.50),
+                        'p99FileSeconds': percentile(latencies, 0.99),
+                        'scalingEfficiency': efficiency,
+                        'phases': {
+                            **startup,
+                            'discovery': discovery['seconds'],
+                            'batch': max(wall - fixed, 0.0),
+                        },
+                    }
+                    results.append(result)
+                    log(_format_result(result))
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    return {
+        'version': 1,
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'languages': languages,
+            'fileSize': args.file_size,
+            'depth': args.depth,
+            'fanout': args.fanout,
+            'seed': args.seed,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'startup': startup,
+        'coldStartSeconds': cold_start,
+        'results': results,
+    }
+
+
+def _walk(path: str):
+    """
+    Yield the directory entries of every file under a directory.
+    
+    Args:
+        path: Directory to walk
+    
+    Yields:
+        os.DirEntry objects of files
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path)
+            else:
+                yield entry
+
+
+def _format_result(result: Dict[str, Any]) -> str:
+    """
+    Format one result as a progress line.
+    
+    Args:
+        result: Result from run_benchmarks
+    
+    Returns:
+        Human-readable summary
+    """
+    phases = result['phases']
+    wall = result['seconds'] or 1
+    breakdown = ', '.join(f"{name} {seconds / wall * 100:.0f}%" for name, seconds in phases.items())
+    efficiency = result['scalingEfficiency']
+    return (f"  {result['files']} files, {result['optionSet']}, {result['threads']} threads: "
+            f"{result['seconds']:.2f} s, {result['filesPerSecond']:.0f} files/s, "
+            f"{result['bytesPerSecond'] / 1e6:.2f} MB/s, "
+            f"p50 {(result['p50FileSeconds'] or 0) * 1000:.2f} ms, "
+            f"p99 {(result['p99FileSeconds'] or 0) * 1000:.2f} ms"
+            + (f", efficiency {efficiency * 100:.0f}%" if efficiency is not None else '')
+            + f" [{breakdown}]")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse command line arguments.
+    
+    Args:
+        argv: Arguments to parse (default: sys.argv[1:])
+    
+    Returns:
+        Parsed arguments object
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the ccp.py command line end to end.')
+    parser.add_argument('--files', nargs='+', type=int, default=[10, 1000, 10000],
+                        help='Numbers of files per tree (10 to 500000)')
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4],
+                        help='Values for --threads; include 1 to get scaling efficiency')
+    parser.add_argument('--option-set', action='append', metavar='NAME=OPTIONS',
+                        help="Named set of CLI options, e.g. 'process=--executor process' "
+                             "(can be repeated; default: backup and no-backup)")
+    parser.add_argument('--languages', nargs='+', metavar='LANGUAGE',
+                        help='Languages of the generated files (default: all)')
+    parser.add_argument('--file-size', type=int, default=4096, help='Approximate size of each file in characters')
+    parser.add_argument('--depth', type=int, default=3, help='Directory levels in each tree')
+    parser.add_argument('--fanout', type=int, default=8, help='Subdirectories per directory')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement on small trees')
+    parser.add_argument('--repeat-limit', type=int, default=1000,
+                        help='Trees with more files than this are run once per measurement')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated contents')
+    parser.add_argument('--workdir', metavar='DIR',
+                        help='Directory for the trees; kept, so templates are reused by later runs')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    parser.add_argument('--output', metavar='FILE', help='Write the results as JSON to FILE (default: stdout)')
+    parser.add_argument('--quiet', action='store_true', help='Do not print progress')
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main entry point for command line execution."""
+    args = parse_args()
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
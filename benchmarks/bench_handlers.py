@@ -0,0 +1,536 @@
+"""
+Handler throughput benchmarks for Comment Cleaner Pro.
+
+Generates seeded synthetic sources for every language CommentRemover
+handles, varying size, comment density, string density, line length and
+preservation-pattern load, and measures each handler's throughput, time
+per file and peak memory. Results are written as JSON, and a compare mode
+flags regressions against a stored baseline.
+
+Usage:
+    python benchmarks/bench_handlers.py run --output results.json
+    python benchmarks/bench_handlers.py run --baseline baseline.json
+    python benchmarks/bench_handlers.py compare baseline.json results.json
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import statistics
+import tracemalloc
+from itertools import product
+from typing import Dict, List, Tuple, Optional, Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python'))
+
+import ccp  # noqa: E402
+
+
+class Syntax:
+    """
+    Enough of a language's syntax to generate valid-looking source code.
+    
+    Block and doc comments are written on lines of their own, so that
+    delimiters that must start a line (Ruby's =begin, MATLAB's %{) work.
+    """
+    
+    def __init__(self, statement: str, line: Optional[str] = None,
+                 block: Optional[Tuple[str, str]] = None,
+                 doc: Optional[Tuple[str, Optional[str]]] = None, quote: str = '"'):
+        """
+        Initialize the syntax.
+        
+        Args:
+            statement: Format of a statement with {n} (a counter) and {s} (a
+                string literal, or a number when no string is wanted)
+            line: Line comment delimiter
+            block: Block comment delimiters
+            doc: Doc comment delimiters; the end is None for line doc comments
+            quote: String literal delimiter
+        """
+        self.statement = statement
+        self.line = line
+        self.block = block
+        self.doc = doc
+        self.quote = quote
+
+
+C_BLOCK = ('/*', '*/')
+JAVADOC = ('/**', '*/')
+
+SYNTAX = {
+    'python': Syntax('x{n} = {s}', line='#', doc=('"""', '"""')),
+    'html': Syntax('<p title={s}>item {n}</p>', block=('<!--', '-->')),
+    'javascript': Syntax('const x{n} = {s};', line='//', block=C_BLOCK, doc=JAVADOC),
+    'typescript': Syntax('const x{n}: unknown = {s};', line='//', block=C_BLOCK, doc=JAVADOC),
+    'c': Syntax('const char *x{n} = {s};', line='//', block=C_BLOCK),
+    'cpp': Syntax('auto x{n} = {s};', line='//', block=C_BLOCK),
+    'java': Syntax('Object x{n} = {s};', line='//', block=C_BLOCK, doc=JAVADOC),
+    'css': Syntax('.c{n} {{ content: {s}; }}', block=C_BLOCK),
+    'go': Syntax('var x{n} = {s}', line='//', block=C_BLOCK),
+    'swift': Syntax('let x{n} = {s}', line='//', block=C_BLOCK, doc=JAVADOC),
+    'rust': Syntax('let x{n} = {s};', line='//', block=C_BLOCK, doc=('///', None)),
+    'kotlin': Syntax('val x{n} = {s}', line='//', block=C_BLOCK, doc=JAVADOC),
+    'dart': Syntax('var x{n} = {s};', line='//', block=C_BLOCK, doc=('///', None)),
+    'bash': Syntax('x{n}={s}', line='#'),
+    'yaml': Syntax('key{n}: {s}', line='#'),
+    'r': Syntax('x{n} <- {s}', line='#'),
+    'powershell': Syntax('$x{n} = {s}', line='#', block=('<#', '#>')),
+    'lua': Syntax('local x{n} = {s}', line='--', block=('--[[', ']]')),
+    'perl': Syntax('my $x{n} = {s};', line='#', block=('=begin', '=cut')),
+    'ruby': Syntax('x{n} = {s}', line='#', block=('=begin', '=end')),
+    'php': Syntax('$x{n} = {s};', line='//', block=C_BLOCK, doc=JAVADOC),
+    'sql': Syntax('SELECT {s} AS c{n};', line='--', block=C_BLOCK, quote="'"),
+    'haskell': Syntax('x{n} = {s}', line='--', block=('{-', '-}')),
+    'matlab': Syntax('x{n} = {s};', line='%', block=('%{', '%}')),
+    'csharp': Syntax('var x{n} = {s};', line='//', block=C_BLOCK, doc=('///', None)),
+}
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'value', 'index', 'result', 'buffer', 'count',
+         'state', 'config', 'handler', 'request', 'token', 'cache', 'retry')
+
+# Comments matched by the generated preservation patterns, and the pattern shapes
+MARKERS = ('TODO', 'FIXME', 'NOTE', 'HACK', 'XXX', 'SAFETY', 'LICENSE', 'KEEP')
+
+
+class CorpusGenerator:
+    """
+    Seeded generator of synthetic source files.
+    
+    The same seed and parameters always give the same file, so runs on
+    different commits measure identical inputs.
+    """
+    
+    def __init__(self, seed: int = 0):
+        """
+        Initialize the generator.
+        
+        Args:
+            seed: Base seed; each file's seed is derived from it and the parameters
+        """
+        self.seed = seed
+    
+    def generate(self, language: str, size: int, comment_density: float,
+                 string_density: float, line_length: int) -> str:
+        """
+        Generate one source file.
+        
+        Args:
+            language: Language key of CommentRemover's handlers
+            size: Approximate size of the file in characters
+            comment_density: Fraction of lines that are comments
+            string_density: Fraction of statements with a string literal; the
+                literals contain comment delimiters, to exercise string handling
+            line_length: Approximate length of each line in characters
+        
+        Returns:
+            The generated source code
+        """
+        syntax = SYNTAX[language]
+        key = f'{self.seed}:{language}:{size}:{comment_density}:{string_density}:{line_length}'
+        rng = random.Random(hashlib.sha256(key.encode('utf-8')).hexdigest())
+        
+        kinds = [kind for kind, delimiter in (('line', syntax.line), ('block', syntax.block),
+                                              ('doc', syntax.doc)) if delimiter]
+        chunks = []
+        total = 0
+        n = 0
+        while total < size:
+            n += 1
+            if rng.random() < comment_density:
+                chunk = self._comment(rng, syntax, rng.choice(kinds), line_length)
+            else:
+                chunk = self._statement(rng, syntax, n, string_density, line_length)
+            chunks.append(chunk)
+            total += len(chunk)
+        return ''.join(chunks)
+    
+    def _words(self, rng: random.Random, length: int) -> str:
+        """
+        Build filler text of about the given length.
+        
+        Args:
+            rng: Random number generator
+            length: Number of characters wanted
+        
+        Returns:
+            Space-separated words
+        """
+        words = []
+        used = 0
+        while used < length:
+            word = rng.choice(WORDS)
+            words.append(word)
+            used += len(word) + 1
+        return ' '.join(words)
+    
+    def _comment(self, rng: random.Random, syntax: Syntax, kind: str, line_length: int) -> str:
+        """
+        Generate a comment of the given kind.
+        
+        Args:
+            rng: Random number generator
+            syntax: Syntax of the language
+            kind: 'line', 'block' or 'doc'
+            line_length: Approximate length of each line
+        
+        Returns:
+            The comment, ending with a newline
+        """
+        text = self._words(rng, max(line_length - 8, 8))
+        if rng.random() < 0.25:
+            text = f'{rng.choice(MARKERS)}: {text}'
+        if kind == 'line':
+            return f'{syntax.line} {text}\n'
+        start, end = syntax.block if kind == 'block' else syntax.doc
+        if end is None:
+            return f'{start} {text}\n'
+        lines = [self._words(rng, max(line_length - 4, 8)) for _ in range(rng.randint(1, 4))]
+        return f'{start}\n' + ''.join(f'  {line}\n' for line in lines) + f'{end}\n'
+    
+    def _statement(self, rng: random.Random, syntax: Syntax, n: int, string_density: float,
+                   line_length: int) -> str:
+        """
+        Generate a statement, with a string literal or a number.
+        
+        Args:
+            rng: Random number generator
+            syntax: Syntax of the language
+            n: Statement counter
+            string_density: Probability of a string literal
+            line_length: Approximate length of the line
+        
+        Returns:
+            The statement, ending with a newline
+        """
+        if rng.random() < string_density:
+            decoy = syntax.line or (syntax.block[0] if syntax.block else '')
+            body = self._words(rng, max(line_length - 24, 4))
+            value = f'{syntax.quote}{body} {decoy} {rng.choice(WORDS)}{syntax.quote}'
+        else:
+            value = str(rng.randint(0, 10 ** 6))
+        return syntax.statement.format(n=n, s=value) + '\n'
+
+
+def preserve_patterns(load: int) -> List[str]:
+    """
+    Build a preservation rule set of the given size.
+    
+    Args:
+        load: Number of regex patterns
+    
+    Returns:
+        Patterns; the first ones match generated markers, the rest do not
+    """
+    patterns = []
+    for index in range(load):
+        marker = MARKERS[index % len(MARKERS)]
+        # Alternate plain markers with patterns that need more matching work
+        patterns.append(marker if index % 2 == 0 else rf'\b{marker}\s*\(\w+\)')
+    return patterns
+
+
+def case_id(case: Dict[str, Any]) -> str:
+    """
+    Build the stable identifier a case is compared by.
+    
+    Args:
+        case: Case parameters
+    
+    Returns:
+        Identifier such as 'python/size=262144/comments=0.1/...'
+    """
+    return (f"{case['language']}/size={case['size']}/comments={case['commentDensity']}"
+            f"/strings={case['stringDensity']}/line={case['lineLength']}"
+            f"/preserve={case['preserveLoad']}/docs={'keep' if case['keepDocComments'] else 'remove'}")
+
+
+def build_cases(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Expand the command line grid into benchmark cases.
+    
+    Args:
+        args: Parsed arguments
+    
+    Returns:
+        List of case parameter dictionaries
+    """
+    languages = args.languages or list(ccp.CommentRemover()._handlers)
+    missing = [language for language in languages if language not in SYNTAX]
+    if missing:
+        raise SystemExit(f"No synthetic syntax for: {', '.join(missing)}")
+    
+    cases = []
+    for language in languages:
+        doc_options = (False, True) if SYNTAX[language].doc else (False,)
+        for size, comments, strings, line, load, keep_docs in product(
+                args.sizes, args.comment_density, args.string_density, args.line_length,
+                args.preserve_load, doc_options):
+            case = {
+                'language': language,
+                'size': size,
+                'commentDensity': comments,
+                'stringDensity': strings,
+                'lineLength': line,
+                'preserveLoad': load,
+                'keepDocComments': keep_docs,
+            }
+            case['id'] = case_id(case)
+            cases.append(case)
+    return cases
+
+
+def measure(remover: ccp.CommentRemover, content: str, case: Dict[str, Any],
+            repeat: int) -> Dict[str, Any]:
+    """
+    Time a handler on one file and measure its peak memory.
+    
+    Args:
+        remover: Remover whose handler is measured
+        content: Source code to clean
+        case: Case parameters
+        repeat: Number of timed runs
+    
+    Returns:
+        Measurements: best and median seconds, MB/s of the best run and
+        peak traced memory in bytes
+    """
+    handler = remover._handlers[case['language']]
+    matcher = ccp.PreservationMatcher.cached(case['preserveLoad'] > 0,
+                                            preserve_patterns(case['preserveLoad']))
+    keep_docs = case['keepDocComments']
+    
+    def run():
+        stats = ccp.CommentStats()
+        handler.remove_comments(content, keep_doc_comments=keep_docs, matcher=matcher, stats=stats)
+        return stats
+    
+    stats = run()  # Warm up caches and compiled patterns
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    
+    # Traced separately: tracemalloc slows allocation down too much to time with it
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    
+    size = len(content.encode('utf-8'))
+    best = min(times)
+    return {
+        'bytes': size,
+        'commentsRemoved': stats.removed,
+        'commentsPreserved': stats.preserved,
+        'seconds': best,
+        'medianSeconds': statistics.median(times),
+        'mbPerSecond': size / best / 1e6 if best > 0 else None,
+        'peakBytes': peak,
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run every case and collect the results.
+    
+    Args:
+        args: Parsed arguments
+    
+    Returns:
+        Results document
+    """
+    remover = ccp.CommentRemover()
+    generator = CorpusGenerator(args.seed)
+    cases = build_cases(args)
+    results = []
+    for index, case in enumerate(cases, 1):
+        content = generator.generate(case['language'], case['size'], case['commentDensity'],
+                                     case['stringDensity'], case['lineLength'])
+        result = dict(case)
+        result.update(measure(remover, content, case, args.repeat))
+        results.append(result)
+        if not args.quiet:
+            print(f"[{index}/{len(cases)}] {case['id']}: {result['mbPerSecond']:.2f} MB/s, "
+                  f"{result['seconds'] * 1000:.2f} ms, peak {result['peakBytes'] / 1024:.0f} KiB",
+                  file=sys.stderr)
+    
+    return {
+        'version': 1,
+        'meta': {
+            'engineVersion': ccp.ResultCache.ENGINE_VERSION,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float,
+            memory_threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare results against a baseline.
+    
+    Args:
+        baseline: Baseline results document
+        current: Current results document
+        threshold: Allowed relative throughput drop, e.g. 0.1 for 10%
+        memory_threshold: Allowed relative peak memory growth
+    
+    Returns:
+        One row per case present in both documents, with the relative
+        changes and whether the case regressed
+    """
+    previous = {result['id']: result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = previous.get(result['id'])
+        if old is None or not old.get('mbPerSecond') or not result.get('mbPerSecond'):
+            continue
+        speed = result['mbPerSecond'] / old['mbPerSecond'] - 1
+        memory = result['peakBytes'] / old['peakBytes'] - 1 if old['peakBytes'] else 0.0
+        rows.append({
+            'id': result['id'],
+            'speedChange': speed,
+            'memoryChange': memory,
+            'regressed': speed < -threshold or memory > memory_threshold,
+        })
+    return rows
+
+
+def report(rows: List[Dict[str, Any]], verbose: bool = False, stream: Any = None) -> int:
+    """
+    Print a comparison and count its regressions.
+    
+    Args:
+        rows: Rows from compare()
+        verbose: Whether to print cases that did not regress
+        stream: Text stream to print to (default: sys.stdout)
+    
+    Returns:
+        Number of regressed cases
+    """
+    stream = stream or sys.stdout
+    regressions = [row for row in rows if row['regressed']]
+    for row in rows if verbose else regressions:
+        flag = 'REGRESSION' if row['regressed'] else 'ok'
+        print(f"{flag:10} {row['id']}: throughput {row['speedChange'] * 100:+.1f}%, "
+              f"peak memory {row['memoryChange'] * 100:+.1f}%", file=stream)
+    if rows:
+        speeds = [row['speedChange'] for row in rows]
+        print(f"{len(rows)} cases compared, {len(regressions)} regressed; "
+              f"median throughput change {statistics.median(speeds) * 100:+.1f}%", file=stream)
+    else:
+        print("No cases in common with the baseline", file=stream)
+    return len(regressions)
+
+
+def load(path: str) -> Dict[str, Any]:
+    """
+    Read a results document.
+    
+    Args:
+        path: Path of the JSON file
+    
+    Returns:
+        The parsed document
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse command line arguments.
+    
+    Args:
+        argv: Arguments to parse (default: sys.argv[1:])
+    
+    Returns:
+        Parsed arguments object
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the comment handlers on synthetic sources.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    run = commands.add_parser('run', help='Run the benchmarks')
+    run.add_argument('--languages', nargs='+', metavar='LANGUAGE',
+                     help='Languages to benchmark (default: every handler)')
+    run.add_argument('--sizes', nargs='+', type=int, default=[16 * 1024, 256 * 1024],
+                     help='File sizes in characters')
+    run.add_argument('--comment-density', nargs='+', type=float, default=[0.1, 0.5],
+                     help='Fractions of lines that are comments')
+    run.add_argument('--string-density', nargs='+', type=float, default=[0.0, 0.3],
+                     help='Fractions of statements with string literals')
+    run.add_argument('--line-length', nargs='+', type=int, default=[80],
+                     help='Line lengths in characters')
+    run.add_argument('--preserve-load', nargs='+', type=int, default=[0, 8],
+                     help='Numbers of preservation patterns (0 disables TODO preservation too)')
+    run.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    run.add_argument('--seed', type=int, default=0, help='Seed for the synthetic corpus')
+    run.add_argument('--output', metavar='FILE', help='Write the results as JSON to FILE (default: stdout)')
+    run.add_argument('--baseline', metavar='FILE', help='Compare the results against this baseline')
+    run.add_argument('--threshold', type=float, default=0.10,
+                     help='Throughput drop that counts as a regression (default: 0.10)')
+    run.add_argument('--memory-threshold', type=float, default=0.20,
+                     help='Peak memory growth that counts as a regression (default: 0.20)')
+    run.add_argument('--quiet', action='store_true', help='Do not print progress')
+    
+    cmp = commands.add_parser('compare', help='Compare two results files')
+    cmp.add_argument('baseline', help='Baseline results')
+    cmp.add_argument('current', help='Results to check')
+    cmp.add_argument('--threshold', type=float, default=0.10,
+                     help='Throughput drop that counts as a regression (default: 0.10)')
+    cmp.add_argument('--memory-threshold', type=float, default=0.20,
+                     help='Peak memory growth that counts as a regression (default: 0.20)')
+    cmp.add_argument('--verbose', action='store_true', help='Also list cases that did not regress')
+    
+    return parser.parse_args(argv)
+
+
+def main():
+    """
+    Main entry point for command line execution.
+    
+    Exits with status 1 if a comparison finds regressions.
+    """
+    args = parse_args()
+    # The handlers log fallbacks; keep them out of the benchmark output
+    ccp.logger.setLevel(ccp.logging.ERROR)
+    
+    if args.command == 'compare':
+        rows = compare(load(args.baseline), load(args.current), args.threshold, args.memory_threshold)
+        sys.exit(1 if report(rows, args.verbose) else 0)
+    
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    
+    if args.baseline:
+        rows = compare(load(args.baseline), results, args.threshold, args.memory_threshold)
+        # Results may be on stdout, so the comparison goes to stderr
+        sys.exit(1 if report(rows, stream=sys.stderr) else 0)
+
+
+if __name__ == "__main__":
+    main()
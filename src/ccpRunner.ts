@@ -2,14 +2,23 @@ import * as cp from 'child_process';
 import * as path from 'path';
 import * as vscode from 'vscode';
 
+type ProgressCallback = (done: number, total: number) => void;
+
+/**
+ * Runs one `ccp.py --format ndjson` process for a list of files. Paths go
+ * to the script NUL-separated on stdin, and results are parsed line by line
+ * as files complete, so nothing but the current line is buffered.
+ */
 export function runCcpScript(
-    filePath: string,
+    filePaths: string[],
     noBackup: boolean,
     force: boolean,
     preserveTodo: boolean = false,
     preservePatterns: any[] = [],
-    keepDocComments: boolean = false
-): Promise<string> {
+    keepDocComments: boolean = false,
+    onRecord?: (record: any) => void,
+    token?: vscode.CancellationToken
+): Promise<any> {
     return new Promise((resolve, reject) => {
         const pythonScriptPath = path.join(__dirname, 'python', 'ccp.py');
 
@@ -21,7 +30,9 @@ export function runCcpScript(
 
         const pythonArgs = [
             pythonScriptPath,
-            filePath,
+            '--files-from', '-',
+            '--null',
+            '--format', 'ndjson',
         ];
 
         if (noBackup) {
@@ -45,33 +56,58 @@ export function runCcpScript(
         }
 
         console.log(`Executing: python ${pythonArgs.join(' ')}`);
-        vscode.window.showInformationMessage(`Running: python with ${pythonScriptPath}`);
 
         const pythonProcess = cp.spawn('python', pythonArgs);
+        if (token) {
+            token.onCancellationRequested(() => pythonProcess.kill());
+        }
+
+        let buffer = '';
+        let summary: any;
 
-        let stdout = '';
-        let stderr = '';
+        pythonProcess.stdout.setEncoding('utf8');
+        pythonProcess.stdout.on('data', (data: string) => {
+            buffer += data;
+            const lines = buffer.split('\n');
+            buffer = lines.pop() || '';
+
+            for (const line of lines) {
+                if (!line.trim()) {
+                    continue;
+                }
 
-        pythonProcess.stdout.on('data', (data) => {
-            stdout += data.toString();
-            console.log(`Python stdout: ${data}`);
+                let message: any;
+                try {
+                    message = JSON.parse(line);
+                } catch (error) {
+                    console.log(`Python sent invalid JSON: ${line}`);
+                    continue;
+                }
+
+                if (message.type === 'summary') {
+                    summary = message;
+                } else if (onRecord) {
+                    onRecord(message);
+                }
+            }
         });
 
         pythonProcess.stderr.on('data', (data) => {
-            stderr += data.toString();
             console.log(`Python stderr: ${data}`);
         });
 
+        pythonProcess.stdin.on('error', (err) => {
+            console.log(`Python input closed: ${err.message}`);
+        });
+        pythonProcess.stdin.end(filePaths.join('\0'));
+
         pythonProcess.on('close', (code) => {
             console.log(`Python process exited with code ${code}`);
 
-            if (code !== 0) {
-                reject(`Python script failed with code ${code}: ${stderr}`);
+            if (code !== 0 && !(token && token.isCancellationRequested)) {
+                reject(`Python script failed with code ${code}`);
             } else {
-                if (!stdout.trim() && !stderr.trim()) {
-                    console.log("Warning: Python script produced no output");
-                }
-                resolve(stdout + '\n' + stderr);
+                resolve(summary);
             }
         });
 
@@ -81,66 +117,270 @@ export function runCcpScript(
     });
 }
 
-export async function executeCcp(
-    filePath: string,
+function toCleanResult(record: any): any {
+    return {
+        fileName: path.basename(record.path),
+        filePath: record.path,
+        success: record.success !== undefined ? record.success : record.status === 'cleaned',
+        commentCount: record.commentCount || 0,
+        linesRemoved: record.linesRemoved || 0,
+        sizeReduction: record.sizeReduction || 0,
+        sizePercentage: record.sizePercentage || 0
+    };
+}
+
+/**
+ * The daemon could not be reached: it failed to start or exited before
+ * answering. Errors it reports for a request are plain strings instead.
+ */
+class CcpTransportError extends Error {}
+
+interface PendingRequest {
+    process: cp.ChildProcessWithoutNullStreams;
+    resolve: (result: any) => void;
+    reject: (error: any) => void;
+    onProgress?: (params: any) => void;
+    cancellation?: vscode.Disposable;
+}
+
+/**
+ * A long-running `ccp.py --serve` process that answers JSON-RPC requests
+ * over stdin/stdout, so interpreter start-up and pattern compilation are
+ * paid once instead of once per file. It is started on first use and
+ * started again if it exits (idle timeout, memory limit or crash).
+ */
+class CcpDaemon {
+    private process: cp.ChildProcessWithoutNullStreams | undefined;
+    private pending = new Map<number, PendingRequest>();
+    private nextId = 1;
+    private buffer = '';
+
+    request(
+        method: string,
+        params: any,
+        onProgress?: (params: any) => void,
+        token?: vscode.CancellationToken
+    ): Promise<any> {
+        return new Promise((resolve, reject) => {
+            try {
+                const proc = this.ensureStarted();
+                const id = this.nextId++;
+                const cancellation = token
+                    ? token.onCancellationRequested(() => this.notify('cancel', { id }))
+                    : undefined;
+                this.pending.set(id, { process: proc, resolve, reject, onProgress, cancellation });
+                proc.stdin.write(JSON.stringify({ jsonrpc: '2.0', id, method, params }) + '\n');
+            } catch (error) {
+                reject(new CcpTransportError(`${error}`));
+            }
+        });
+    }
+
+    notify(method: string, params: any): void {
+        if (this.process) {
+            this.process.stdin.write(JSON.stringify({ jsonrpc: '2.0', method, params }) + '\n');
+        }
+    }
+
+    dispose(): void {
+        if (this.process) {
+            this.notify('shutdown', {});
+            this.process.stdin.end();
+            this.process = undefined;
+        }
+    }
+
+    private ensureStarted(): cp.ChildProcessWithoutNullStreams {
+        if (this.process) {
+            return this.process;
+        }
+
+        const pythonScriptPath = path.join(__dirname, 'python', 'ccp.py');
+        const fs = require('fs');
+        if (!fs.existsSync(pythonScriptPath)) {
+            throw new CcpTransportError(`Python script not found: ${pythonScriptPath}`);
+        }
+
+        const proc = cp.spawn('python', [pythonScriptPath, '--serve']);
+        this.buffer = '';
+        proc.stdout.setEncoding('utf8');
+        proc.stdout.on('data', (data: string) => this.onData(data));
+        proc.stderr.on('data', (data) => {
+            console.log(`CCP daemon: ${data}`);
+        });
+        // Writes after the process has exited fail here; the exit handler
+        // rejects the affected requests
+        proc.stdin.on('error', (err) => {
+            console.log(`CCP daemon input closed: ${err.message}`);
+        });
+        proc.on('exit', (code) => this.onExit(proc, `CCP daemon exited with code ${code}`));
+        proc.on('error', (err) => this.onExit(proc, `Failed to execute Python: ${err.message}`));
+
+        this.process = proc;
+        return proc;
+    }
+
+    private onData(data: string): void {
+        this.buffer += data;
+        const lines = this.buffer.split('\n');
+        this.buffer = lines.pop() || '';
+
+        for (const line of lines) {
+            if (!line.trim()) {
+                continue;
+            }
+
+            let message: any;
+            try {
+                message = JSON.parse(line);
+            } catch (error) {
+                console.log(`CCP daemon sent invalid JSON: ${line}`);
+                continue;
+            }
+
+            if (message.method === 'progress') {
+                const request = this.pending.get(message.params.id);
+                if (request && request.onProgress) {
+                    request.onProgress(message.params);
+                }
+                continue;
+            }
+
+            const request = this.settle(message.id);
+            if (!request) {
+                continue;
+            }
+            if (message.error) {
+                request.reject(message.error.message);
+            } else {
+                request.resolve(message.result);
+            }
+        }
+    }
+
+    private onExit(proc: cp.ChildProcessWithoutNullStreams, reason: string): void {
+        if (this.process === proc) {
+            this.process = undefined;
+        }
+        this.pending.forEach((request, id) => {
+            if (request.process === proc) {
+                this.settle(id);
+                request.reject(new CcpTransportError(reason));
+            }
+        });
+    }
+
+    private settle(id: number): PendingRequest | undefined {
+        const request = this.pending.get(id);
+        if (request) {
+            this.pending.delete(id);
+            if (request.cancellation) {
+                request.cancellation.dispose();
+            }
+        }
+        return request;
+    }
+}
+
+let daemon: CcpDaemon | undefined;
+
+export function stopCcpDaemon(): void {
+    if (daemon) {
+        daemon.dispose();
+        daemon = undefined;
+    }
+}
+
+export async function executeCcpBatch(
+    filePaths: string[],
     noBackup: boolean,
     force: boolean,
     preserveTodo: boolean = false,
     preservePatterns: any[] = [],
-    keepDocComments: boolean = false
-): Promise<any> {
+    keepDocComments: boolean = false,
+    onProgress?: ProgressCallback,
+    token?: vscode.CancellationToken
+): Promise<any[]> {
+    if (!daemon) {
+        daemon = new CcpDaemon();
+    }
+
+    // Records arrive with the progress notifications, so a daemon that dies
+    // part-way leaves only the files without a record to run again
+    const records = new Map<string, any>();
     try {
-        const output = await runCcpScript(
-            filePath,
-            noBackup,
+        await daemon.request('clean', {
+            files: filePaths,
+            backup: !noBackup,
             force,
             preserveTodo,
             preservePatterns,
             keepDocComments
-        );
-        console.log("Python script output:", output);
+        }, (progress) => {
+            if (progress.file) {
+                records.set(progress.file.path, toCleanResult(progress.file));
+            }
+            if (onProgress) {
+                onProgress(progress.done, progress.total);
+            }
+        }, token);
+
+        return Array.from(records.values());
+    } catch (error) {
+        if (!(error instanceof CcpTransportError)) {
+            throw error;
+        }
+        console.log(`CCP daemon unavailable, running the script directly: ${error.message}`);
+    }
 
-        const results = parseCleanResults(output, filePath);
+    const results = Array.from(records.values());
+    const remaining = filePaths.filter((filePath) => !records.has(filePath));
+    if (remaining.length === 0 || (token && token.isCancellationRequested)) {
         return results;
+    }
+    try {
+        await runCcpScript(
+            remaining,
+            noBackup,
+            force,
+            preserveTodo,
+            preservePatterns,
+            keepDocComments,
+            (record) => {
+                results.push(toCleanResult(record));
+                if (onProgress) {
+                    onProgress(results.length, filePaths.length);
+                }
+            },
+            token
+        );
     } catch (error) {
         vscode.window.showErrorMessage(`Failed to run CCP: ${error}`);
-        throw error;
+        if (results.length === 0) {
+            throw error;
+        }
     }
+    return results;
 }
 
-function parseCleanResults(output: string, filePath: string): any {
-    const results: any = {
-        fileName: path.basename(filePath),
-        filePath: filePath,
-        commentCount: 0,
-        linesRemoved: 0,
-        sizeReduction: 0,
-        sizePercentage: 0
-    };
-
-    console.log("Raw Python output to parse:", output);
-
-    const commentMatch = output.match(/Removed\s+approximately\s+(\d+)\s+comments?\s*\((\d+)\s+lines?\)/i) ||
-                       output.match(/Removed.*?(\d+).*?comment.*?\((\d+).*?line/i);
-
-    const sizeMatch = output.match(/File\s+size\s+reduced\s+by\s+(\d+)\s+bytes\s+\(([0-9.]+)%\)/i) ||
-                    output.match(/reduced.*?by\s+(\d+)\s+bytes.*?\(([0-9.]+)%\)/i);
-
-    if (commentMatch) {
-        results.commentCount = parseInt(commentMatch[1]);
-        results.linesRemoved = parseInt(commentMatch[2]);
-        console.log("Matched comments:", results.commentCount, "lines:", results.linesRemoved);
-    } else {
-        console.log("Failed to match comment pattern in output");
-    }
-
-    if (sizeMatch) {
-        results.sizeReduction = parseInt(sizeMatch[1]);
-        results.sizePercentage = parseFloat(sizeMatch[2]);
-        console.log("Matched size:", results.sizeReduction, "percentage:", results.sizePercentage);
-    } else {
-        console.log("Failed to match size pattern in output");
+export async function executeCcp(
+    filePath: string,
+    noBackup: boolean,
+    force: boolean,
+    preserveTodo: boolean = false,
+    preservePatterns: any[] = [],
+    keepDocComments: boolean = false
+): Promise<any> {
+    const results = await executeCcpBatch(
+        [filePath],
+        noBackup,
+        force,
+        preserveTodo,
+        preservePatterns,
+        keepDocComments
+    );
+    if (results.length === 0) {
+        throw new Error(`Failed to process ${filePath}`);
     }
-
-    return results;
-}
\ No newline at end of file
+    return results[0];
+}
@@ -1,5 +1,5 @@
 import * as vscode from 'vscode';
-import { executeCcp } from './ccpRunner';
+import { executeCcp, stopCcpDaemon } from './ccpRunner';
 import { selectAndProcessFiles } from './fileSelector';
 import { FilesViewProvider, HistoryViewProvider } from './ccpViewProvider';
 import { ButtonsViewProvider } from './ccpWebviewProvider';
@@ -255,4 +255,6 @@ async function fileExists(path: string): Promise<boolean> {
     }
 }
 
-export function deactivate() {}
\ No newline at end of file
+export function deactivate() {
+    stopCcpDaemon();
+}
\ No newline at end of file
@@ -1,5 +1,5 @@
 import * as vscode from 'vscode';
-import { executeCcp } from './ccpRunner';
+import { executeCcpBatch } from './ccpRunner';
 
 interface CCPOptions {
     createBackup: boolean;
@@ -83,40 +83,32 @@ async function processFilesWithSettings(
         title: `Removing comments from ${files.length} files`,
         cancellable: true
     }, async (progress, token) => {
-        let processed = 0;
-        
-        for (const file of files) {
-            if (token.isCancellationRequested) {
-                break;
-            }
-
-            try {
-                const result = await executeCcp(
-                    file.fsPath,
-                    noBackup,
-                    forceProcess,
-                    preserveTodo,
-                    preservePatterns,
-                    keepDocComments
-                );
-
-                allResults.push(result); // Store in our outer scope array
-
-                if (historyProvider) {
-                    historyProvider.addToHistory(file.fsPath);
-                }
-
-                processed++;
+        // One request for all files, answered by the long-running CCP process
+        const results = await executeCcpBatch(
+            files.map(file => file.fsPath),
+            noBackup,
+            forceProcess,
+            preserveTodo,
+            preservePatterns,
+            keepDocComments,
+            (processed, total) => {
                 progress.report({
-                    increment: 100 / files.length,
-                    message: `${processed}/${files.length} files processed`
+                    increment: 100 / total,
+                    message: `${processed}/${total} files processed`
                 });
-            } catch (error) {
-                console.error(`Error processing ${file.fsPath}:`, error);
+            },
+            token
+        );
+
+        for (const result of results) {
+            allResults.push(result); // Store in our outer scope array
+
+            if (historyProvider) {
+                historyProvider.addToHistory(result.filePath);
             }
         }
 
-        return processed;
+        return results.length;
     });
 
     // Calculate total comments removed using our allResults array
@@ -7,17 +7,44 @@ Useful for preparing code for deployment, reducing file sizes, or cleaning up co
 
 import os
 import re
+import mmap
+import codecs
+import cProfile
+import filecmp
+import gzip
+import hashlib
+import io
 import sys
-import glob
 import shutil
 import logging
+import pstats
 import argparse
 import concurrent.futures
 import json
+import multiprocessing
+import queue
+import threading
+import tempfile
+import time
 import tokenize
 from abc import ABC, abstractmethod
-from typing import Dict, List, Tuple, Optional, Any, Set, Pattern
-from io import BytesIO
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional, Any, Set, Pattern, Callable
+
+try:
+    import psutil
+except ImportError:  # Optional; only used where /proc is not available
+    psutil = None
+
+try:
+    import sqlite3
+except ImportError:  # Python builds without SQLite support
+    sqlite3 = None
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(
@@ -36,7 +63,10 @@ class CommentPattern:
     """
     
     def __init__(self, pattern: str, is_block: bool = False, is_doc: bool = False,
-                 needs_string_protection: bool = False, description: str = ""):
+                 needs_string_protection: bool = False, description: str = "",
+                 start: Optional[str] = None, end: Optional[str] = None,
+                 nested: bool = False, line_start: bool = False,
+                 not_after: Optional[str] = None):
         """
         Initialize a comment pattern.
         
@@ -46,12 +76,59 @@ class CommentPattern:
             is_doc: Whether this is a documentation comment
             needs_string_protection: Whether this pattern needs protection from string contexts
             description: Human-readable description of the pattern
+            start: Literal opening delimiter, used by the table-driven lexer
+            end: Literal closing delimiter for block comments (line comments end at newline)
+            nested: Whether block comments of this kind can nest
+            line_start: Whether the opening delimiter must start a line
+            not_after: Regex character class; the delimiter is ignored when preceded by a match
         """
         self.pattern = pattern
         self.is_block = is_block
         self.is_doc = is_doc
         self.needs_string_protection = needs_string_protection
         self.description = description
+        self.start = start
+        self.end = end
+        self.nested = nested
+        self.line_start = line_start
+        self.not_after = not_after
+
+
+class StringPattern:
+    """
+    Represents a string literal syntax for a specific language.
+    
+    Used by the table-driven lexer so that comment delimiters inside
+    string literals are left untouched.
+    """
+    
+    def __init__(self, start: str, end: Optional[str] = None, escape: Optional[str] = '\\',
+                 doubled: bool = False, not_after: Optional[str] = None,
+                 pattern: Optional[str] = None, max_length: Optional[int] = None,
+                 description: str = ""):
+        """
+        Initialize a string pattern.
+        
+        Args:
+            start: Literal opening delimiter
+            end: Literal closing delimiter (defaults to the opening delimiter)
+            escape: Escape character inside the literal, or None for raw literals
+            doubled: Whether a doubled closing delimiter stands for a literal delimiter
+            not_after: Regex character class; the delimiter is ignored when preceded by a match
+            pattern: Regex without capturing groups for the whole literal, for
+                literals more restricted than start ... end; where it does not
+                match, the opening delimiter is an ordinary character
+            max_length: Length of the longest literal pattern matches
+            description: Human-readable description of the pattern
+        """
+        self.start = start
+        self.end = end if end is not None else start
+        self.escape = escape
+        self.doubled = doubled
+        self.not_after = not_after
+        self.pattern = pattern
+        self.max_length = max_length
+        self.description = description
 
 
 # Centralized pattern registry
@@ -96,40 +173,55 @@ COMMENT_PATTERNS = {
         'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="CSS comment"),
     },
     'sql': {
-        'line': CommentPattern(r'--.*$', description="SQL line comment"),
-        'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="SQL block comment"),
+        'line': CommentPattern(r'--.*$', description="SQL line comment", start='--'),
+        'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="SQL block comment",
+                              start='/*', end='*/'),
     },
     'bash': {
         'line': CommentPattern(r'#.*$', description="Bash line comment"),
     },
     'powershell': {
-        'line': CommentPattern(r'#.*$', description="PowerShell line comment"),
-        'block': CommentPattern(r'<#[\s\S]*?#>', is_block=True, description="PowerShell block comment"),
+        'line': CommentPattern(r'#.*$', description="PowerShell line comment", start='#'),
+        'block': CommentPattern(r'<#[\s\S]*?#>', is_block=True, description="PowerShell block comment",
+                              start='<#', end='#>'),
     },
     'lua': {
-        'line': CommentPattern(r'--.*$', description="Lua line comment"),
-        'block': CommentPattern(r'--\[\[[\s\S]*?]]', is_block=True, description="Lua block comment"),
+        'line': CommentPattern(r'--.*$', description="Lua line comment", start='--'),
+        'block': CommentPattern(r'--\[\[[\s\S]*?]]', is_block=True, description="Lua block comment",
+                              start='--[[', end=']]'),
     },
     'haskell': {
-        'line': CommentPattern(r'--.*$', description="Haskell line comment"),
-        'block': CommentPattern(r'\{-[\s\S]*?-\}', is_block=True, description="Haskell block comment"),
+        'line': CommentPattern(r'--.*$', description="Haskell line comment", start='--'),
+        'block': CommentPattern(r'\{-[\s\S]*?-\}', is_block=True, description="Haskell block comment",
+                              start='{-', end='-}', nested=True),
     },
     'ruby': {
-        'line': CommentPattern(r'#.*$', description="Ruby line comment"),
-        'block': CommentPattern(r'=begin[\s\S]*?=end', is_block=True, description="Ruby block comment"),
+        'line': CommentPattern(r'#.*$', description="Ruby line comment", start='#'),
+        'block': CommentPattern(r'=begin[\s\S]*?=end', is_block=True, description="Ruby block comment",
+                              start='=begin', end='=end', line_start=True),
     },
     'perl': {
-        'line': CommentPattern(r'#.*$', description="Perl line comment"),
-        'block': CommentPattern(r'=begin[\s\S]*?=cut', is_block=True, description="Perl block comment"),
+        'line': CommentPattern(r'#.*$', description="Perl line comment", start='#', not_after=r'[$]'),
+        'block': CommentPattern(r'=begin[\s\S]*?=cut', is_block=True, description="Perl block comment",
+                              start='=begin', end='=cut', line_start=True),
+    },
+    'php': {
+        'line': CommentPattern(r'//.*$', description="PHP line comment", start='//'),
+        'hash_line': CommentPattern(r'#.*$', description="PHP shell-style line comment", start='#'),
+        'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="PHP block comment",
+                              start='/*', end='*/'),
     },
     'matlab': {
-        'line': CommentPattern(r'%.*$', description="MATLAB line comment"),
-        'block': CommentPattern(r'%\{[\s\S]*?%\}', is_block=True, description="MATLAB block comment"),
+        'line': CommentPattern(r'%.*$', description="MATLAB line comment", start='%'),
+        'block': CommentPattern(r'%\{[\s\S]*?%\}', is_block=True, description="MATLAB block comment",
+                              start='%{', end='%}'),
     },
     'csharp': {
-        'line': CommentPattern(r'//.*$', description="C# line comment"),
-        'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="C# block comment"),
-        'doc': CommentPattern(r'///.*$', is_doc=True, description="C# XML documentation comment"),
+        'line': CommentPattern(r'//.*$', description="C# line comment", start='//'),
+        'block': CommentPattern(r'/\*[\s\S]*?\*/', is_block=True, description="C# block comment",
+                              start='/*', end='*/'),
+        'doc': CommentPattern(r'///.*$', is_doc=True, description="C# XML documentation comment",
+                            start='///'),
     },
     'go': {
         'line': CommentPattern(r'//.*$', description="Go line comment"),
@@ -166,1421 +258,4821 @@ COMMENT_PATTERNS = {
 }
 
 
-class CommentHandler(ABC):
+# String literal syntax for languages handled by the table-driven lexer
+STRING_PATTERNS = {
+    'sql': [
+        StringPattern("'", escape=None, doubled=True, description="SQL string literal"),
+        StringPattern('"', escape=None, doubled=True, description="SQL quoted identifier"),
+    ],
+    'powershell': [
+        StringPattern("@'", "'@", escape=None, description="PowerShell verbatim here-string"),
+        StringPattern('@"', '"@', escape=None, description="PowerShell expandable here-string"),
+        StringPattern("'", escape=None, doubled=True, description="PowerShell verbatim string"),
+        StringPattern('"', escape='`', doubled=True, description="PowerShell expandable string"),
+    ],
+    'lua': [
+        StringPattern('[[', ']]', escape=None, description="Lua long string"),
+        StringPattern("'", description="Lua single-quoted string"),
+        StringPattern('"', description="Lua double-quoted string"),
+    ],
+    'haskell': [
+        StringPattern('"', description="Haskell string literal"),
+        # Primes in names such as foldl' or a' are not character literals
+        StringPattern("'", not_after=r"[\w']", pattern=r"'(?:\\.|[^'\\\n])'", max_length=4,
+                      description="Haskell character literal"),
+    ],
+    'ruby': [
+        StringPattern("'", description="Ruby single-quoted string"),
+        StringPattern('"', description="Ruby double-quoted string"),
+    ],
+    'perl': [
+        StringPattern("'", description="Perl single-quoted string"),
+        StringPattern('"', description="Perl double-quoted string"),
+    ],
+    'matlab': [
+        StringPattern("'", escape=None, doubled=True, not_after=r"[\w)\]}.']",
+                      description="MATLAB character vector (not a transpose)"),
+        StringPattern('"', escape=None, doubled=True, description="MATLAB string"),
+    ],
+    'php': [
+        StringPattern("'", description="PHP single-quoted string"),
+        StringPattern('"', description="PHP double-quoted string"),
+    ],
+    'csharp': [
+        StringPattern('@$"', '"', escape=None, doubled=True, description="C# verbatim interpolated string"),
+        StringPattern('$@"', '"', escape=None, doubled=True, description="C# verbatim interpolated string"),
+        StringPattern('@"', '"', escape=None, doubled=True, description="C# verbatim string"),
+        StringPattern('"', description="C# string literal"),
+        StringPattern("'", description="C# character literal"),
+    ],
+}
+
+
+class PreservationMatcher:
     """
-    Base abstract class for language-specific comment handlers.
+    Compiled comment preservation rules for a run.
     
-    Provides common functionality while requiring language-specific
-    implementations to define their own removal logic.
+    Combines the TODO/FIXME rule and user patterns into as few regex
+    searches as possible. Patterns are validated once, when the matcher
+    is built, and the same instance is shared by every handler and worker.
     """
     
-    def __init__(self, language_key: str):
+    TODO_PATTERN = r'(?i:\b(?:TODO|FIXME)\b)'
+    
+    # Characters that give a pattern regex meaning; anything else is a plain substring
+    _REGEX_CHARS = set('.^$*+?{}[]\\|()')
+    
+    # Most recently used matchers, bounded because a server builds one per client rule set
+    CACHE_SIZE = 32
+    _cache: 'OrderedDict[Tuple[bool, Tuple[str, ...]], PreservationMatcher]' = OrderedDict()
+    _cache_lock = threading.Lock()
+    
+    def __init__(self, preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None):
         """
-        Initialize the handler with language-specific patterns.
+        Compile the preservation rules.
         
         Args:
-            language_key: Key to look up appropriate patterns from registry
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
         """
-        self.language_key = language_key
-        self.patterns = COMMENT_PATTERNS.get(language_key, {})
+        self.preserve_todo = preserve_todo
+        self.preserve_patterns = list(preserve_patterns or [])
+        self.literals: List[str] = []
+        self.invalid_patterns: List[str] = []
+        
+        regexes = [self.TODO_PATTERN] if preserve_todo else []
+        for pattern in self.preserve_patterns:
+            if not self._REGEX_CHARS.intersection(pattern):
+                self.literals.append(pattern)
+                continue
+            try:
+                re.compile(pattern)
+            except re.error:
+                logger.warning(f"Invalid regex pattern: {pattern}")
+                self.invalid_patterns.append(pattern)
+                continue
+            regexes.append(pattern)
+        
+        self.regexes: List[Pattern] = self._combine(regexes)
+        self.active = bool(self.literals or self.regexes)
     
-    @abstractmethod
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    @staticmethod
+    def _combine(patterns: List[str]) -> List[Pattern]:
         """
-        Remove comments from the content.
+        Compile patterns into a single alternation where possible.
+        
+        Patterns that cannot share an alternation (backreferences, global
+        inline flags, clashing group names) are compiled on their own.
         
         Args:
-            content: Source code content to process
-            keep_doc_comments: Whether to preserve documentation comments
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            patterns: Validated regex patterns
             
         Returns:
-            Processed content with comments removed according to settings
+            List of compiled patterns to search with
         """
-        pass
-
-    def get_patterns(self, include_doc_comments: bool = True) -> List[CommentPattern]:
+        combinable = []
+        separate = []
+        for pattern in patterns:
+            compiled = re.compile(pattern)
+            if compiled.groups or compiled.flags & ~re.UNICODE:
+                separate.append(compiled)
+            else:
+                combinable.append(pattern)
+        
+        if len(combinable) > 1:
+            try:
+                return [re.compile('|'.join('(?:' + p + ')' for p in combinable))] + separate
+            except re.error:
+                pass
+        return [re.compile(p) for p in combinable] + separate
+    
+    @classmethod
+    def cached(cls, preserve_todo: bool = False,
+               preserve_patterns: Optional[List[str]] = None) -> 'PreservationMatcher':
         """
-        Get applicable patterns based on settings.
+        Get a matcher for the given settings, compiling it on first use.
+        
+        The CACHE_SIZE most recently used matchers are kept.
         
         Args:
-            include_doc_comments: Whether to include documentation comment patterns
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
             
         Returns:
-            List of comment patterns to use
+            Shared PreservationMatcher instance
         """
-        if include_doc_comments:
-            return list(self.patterns.values())
-        else:
-            return [p for p in self.patterns.values() if not p.is_doc]
-            
-    def should_preserve_comment(self, comment: str, preserve_todo: bool = False, 
-                          preserve_patterns: Optional[List[str]] = None) -> bool:
+        key = (bool(preserve_todo), tuple(preserve_patterns or ()))
+        with cls._cache_lock:
+            matcher = cls._cache.get(key)
+            if matcher is not None:
+                cls._cache.move_to_end(key)
+                return matcher
+        matcher = cls(preserve_todo, preserve_patterns)
+        with cls._cache_lock:
+            cls._cache[key] = matcher
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return matcher
+    
+    def __bool__(self) -> bool:
+        return self.active
+    
+    def matches(self, comment: str) -> bool:
         """
-        Check if a comment should be preserved based on settings.
+        Check if a comment should be preserved.
         
         Args:
             comment: The comment text to check
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
             
         Returns:
             True if the comment should be preserved, False otherwise
         """
-        # Check for TODO/FIXME comments
-        if preserve_todo and re.search(r'\b(TODO|FIXME)\b', comment, re.IGNORECASE):
-            return True
-            
-        # Check against custom patterns
-        if preserve_patterns:
-            for pattern in preserve_patterns:
-                try:
-                    if re.search(pattern, comment):
-                        return True
-                except re.error:
-                    logger.warning(f"Invalid regex pattern: {pattern}")
-                
+        for literal in self.literals:
+            if literal in comment:
+                return True
+        for regex in self.regexes:
+            if regex.search(comment):
+                return True
         return False
 
 
-class PythonCommentHandler(CommentHandler):
+class ByteViewMatcher:
     """
-    Handler for Python comments using the tokenize module.
+    Preservation rules for comments taken from a Latin-1 view of encoded bytes.
     
-    Specializes in handling Python's unique comment syntax including
-    docstrings and line comments.
+    Comments with non-ASCII characters are decoded with the file's real
+    encoding before matching, so patterns see the same text as they would
+    on the decoded path.
     """
     
-    def __init__(self):
-        """Initialize the Python comment handler."""
-        super().__init__('python')
+    def __init__(self, matcher: PreservationMatcher, encoding: str):
+        """
+        Wrap a matcher for a byte view.
+        
+        Args:
+            matcher: Compiled preservation rules
+            encoding: Real encoding of the bytes behind the view
+        """
+        self.matcher = matcher
+        self.encoding = encoding
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def __bool__(self) -> bool:
+        return bool(self.matcher)
+    
+    def matches(self, comment: str) -> bool:
         """
-        Remove comments from Python code.
+        Check if a comment should be preserved.
         
         Args:
-            content: Python source code to process
-            keep_doc_comments: Whether to preserve docstrings
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            comment: The comment text as seen through the Latin-1 view
             
         Returns:
-            Processed Python code with comments removed according to settings
+            True if the comment should be preserved, False otherwise
         """
-        # First, explicitly remove encoding declarations and shebang lines
-        content = re.sub(r'^#!.*$|^#.*?coding[=:]\s*[-\w.]+.*$', '', content, flags=re.MULTILINE)
-        
-        # Handle docstrings first if needed
-        if not keep_doc_comments:
-            # Use regex for docstrings as tokenize doesn't separate docstrings from strings
-            for pattern_name in ['docstring_double', 'docstring_single']:
-                if pattern_name in self.patterns:
-                    pattern = self.patterns[pattern_name].pattern
-                    
-                    # Find all docstrings and check if any need to be preserved
-                    if preserve_todo or preserve_patterns:
-                        matches = re.finditer(pattern, content)
-                        for match in matches:
-                            match_text = match.group(0)
-                            if self.should_preserve_comment(match_text, preserve_todo, preserve_patterns):
-                                continue  # Skip this docstring, it should be preserved
-                            else:
-                                # Replace only this specific docstring
-                                content = content.replace(match_text, '', 1)
-                    else:
-                        # No preservation needed, remove all docstrings
-                        content = re.sub(pattern, '', content)
-        
-        # For line comments with preservation support, we need a custom approach
-        if preserve_todo or preserve_patterns:
-            # Process each line individually to check for preserved comments
-            lines = content.split('\n')
-            result_lines = []
-            
-            for line in lines:
-                if '#' in line:
-                    # Find the position of the # character (not in a string)
-                    comment_start = line.find('#')
-                    code_part = line[:comment_start]
-                    comment_part = line[comment_start:]
-                    
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result_lines.append(line)  # Keep the whole line with comment
-                    else:
-                        result_lines.append(code_part)  # Keep just the code part
-                else:
-                    result_lines.append(line)
-            
-            content = '\n'.join(result_lines)
-            
-        # Use tokenize for regular line comments if no preservation is needed
-        if not preserve_todo and not preserve_patterns:
-            try:
-                # tokenize requires bytes input
-                source_bytes = content.encode('utf-8')
-                
-                # Create tokens from the source
-                tokens = list(tokenize.tokenize(BytesIO(source_bytes).readline))
-                
-                # Reconstruct content without comments
-                result = []
-                last_token_end = (1, 0)  # Start at line 1, column 0
-                
-                for token in tokens:
-                    token_type = token.type
-                    token_string = token.string
-                    token_start = token.start
-                    token_end = token.end
-                    
-                    # Keep all non-comment tokens
-                    if token_type != tokenize.COMMENT:
-                        # Add whitespace/newlines between tokens
-                        if token_start[0] > last_token_end[0]:
-                            # Add newlines if needed
-                            result.append('\n' * (token_start[0] - last_token_end[0]))
-                            last_token_end = (token_start[0], 0)
-                        elif token_start[1] > last_token_end[1]:
-                            # Add spaces if needed
-                            result.append(' ' * (token_start[1] - last_token_end[1]))
-                        
-                        # Add the token itself
-                        result.append(token_string)
-                        last_token_end = token_end
-                
-                return ''.join(result)
-            except Exception as e:
-                logger.warning(f"Tokenizer failed: {e}. Falling back to regex-based parsing.")
-                # Fall back to regex-based approach
-                content = re.sub(r'#.*$', '', content, flags=re.MULTILINE)
-        
-        return content
+        if not self.matcher:
+            return False
+        if not comment.isascii():
+            comment = comment.encode('latin-1').decode(self.encoding, 'replace')
+        return self.matcher.matches(comment)
 
 
-class HtmlCommentHandler(CommentHandler):
-    """Handler for HTML comments."""
+class CommentStats:
+    """
+    Comment statistics collected by handlers during removal.
     
-    def __init__(self):
-        super().__init__('html')
+    Handlers record every comment they remove or preserve, so the
+    numbers are exact for the language instead of a cross-language estimate.
+    """
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    KINDS = ('line', 'block', 'doc')
+    
+    def __init__(self, encoding: str = 'utf-8'):
         """
-        Remove comments from HTML content.
+        Initialize empty statistics.
         
         Args:
-            content: HTML source code to process
-            keep_doc_comments: Not applicable to HTML, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
-            
-        Returns:
-            Processed HTML code with comments removed according to settings
+            encoding: Encoding of the file, used to report removed sizes in bytes
+        """
+        self.encoding = encoding
+        # ASCII text can be measured without encoding it unless the encoding is wider
+        self._ascii_is_bytes = 'a'.encode(encoding) == b'a'
+        self.removed = 0
+        self.preserved = 0
+        self.by_kind: Dict[str, Dict[str, int]] = {
+            kind: {'count': 0, 'bytes': 0, 'lines': 0} for kind in self.KINDS
+        }
+    
+    def record_removed(self, kind: str, text: str) -> None:
+        """
+        Record a removed comment.
+        
+        Args:
+            kind: Comment kind ('line', 'block' or 'doc')
+            text: The removed comment text
         """
-        if not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            for pattern_name in ['block', 'block_dotall']:
-                if pattern_name in self.patterns:
-                    pattern = self.patterns[pattern_name].pattern
-                    content = re.sub(pattern, '', content)
+        self.removed += 1
+        entry = self.by_kind[kind]
+        entry['count'] += 1
+        if self._ascii_is_bytes and text.isascii():
+            entry['bytes'] += len(text)
         else:
-            # Need to check each comment
-            for pattern_name in ['block', 'block_dotall']:
-                if pattern_name in self.patterns:
-                    pattern = self.patterns[pattern_name].pattern
-                    matches = re.finditer(pattern, content)
-                    
-                    # We need to process comments from back to front to avoid position shifts
-                    matches = list(matches)
-                    for match in reversed(matches):
-                        comment = match.group(0)
-                        
-                        if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                            # Remove this comment
-                            start, end = match.span()
-                            content = content[:start] + content[end:]
-        
-        return content
-
-
-class CStyleCommentHandler(CommentHandler):
-    """Handler for C-style comments (C, C++, JavaScript, Java, etc.)."""
+            entry['bytes'] += len(text.encode(self.encoding, 'replace'))
+        entry['lines'] += text.count('\n') + 1
     
-    def __init__(self, language_key: str = 'javascript'):
-        super().__init__(language_key)
+    def record_preserved(self) -> None:
+        """Record a comment that was kept because of preservation rules."""
+        self.preserved += 1
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def to_dict(self) -> Dict[str, Any]:
         """
-        Remove comments from C-style code.
+        Convert the statistics to a JSON-friendly dictionary.
         
-        Args:
-            content: Source code to process
-            keep_doc_comments: Whether to preserve documentation comments
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
-            
         Returns:
-            Processed code with comments removed according to settings
+            Dictionary with removed/preserved counts and per-kind breakdown
         """
-        # Handle string literals to prevent removing comments inside strings
-        chunks = []
-        in_string = False
-        string_char = None
-        i = 0
-        
-        while i < len(content):
-            # Check for line comments
-            if content[i:i+2] == '//' and not in_string and 'line' in self.patterns:
-                # Found line comment
-                line_start = i
-                line_end = content.find('\n', i)
-                if line_end == -1:
-                    comment = content[i:]
-                    if self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                        chunks.append(comment)
-                    i = len(content)  # End of content
-                else:
-                    comment = content[i:line_end]
-                    if self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                        chunks.append(comment)
-                        chunks.append('\n')  # Add newline to keep line structure
-                    else:
-                        chunks.append('\n')  # Add newline but skip comment
-                    i = line_end + 1  # Move PAST the newline
-                
-            # Check for block comments
-            elif content[i:i+2] == '/*' and not in_string:
-                # Found block comment
-                if content[i:i+3] == '/**' and keep_doc_comments and 'doc' in self.patterns:
-                    # Preserve doc comment
-                    end = content.find('*/', i + 2)
-                    if end != -1:
-                        chunks.append(content[i:end+2])
-                        i = end + 2
-                    else:
-                        chunks.append(content[i:])
-                        i = len(content)
-                else:
-                    # Check if we need to preserve this block comment
-                    end = content.find('*/', i + 2)
-                    if end != -1:
-                        comment = content[i:end+2]
-                        if self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                            chunks.append(comment)
-                        i = end + 2  # Skip comment and closing tag
-                    else:
-                        # Unterminated comment
-                        comment = content[i:]
-                        if self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                            chunks.append(comment)
-                        i = len(content)
-            
-            # Template literals (backticks) in JavaScript/TypeScript
-            elif content[i] == '`' and self.language_key in ['javascript', 'typescript']:
-                # Handle template literal
-                start = i
-                i += 1
-                # Find the end of the template literal
-                while i < len(content) and content[i] != '`':
-                    # Skip escaped characters
-                    if content[i] == '\\' and i+1 < len(content):
-                        i += 2
-                    else:
-                        i += 1
-                
-                # Include the closing backtick if found
-                if i < len(content):
-                    i += 1
-                    
-                # Add the entire template literal
-                chunks.append(content[start:i])
-                
-            # String handling with better escaped quote support
-            elif content[i] in ['"', "'"] and (i == 0 or content[i-1] != '\\'):
-                string_start = i
-                char = content[i]
-                i += 1
-                
-                # Find the end of the string
-                while i < len(content) and (content[i] != char or content[i-1] == '\\'):
-                    # Handle escaped characters correctly
-                    if content[i] == '\\' and i+1 < len(content):
-                        i += 2  # Skip the escaped character
-                    else:
-                        i += 1
-                        
-                # Add the closing quote if found
-                if i < len(content):
-                    i += 1
-                    
-                # Add the entire string
-                chunks.append(content[string_start:i])
-            else:
-                # Regular code or string content
-                chunks.append(content[i])
-                i += 1
-        
-        return ''.join(chunks)
+        return {
+            'removed': self.removed,
+            'preserved': self.preserved,
+            'byKind': {kind: dict(entry) for kind, entry in self.by_kind.items()},
+        }
 
 
-class SqlCommentHandler(CommentHandler):
-    """Handler for SQL comments."""
+class EditPlan:
+    """
+    Collected edits against a source text, applied in one forward pass.
+    
+    Handlers record (start, end, replacement) spans while scanning and the
+    plan builds the output with a single join, instead of re-slicing the
+    whole content once per removed comment.
+    """
     
     def __init__(self):
-        super().__init__('sql')
+        """Initialize an empty plan."""
+        self.edits: List[Tuple[int, int, str]] = []
+        self._ordered = True
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def __len__(self) -> int:
+        return len(self.edits)
+    
+    def remove(self, start: int, end: int, replacement: str = '') -> None:
         """
-        Remove comments from SQL content.
+        Record that content[start:end] should be replaced.
         
         Args:
-            content: SQL source code to process
-            keep_doc_comments: Not applicable to SQL, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            start: Start index of the span
+            end: End index of the span (exclusive)
+            replacement: Text to put in place of the span
+        """
+        if self.edits and start < self.edits[-1][1]:
+            self._ordered = False
+        self.edits.append((start, end, replacement))
+    
+    def apply(self, content: str, start: int = 0, end: Optional[int] = None) -> str:
+        """
+        Apply the edits to the content.
+        
+        Args:
+            content: The text the spans refer to
+            start: Index where the output starts; spans must not begin before it
+            end: Index where the output ends (default: end of content)
             
         Returns:
-            Processed SQL code with comments removed according to settings
+            content[start:end] with every span replaced
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '--' in line and 'line' in self.patterns:
-                # Find the position of the -- sequence
-                comment_pos = line.find('--')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-            
-        return '\n'.join(result)
-
-
-class HashCommentHandler(CommentHandler):
-    """Handler for languages that use # for line comments."""
-    
-    def __init__(self, language_key: str = 'bash', preserve_shebang: bool = False):
-        super().__init__(language_key)
-        self.preserve_shebang = preserve_shebang
+        if not self.edits:
+            return content if start == 0 and end is None else content[start:end]
+        if not self._ordered:
+            self.edits.sort()
+            self._ordered = True
+        
+        chunks = []
+        kept_from = start
+        for span_start, span_end, replacement in self.edits:
+            chunks.append(content[kept_from:span_start])
+            if replacement:
+                chunks.append(replacement)
+            kept_from = span_end
+        chunks.append(content[kept_from:end])
+        return ''.join(chunks)
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def buffer_slices(self, buffer: memoryview, start: int = 0, end: Optional[int] = None,
+                      encoding: str = 'latin-1') -> List[Any]:
         """
-        Remove comments from code using # for line comments.
+        Express the edited content as slices of an encoded buffer, without copying it.
         
         Args:
-            content: Source code to process
-            keep_doc_comments: Not applicable to # comments, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            buffer: The encoded content, indexed the same way as the scanned text
+            start: Index where the output starts; spans must not begin before it
+            end: Index where the output ends (default: end of buffer)
+            encoding: Encoding used for replacement text
             
         Returns:
-            Processed code with comments removed according to settings
+            Buffer slices and encoded replacements that make up buffer[start:end]
+            with every span replaced, in order
         """
-        result = []
+        if not self._ordered:
+            self.edits.sort()
+            self._ordered = True
+        if end is None:
+            end = len(buffer)
         
-        for line in content.split('\n'):
-            if '#' in line:
-                # Find the position of the comment
-                comment_pos = line.find('#')
-                
-                # Get the code part and comment part
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Optionally preserve shebang lines
-                if self.preserve_shebang and comment_part.strip().startswith('#!'):
-                    result.append(line)
-                # Preserve TODOs and pattern matches if requested
-                elif preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line with comment
-                    else:
-                        result.append(code_part)  # Keep just the code part
-                else:
-                    result.append(code_part)
-            else:
-                result.append(line)
-                
-        return '\n'.join(result)
+        slices = []
+        kept_from = start
+        for span_start, span_end, replacement in self.edits:
+            if span_start > kept_from:
+                slices.append(buffer[kept_from:span_start])
+            if replacement:
+                slices.append(replacement.encode(encoding))
+            kept_from = span_end
+        if kept_from < end:
+            slices.append(buffer[kept_from:end])
+        return slices
 
 
-class LuaCommentHandler(CommentHandler):
-    """Handler for Lua comments."""
+class PostProcessor:
+    """
+    Whitespace clean-up applied to handler output.
     
-    def __init__(self):
-        super().__init__('lua')
+    Strips trailing whitespace from every line and collapses runs of
+    blank lines into one, with a single split and join of the text. It
+    can also be fed the output piece by piece; whitespace at the end of a
+    piece is held back until the next piece shows how the line continues.
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    The text may also be bytes in an encoding where ASCII characters stand
+    for themselves, as long as it has none of the whitespace that
+    wide_whitespace() finds; the result is then the same as for the
+    decoded text.
+    """
+    
+    # After stripping, blank-line runs are plain newline runs
+    _BLANK_RUNS = re.compile(r'\n{3,}')
+    _BLANK_RUNS_UNSTRIPPED = re.compile(r'\n\s*\n\s*\n')
+    _BLANK_RUNS_BYTES = re.compile(rb'\n{3,}')
+    _BLANK_RUNS_UNSTRIPPED_BYTES = re.compile(rb'\n\s*\n\s*\n')
+    _wide_whitespace_cache: Dict[str, Optional[Pattern]] = {}
+    
+    def __init__(self, strip_trailing_whitespace: bool = True, collapse_blank_lines: bool = True):
         """
-        Remove comments from Lua content.
+        Configure the clean-up.
         
         Args:
-            content: Lua source code to process
-            keep_doc_comments: Not applicable to Lua, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            strip_trailing_whitespace: Whether to remove whitespace at the end of lines
+            collapse_blank_lines: Whether to reduce runs of blank lines to a single one
+        """
+        self.strip_trailing_whitespace = strip_trailing_whitespace
+        self.collapse_blank_lines = collapse_blank_lines
+        self.enabled = strip_trailing_whitespace or collapse_blank_lines
+        self._pending = ''
+    
+    def process(self, text: str) -> str:
+        """
+        Clean up a complete text.
+        
+        Args:
+            text: Handler output, as str or bytes
             
         Returns:
-            Processed Lua code with comments removed according to settings
+            Cleaned text, of the same type
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '--' in line and 'line' in self.patterns:
-                # Find the position of the -- sequence
-                comment_pos = line.find('--')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-            
-        return '\n'.join(result)
-
-
-class HaskellCommentHandler(CommentHandler):
-    """Handler for Haskell comments."""
-    
-    def __init__(self):
-        super().__init__('haskell')
+        if isinstance(text, bytes):
+            newline, blank_runs, blank_runs_unstripped = b'\n', self._BLANK_RUNS_BYTES, self._BLANK_RUNS_UNSTRIPPED_BYTES
+        else:
+            newline, blank_runs, blank_runs_unstripped = '\n', self._BLANK_RUNS, self._BLANK_RUNS_UNSTRIPPED
+        if self.strip_trailing_whitespace:
+            text = newline.join(map(type(text).rstrip, text.split(newline)))
+            if self.collapse_blank_lines and newline * 3 in text:
+                text = blank_runs.sub(newline * 2, text)
+        elif self.collapse_blank_lines:
+            text = blank_runs_unstripped.sub(newline * 2, text)
+        return text
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    @classmethod
+    def wide_whitespace(cls, encoding: str) -> Optional[Pattern]:
         """
-        Remove comments from Haskell content.
+        Get a regex for encoded whitespace that bytes.rstrip() does not strip.
         
         Args:
-            content: Haskell source code to process
-            keep_doc_comments: Not applicable to Haskell, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            encoding: An encoding where ASCII characters stand for themselves
             
         Returns:
-            Processed Haskell code with comments removed according to settings
+            Bytes regex, or None if the encoding has no such whitespace
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '--' in line and 'line' in self.patterns:
-                # Find the position of the -- sequence
-                comment_pos = line.find('--')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
+        if encoding not in cls._wide_whitespace_cache:
+            sequences = set()
+            for code in range(0x3001):  # U+3000 is the highest whitespace character
+                char = chr(code)
+                if char.isspace() and char not in ' \t\n\r\x0b\x0c':
+                    try:
+                        sequences.add(char.encode(encoding))
+                    except UnicodeEncodeError:
                         continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-            
-        return '\n'.join(result)
-
-
-class MatlabCommentHandler(CommentHandler):
-    """Handler for MATLAB comments."""
-    
-    def __init__(self):
-        super().__init__('matlab')
+            cls._wide_whitespace_cache[encoding] = re.compile(
+                b'|'.join(re.escape(sequence) for sequence in sorted(sequences))) if sequences else None
+        return cls._wide_whitespace_cache[encoding]
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def feed(self, text: str) -> str:
         """
-        Remove comments from MATLAB content.
+        Clean up the next piece of a text that arrives in pieces.
         
         Args:
-            content: MATLAB source code to process
-            keep_doc_comments: Not applicable to MATLAB, ignored
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            text: Next piece of handler output, as str or bytes
             
         Returns:
-            Processed MATLAB code with comments removed according to settings
+            Cleaned output that is final so far
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '%' in line and 'line' in self.patterns:
-                # Find the position of the % character
-                comment_pos = line.find('%')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-            
-        return '\n'.join(result)
+        if not self.enabled:
+            return text
+        if self._pending:
+            text = self._pending + text
+        body = text.rstrip()
+        self._pending = text[len(body):]
+        return self.process(body)
+    
+    def flush(self) -> str:
+        """
+        Finish a text that was fed in pieces.
+        
+        Returns:
+            Cleaned remainder of the text
+        """
+        pending, self._pending = self._pending, ''
+        return self.process(pending)
 
 
-class PowerShellCommentHandler(CommentHandler):
-    """Handler for PowerShell comments."""
+class CommentHandler(ABC):
+    """
+    Base abstract class for language-specific comment handlers.
     
-    def __init__(self):
-        super().__init__('powershell')
+    Provides common functionality while requiring language-specific
+    implementations to define their own removal logic.
+    """
+    
+    # Whether the handler can clean a file chunk by chunk (see ScanningCommentHandler)
+    supports_streaming = False
+    
+    def __init__(self, language_key: str):
+        """
+        Initialize the handler with language-specific patterns.
+        
+        Args:
+            language_key: Key to look up appropriate patterns from registry
+        """
+        self.language_key = language_key
+        self.patterns = COMMENT_PATTERNS.get(language_key, {})
     
+    @abstractmethod
     def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None,
+                       matcher: Optional[PreservationMatcher] = None,
+                       stats: Optional[CommentStats] = None) -> str:
         """
-        Remove comments from PowerShell content.
+        Remove comments from the content.
         
         Args:
-            content: PowerShell source code to process
-            keep_doc_comments: Not applicable to PowerShell, ignored
+            content: Source code content to process
+            keep_doc_comments: Whether to preserve documentation comments
             preserve_todo: Whether to preserve TODO and FIXME comments
             preserve_patterns: List of regex patterns for comments to preserve
+            matcher: Compiled preservation rules; built from the two settings above if omitted
+            stats: Statistics object that removed and preserved comments are recorded in
             
         Returns:
-            Processed PowerShell code with comments removed according to settings
+            Processed content with comments removed according to settings
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '#' in line and 'line' in self.patterns:
-                # Find the position of the # character
-                comment_pos = line.find('#')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-            
-        return '\n'.join(result)
-
+        pass
 
-class RubyCommentHandler(CommentHandler):
-    """Handler for Ruby comments."""
+    def first_removal(self, content: str, keep_doc_comments: bool,
+                      matcher: PreservationMatcher) -> Optional[Tuple[int, int]]:
+        """
+        Find the first comment that would be removed, without building any output.
+        
+        Args:
+            content: Source code content to check
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+        
+        Returns:
+            (start, end) of the first comment to remove, or None if there is
+            none; the span runs to the end of the line
+        """
+        stats = CommentStats()
+        cleaned = self.remove_comments(content, keep_doc_comments, matcher=matcher, stats=stats)
+        if not stats.removed:
+            return None
+        # The first removal starts where the output first differs from the input
+        start = 0
+        while start < len(cleaned) and content[start] == cleaned[start]:
+            start += 1
+        end = content.find('\n', start)
+        return start, end if end != -1 else len(content)
     
-    def __init__(self):
-        super().__init__('ruby')
+    def get_patterns(self, include_doc_comments: bool = True) -> List[CommentPattern]:
+        """
+        Get applicable patterns based on settings.
+        
+        Args:
+            include_doc_comments: Whether to include documentation comment patterns
+            
+        Returns:
+            List of comment patterns to use
+        """
+        if include_doc_comments:
+            return list(self.patterns.values())
+        else:
+            return [p for p in self.patterns.values() if not p.is_doc]
+            
+    def should_preserve_comment(self, comment: str, preserve_todo: bool = False, 
+                          preserve_patterns: Optional[List[str]] = None) -> bool:
+        """
+        Check if a comment should be preserved based on settings.
+        
+        Args:
+            comment: The comment text to check
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
+            
+        Returns:
+            True if the comment should be preserved, False otherwise
+        """
+        return PreservationMatcher.cached(preserve_todo, preserve_patterns).matches(comment)
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def get_matcher(self, preserve_todo: bool = False,
+                    preserve_patterns: Optional[List[str]] = None,
+                    matcher: Optional[PreservationMatcher] = None) -> PreservationMatcher:
         """
-        Remove comments from Ruby content.
+        Resolve the preservation matcher to use for a call.
         
         Args:
-            content: Ruby source code to process
-            keep_doc_comments: Not applicable to Ruby, ignored
             preserve_todo: Whether to preserve TODO and FIXME comments
             preserve_patterns: List of regex patterns for comments to preserve
+            matcher: Matcher supplied by the caller, if any
             
         Returns:
-            Processed Ruby code with comments removed according to settings
+            The supplied matcher, or a cached one built from the settings
+        """
+        if matcher is not None:
+            return matcher
+        return PreservationMatcher.cached(preserve_todo, preserve_patterns)
+    
+    def keep_comment(self, comment: str, kind: str, matcher: PreservationMatcher,
+                     stats: Optional[CommentStats] = None) -> bool:
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
+        Apply the preservation rules to a comment and record the outcome.
+        
+        Args:
+            comment: The comment text
+            kind: Comment kind to record ('line', 'block' or 'doc')
+            matcher: Compiled preservation rules
+            stats: Statistics object to record the outcome in, if any
             
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments (preserve shebang)
-        result = []
-        for line in content.split('\n'):
-            if '#' in line and 'line' in self.patterns:
-                # Preserve shebang lines (both #! and # ! formats)
-                stripped = line.strip()
-                if stripped.startswith('#!') or stripped.startswith('# !'):
-                    result.append(line)
-                    continue
-                
-                # Find the position of the # character
-                comment_pos = line.find('#')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
+        Returns:
+            True if the comment should be kept, False if it should be removed
+        """
+        if matcher.matches(comment):
+            if stats is not None:
+                stats.record_preserved()
+            return True
+        if stats is not None:
+            stats.record_removed(kind, comment)
+        return False
+    
+    def remove_matches(self, pattern: str, content: str, kind: str,
+                       stats: Optional[CommentStats] = None, flags: int = 0) -> str:
+        """
+        Remove every match of a regex, recording each removal.
+        
+        Args:
+            pattern: Regular expression matching the comments to remove
+            content: Source code content to process
+            kind: Comment kind to record ('line', 'block' or 'doc')
+            stats: Statistics object to record removals in, if any
+            flags: Regex flags
             
-        return '\n'.join(result)
+        Returns:
+            Content with all matches removed
+        """
+        if stats is None:
+            return re.sub(pattern, '', content, flags=flags)
+        
+        def drop(match):
+            stats.record_removed(kind, match.group(0))
+            return ''
+        
+        return re.sub(pattern, drop, content, flags=flags)
 
 
-class PerlCommentHandler(CommentHandler):
-    """Handler for Perl comments."""
+class ScanningCommentHandler(CommentHandler):
+    """
+    Base class for handlers built on a resumable scan.
     
-    def __init__(self):
-        super().__init__('perl')
+    Subclasses implement scan(), which plans the removals for a stretch of
+    text and reports how far it got. Whole files are cleaned with a single
+    scan; large files can be cleaned in chunks, with each scan stopping
+    before any comment or literal that may continue in the next chunk.
+    """
+    
+    supports_streaming = True
+    # Whether scan() gives the same result on a Latin-1 view of UTF-8 bytes
+    byte_view_safe = True
+    # Characters scanned before first_removal() looks at the plan; doubled each round
+    CHECK_WINDOW = 64 * 1024
     
     def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None,
+                       matcher: Optional[PreservationMatcher] = None,
+                       stats: Optional[CommentStats] = None) -> str:
         """
-        Remove comments from Perl content.
+        Remove comments from the content with a single scan.
         
         Args:
-            content: Perl source code to process
-            keep_doc_comments: Not applicable to Perl, ignored
+            content: Source code content to process
+            keep_doc_comments: Whether to preserve documentation comments
             preserve_todo: Whether to preserve TODO and FIXME comments
             preserve_patterns: List of regex patterns for comments to preserve
+            matcher: Compiled preservation rules; built from the two settings above if omitted
+            stats: Statistics object that removed and preserved comments are recorded in
             
         Returns:
-            Processed Perl code with comments removed according to settings
+            Processed content with comments removed according to settings
+        """
+        matcher = self.get_matcher(preserve_todo, preserve_patterns, matcher)
+        plan, _ = self.scan(content, 0, True, keep_doc_comments, matcher, stats)
+        return plan.apply(content)
+    
+    def first_removal(self, content: str, keep_doc_comments: bool,
+                      matcher: PreservationMatcher) -> Optional[Tuple[int, int]]:
+        """
+        Find the first comment that would be removed, scanning a growing prefix.
+        
+        The scan resumes where the previous prefix stopped, so a file with
+        a comment near the top is not scanned to the end.
+        
+        Args:
+            content: Source code content to check
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+        
+        Returns:
+            (start, end) of the first comment to remove, or None if there is none
+        """
+        start = 0
+        window = self.CHECK_WINDOW
+        while True:
+            final = window >= len(content)
+            plan, stop = self.scan(content if final else content[:window], start, final,
+                                   keep_doc_comments, matcher)
+            if plan.edits:
+                first = min(plan.edits)
+                return first[0], first[1]
+            if final:
+                return None
+            start = stop
+            window *= 2
+    
+    @abstractmethod
+    def scan(self, content: str, start: int, final: bool, keep_doc_comments: bool,
+             matcher: PreservationMatcher, stats: Optional[CommentStats] = None) -> Tuple[EditPlan, int]:
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
+        Plan the comment removals for content[start:].
+        
+        Args:
+            content: Text to scan; anything before start is only used as context
+            start: Index to start scanning at
+            final: Whether the content runs to the end of the file. If not, the
+                scan stops before any construct that may continue past the end
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            stats: Statistics object that removed and preserved comments are recorded in
             
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments (preserving shebangs)
-        result = []
-        for line in content.split('\n'):
-            if '#' in line and 'line' in self.patterns:
-                if line.strip().startswith('#!'):
-                    result.append(line)
-                    continue
-                
-                # Find the position of the # character
-                comment_pos = line.find('#')
-                
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
-                
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
-                
-                # Otherwise just keep the code part
-                result.append(code_part)
-            else:
-                result.append(line)
-                
-        return '\n'.join(result)
+        Returns:
+            Tuple of (plan, stop): the removals, and the index up to which the
+            content has been fully scanned
+        """
+        pass
 
 
-class PhpCommentHandler(CommentHandler):
-    """Handler for PHP comments."""
+class PythonCommentHandler(CommentHandler):
+    """
+    Handler for Python comments using the tokenize module.
+    
+    Specializes in handling Python's unique comment syntax including
+    docstrings and line comments.
+    """
     
     def __init__(self):
-        super().__init__('php')
+        """Initialize the Python comment handler."""
+        super().__init__('python')
     
     def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None,
+                       matcher: Optional[PreservationMatcher] = None,
+                       stats: Optional[CommentStats] = None) -> str:
         """
-        Remove comments from PHP content.
+        Remove comments from Python code.
         
         Args:
-            content: PHP source code to process
-            keep_doc_comments: Not applicable to PHP, ignored
+            content: Python source code to process
+            keep_doc_comments: Whether to preserve docstrings
             preserve_todo: Whether to preserve TODO and FIXME comments
             preserve_patterns: List of regex patterns for comments to preserve
+            matcher: Compiled preservation rules; built from the two settings above if omitted
+            stats: Statistics object that removed and preserved comments are recorded in
             
         Returns:
-            Processed PHP code with comments removed according to settings
+            Processed Python code with comments removed according to settings
         """
-        # Handle block comments with preservation
-        if not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(r'/\*[\s\S]*?\*/', '', content)
-        else:
-            # Need to check each block comment
-            block_pattern = r'/\*[\s\S]*?\*/'
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            # Process the line for both // and # comments
-            processed_line = line
-            
-            # First handle // comments
-            if '//' in processed_line:
-                comment_pos = processed_line.find('//')
-                code_part = processed_line[:comment_pos]
-                comment_part = processed_line[comment_pos:]
-                
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        # Keep this comment
-                        pass
-                    else:
-                        processed_line = code_part
+        matcher = self.get_matcher(preserve_todo, preserve_patterns, matcher)
+        
+        try:
+            removals, preserved = self._find_removals(content, keep_doc_comments, matcher)
+        except (tokenize.TokenError, SyntaxError) as e:
+            logger.warning(f"Tokenizer failed: {e}. Falling back to regex-based parsing.")
+            return self._remove_line_comments(content, matcher, stats)
+        
+        plan = EditPlan()
+        for start, end, replacement, kind in removals:
+            plan.remove(start, end, replacement)
+            if stats is not None:
+                stats.record_removed(kind, content[start:end])
+        if stats is not None:
+            for _ in range(preserved):
+                stats.record_preserved()
+        
+        return plan.apply(content)
+    
+    def first_removal(self, content: str, keep_doc_comments: bool,
+                      matcher: PreservationMatcher) -> Optional[Tuple[int, int]]:
+        """
+        Find a comment or docstring that would be removed.
+        
+        Tokenizing stops as soon as a removal is found, so a docstring still
+        waiting for the end of its statement may be passed over for a later
+        comment.
+        
+        Args:
+            content: Python source code to check
+            keep_doc_comments: Whether to preserve docstrings
+            matcher: Compiled preservation rules
+            
+        Returns:
+            (start, end) of a span to remove, or None if there is none
+        """
+        try:
+            removals, _ = self._find_removals(content, keep_doc_comments, matcher, first_only=True)
+        except (tokenize.TokenError, SyntaxError):
+            return super().first_removal(content, keep_doc_comments, matcher)
+        if not removals:
+            return None
+        start, end, _, _ = min(removals)
+        return start, end
+    
+    def _find_removals(self, content: str, keep_doc_comments: bool,
+                       matcher: PreservationMatcher,
+                       first_only: bool = False) -> Tuple[List[Tuple[int, int, str, str]], int]:
+        """
+        Stream the token stream once and collect the spans to remove.
+        
+        Docstrings are recognised from token context: a statement made up
+        only of string literals at the start of a module, class or function
+        body. A docstring that is the whole body is replaced with 'pass'.
+        
+        Args:
+            content: Python source code to scan
+            keep_doc_comments: Whether to preserve docstrings
+            matcher: Compiled preservation rules
+            first_only: Whether to stop at the first token after a removal is found
+            
+        Returns:
+            Tuple of (removals, preserved_count), where removals are
+            (start, end, replacement, kind) tuples with character offsets
+        """
+        removals = []
+        preserved = 0
+        
+        # Character offset of the start of every line handed to the tokenizer
+        line_offsets = []
+        reader = io.StringIO(content)
+        consumed = 0
+        
+        def readline():
+            nonlocal consumed
+            line = reader.readline()
+            line_offsets.append(consumed)
+            consumed += len(line)
+            return line
+        
+        def offset(position):
+            return line_offsets[position[0] - 1] + position[1]
+        
+        expect_doc = True      # Next statement may be a docstring
+        stmt_start = True      # Next significant token starts a statement
+        inline_body = False    # Statement follows a def/class header on the same line
+        header = False         # Inside a def/class header ('async' until 'def' is seen)
+        depth = 0              # Bracket depth within the header
+        candidate = None       # [start, end, one_liner] of a possible docstring
+        finished = None        # Complete docstring waiting to see what follows it
+        
+        for token in tokenize.generate_tokens(readline):
+            if first_only and removals:
+                break
+            token_type = token.type
+            
+            if token_type == tokenize.COMMENT:
+                start = offset(token.start)
+                if matcher.matches(token.string):
+                    preserved += 1
                 else:
-                    processed_line = code_part
+                    removals.append((start, start + len(token.string), '', 'line'))
+                continue
+            if token_type == tokenize.NL:
+                continue
             
-            # Then handle # comments
-            if '#' in processed_line:
-                comment_pos = processed_line.find('#')
-                code_part = processed_line[:comment_pos]
-                comment_part = processed_line[comment_pos:]
-                
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        # Keep this comment
-                        pass
+            if finished is not None:
+                # An emptied body needs a placeholder statement
+                start, end = finished
+                removals.append((start, end, 'pass' if token_type == tokenize.DEDENT else '', 'doc'))
+                finished = None
+            
+            if candidate is not None:
+                if token_type == tokenize.STRING:
+                    candidate[1] = offset(token.end)  # Implicit concatenation
+                    continue
+                start, end, one_liner = candidate
+                candidate = None
+                if token_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                    if matcher.matches(content[start:end]):
+                        preserved += 1
+                    elif one_liner:
+                        removals.append((start, end, 'pass', 'doc'))
+                    elif token_type == tokenize.ENDMARKER:
+                        removals.append((start, end, '', 'doc'))
                     else:
-                        processed_line = code_part
-                else:
-                    processed_line = code_part
+                        finished = (start, end)
+            
+            if token_type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+                stmt_start = True
+                inline_body = False
+                continue
+            
+            if stmt_start:
+                stmt_start = False
+                if expect_doc and token_type == tokenize.STRING and not keep_doc_comments:
+                    candidate = [offset(token.start), offset(token.end), inline_body]
+                    expect_doc = False
+                    continue
+                expect_doc = False
+                header = False
+                if token_type == tokenize.NAME and token.string in ('def', 'class', 'async'):
+                    header = 'async' if token.string == 'async' else True
+                depth = 0
+                continue
             
-            result.append(processed_line)
+            if header == 'async':
+                header = token_type == tokenize.NAME and token.string == 'def'
+            elif header and token_type == tokenize.OP:
+                if token.string in '([{':
+                    depth += 1
+                elif token.string in ')]}':
+                    depth -= 1
+                elif token.string == ':' and depth == 0:
+                    # End of the header: the body starts next, on this line or the next
+                    header = False
+                    expect_doc = True
+                    stmt_start = True
+                    inline_body = True
+        
+        return removals, preserved
+    
+    def _remove_line_comments(self, content: str, matcher: PreservationMatcher,
+                              stats: Optional[CommentStats] = None) -> str:
+        """
+        Regex-based fallback for code the tokenizer cannot handle.
+        
+        Args:
+            content: Python source code to process
+            matcher: Compiled preservation rules
+            stats: Statistics object to record comments in, if any
             
-        return '\n'.join(result)
+        Returns:
+            Content with '#' comments removed
+        """
+        def replace(match):
+            comment = match.group(0)
+            return comment if self.keep_comment(comment, 'line', matcher, stats) else ''
+        
+        return re.sub(r'#.*$', replace, content, flags=re.MULTILINE)
 
 
-class CSharpCommentHandler(CommentHandler):
-    """Handler for C# comments."""
+class HtmlCommentHandler(ScanningCommentHandler):
+    """Handler for HTML comments."""
     
     def __init__(self):
-        super().__init__('csharp')
+        super().__init__('html')
+        self._comment_regex = re.compile(self.patterns['block'].pattern)
     
-    def remove_comments(self, content: str, keep_doc_comments: bool = False,
-                       preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None) -> str:
+    def scan(self, content: str, start: int, final: bool, keep_doc_comments: bool,
+             matcher: PreservationMatcher, stats: Optional[CommentStats] = None) -> Tuple[EditPlan, int]:
         """
-        Remove comments from C# content.
+        Plan the removal of HTML comments.
         
         Args:
-            content: C# source code to process
-            keep_doc_comments: Whether to preserve XML documentation comments
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
+            content: HTML source code to scan
+            start: Index to start scanning at
+            final: Whether the content runs to the end of the file
+            keep_doc_comments: Not applicable to HTML, ignored
+            matcher: Compiled preservation rules
+            stats: Statistics object that removed and preserved comments are recorded in
             
         Returns:
-            Processed C# code with comments removed according to settings
+            Tuple of (plan, stop) as described in ScanningCommentHandler.scan
         """
-        # Handle block comments
-        if 'block' in self.patterns and not preserve_todo and not preserve_patterns:
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['block'].pattern, '', content)
-        elif 'block' in self.patterns:
-            # Need to check each block comment
-            block_pattern = self.patterns['block'].pattern
-            matches = re.finditer(block_pattern, content)
-            
-            # Process from back to front to avoid position shifts
-            matches = list(matches)
-            for match in reversed(matches):
-                comment = match.group(0)
-                
-                if not self.should_preserve_comment(comment, preserve_todo, preserve_patterns):
-                    # Remove this comment
-                    start, end = match.span()
-                    content = content[:start] + content[end:]
-        
-        # Handle XML documentation comments (///)
-        if not keep_doc_comments and 'doc' in self.patterns and not (preserve_todo or preserve_patterns):
-            # Simple case - no preservation needed
-            content = re.sub(self.patterns['doc'].pattern, '', content, flags=re.MULTILINE)
-        elif 'doc' in self.patterns and not keep_doc_comments:
-            # Need to check each doc comment
-            doc_pattern = self.patterns['doc'].pattern
-            result = []
-            
-            for line in content.split('\n'):
-                if line.strip().startswith('///'):
-                    if preserve_todo or preserve_patterns:
-                        if self.should_preserve_comment(line, preserve_todo, preserve_patterns):
-                            result.append(line)  # Keep this doc comment
-                            continue
-                    # Skip this line if it's a doc comment that shouldn't be preserved
-                else:
-                    result.append(line)
+        plan = EditPlan()
+        pos = start
+        for match in self._comment_regex.finditer(content, start):
+            comment = match.group(0)
+            if not self.keep_comment(comment, 'block', matcher, stats):
+                plan.remove(match.start(), match.end())
+            pos = match.end()
+        
+        n = len(content)
+        if final:
+            return plan, n
+        
+        # Stop at an unterminated comment, or short of a '<!--' cut in half
+        unterminated = content.find('<!--', pos)
+        if unterminated != -1:
+            return plan, unterminated
+        return plan, max(pos, n - 3)
+
+
+class CStyleCommentHandler(ScanningCommentHandler):
+    """Handler for C-style comments (C, C++, JavaScript, Java, etc.)."""
+    
+    # Characters that can start a comment, string or template literal.
+    # Everything between two of them is copied as a single slice.
+    _SPECIAL = re.compile(r'[/"\']')
+    _SPECIAL_WITH_TEMPLATES = re.compile(r'[/"\'`]')
+    _STRING_STOPS = {
+        '"': re.compile(r'[\\"]'),
+        "'": re.compile(r"[\\']"),
+        '`': re.compile(r'[\\`]'),
+    }
+    
+    def __init__(self, language_key: str = 'javascript'):
+        super().__init__(language_key)
+        self._has_templates = language_key in ['javascript', 'typescript']
+        self._special = self._SPECIAL_WITH_TEMPLATES if self._has_templates else self._SPECIAL
+        
+        # Prefix that marks documentation comments, used to classify removals
+        doc = self.patterns.get('doc')
+        self._doc_prefix = None if doc is None else ('/**' if doc.is_block else '///')
+    
+    def scan(self, content: str, start: int, final: bool, keep_doc_comments: bool,
+             matcher: PreservationMatcher, stats: Optional[CommentStats] = None) -> Tuple[EditPlan, int]:
+        """
+        Plan the removal of C-style comments, skipping over literals.
+        
+        Args:
+            content: Source code to scan
+            start: Index to start scanning at
+            final: Whether the content runs to the end of the file
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            stats: Statistics object that removed and preserved comments are recorded in
             
-            content = '\n'.join(result)
+        Returns:
+            Tuple of (plan, stop) as described in ScanningCommentHandler.scan
+        """
+        plan = EditPlan()
+        n = len(content)
+        i = start
+        has_line = 'line' in self.patterns
+        keep_docs = keep_doc_comments and 'doc' in self.patterns
+        special = self._special
         
-        # Handle line comments
-        result = []
-        for line in content.split('\n'):
-            if '//' in line and 'line' in self.patterns:
-                # Ignore if it's a doc comment that we've already handled
-                if line.strip().startswith('///'):
-                    result.append(line)
-                    continue
-                
-                # Find the position of the // sequence
-                comment_pos = line.find('//')
+        while i < n:
+            # Jump to the next character that can start a comment or literal;
+            # everything in between is code and stays as it is
+            match = special.search(content, i)
+            if match is None:
+                break
+            
+            pos = match.start()
+            char = content[pos]
+            
+            if char == '/':
+                if pos + 1 == n and not final:
+                    return plan, pos  # May be the first half of a comment opener
+                next_char = content[pos + 1:pos + 2]
                 
-                # Split the line into code and comment
-                code_part = line[:comment_pos]
-                comment_part = line[comment_pos:]
+                # Check for line comments (the newline itself is kept)
+                if next_char == '/' and has_line:
+                    line_end = content.find('\n', pos)
+                    if line_end == -1 and not final:
+                        return plan, pos
+                    comment_end = n if line_end == -1 else line_end
+                    comment = content[pos:comment_end]
+                    if not self.keep_comment(comment, self._comment_kind(comment, 'line'), matcher, stats):
+                        plan.remove(pos, comment_end)
+                    i = comment_end + 1
                 
-                # Check if we need to preserve this comment
-                if preserve_todo or preserve_patterns:
-                    if self.should_preserve_comment(comment_part, preserve_todo, preserve_patterns):
-                        result.append(line)  # Keep the whole line
-                        continue
+                # Check for block comments
+                elif next_char == '*':
+                    end = content.find('*/', pos + 2)
+                    if end == -1 and not final:
+                        return plan, pos
+                    comment_end = end + 2 if end != -1 else n
+                    comment = content[pos:comment_end]
+                    if keep_docs and content.startswith('/**', pos):
+                        pass  # Preserve doc comment
+                    elif not self.keep_comment(comment, self._comment_kind(comment, 'block'), matcher, stats):
+                        plan.remove(pos, comment_end)
+                    i = comment_end
                 
-                # Otherwise just keep the code part
-                result.append(code_part)
+                else:
+                    # Division operator, regex literal, etc.
+                    i = pos + 1
+            
+            # Template literals (backticks) in JavaScript/TypeScript, and string
+            # literals unless the quote itself is escaped
+            elif char == '`' or pos == 0 or content[pos - 1] != '\\':
+                i = self._find_literal_end(content, pos, char)
+                if i == -1:
+                    if not final:
+                        return plan, pos
+                    i = n
+            
             else:
-                result.append(line)
+                i = pos + 1
+        
+        return plan, n
+    
+    def _comment_kind(self, comment: str, default: str) -> str:
+        """
+        Classify a comment for statistics.
+        
+        Args:
+            comment: The comment text
+            default: Kind to use when it is not a documentation comment
             
-        return '\n'.join(result)
-
-
-class CommentRemover:
-    """
-    Main class to orchestrate comment removal across different languages.
+        Returns:
+            'doc' for documentation comments, otherwise the default kind
+        """
+        if self._doc_prefix and comment.startswith(self._doc_prefix):
+            return 'doc'
+        return default
     
-    Manages language detection and delegates to appropriate handlers.
+    def _find_literal_end(self, content: str, start: int, quote: str) -> int:
+        """
+        Find the end of a string or template literal.
+        
+        Args:
+            content: Source code being scanned
+            start: Index of the opening quote
+            quote: The quote character that opened the literal
+            
+        Returns:
+            Index just past the closing quote, or -1 if the literal is unterminated
+        """
+        stops = self._STRING_STOPS[quote]
+        n = len(content)
+        i = start + 1
+        
+        while True:
+            match = stops.search(content, i)
+            if match is None:
+                return -1
+            pos = match.start()
+            if content[pos] == '\\':
+                # Skip the escaped character
+                if pos + 1 >= n:
+                    return -1
+                i = pos + 2
+            elif quote != '`' and content[pos - 1] == '\\':
+                # Quote directly after an escaped backslash does not close the string
+                i = pos + 1
+            else:
+                return pos + 1
+
+
+class LexerRule:
+    """
+    A single entry in a compiled lexer table.
+    
+    Wraps a comment or string pattern together with the regex fragment
+    that matches the whole construct.
+    """
+    
+    # Non-ASCII letters, digits and spaces used to probe context patterns
+    _NON_ASCII_SAMPLE = [chr(code) for code in range(0x80, 0x100)] + ['\u0101', '\u0663', '\u2003', '\u4e2d']
+    
+    def __init__(self, kind: str, pattern: Any):
+        """
+        Initialize a lexer rule.
+        
+        Args:
+            kind: One of 'line', 'block' or 'string'
+            pattern: The CommentPattern or StringPattern this rule was built from
+        """
+        self.kind = kind
+        self.pattern = pattern
+        self.start = pattern.start
+        self.end = pattern.end
+        self.is_doc = kind != 'string' and pattern.is_doc
+        self.line_start = kind != 'string' and pattern.line_start
+        self.not_after = re.compile(pattern.not_after) if pattern.not_after else None
+        self.max_length = max(len(self.start), kind == 'string' and pattern.max_length or 0)
+        self.contextual = bool(self.line_start or self.not_after)
+        # Whether the context check only looks at ASCII characters, so it gives
+        # the same answer on a byte view of the text
+        self.ascii_context = self.not_after is None or not any(
+            self.not_after.match(char) for char in self._NON_ASCII_SAMPLE
+        )
+        self.regex, self.complete = self._build_regex()
+        
+        # Fallback scanning for constructs a single regex cannot match
+        self.stops = None
+        if not self.complete:
+            if kind == 'string':
+                stops = [re.escape(self.end)]
+                if pattern.escape:
+                    stops.insert(0, re.escape(pattern.escape))
+                self.stops = re.compile('|'.join(stops))
+            else:
+                self.stops = re.compile(re.escape(self.start) + '|' + re.escape(self.end))
+    
+    def _build_regex(self) -> Tuple[str, bool]:
+        """
+        Build the regex fragment for this construct.
+        
+        Returns:
+            Tuple of (regex_fragment, complete) where complete is False when the
+            fragment only matches the opening delimiter and find_end must be used
+        """
+        start = re.escape(self.start)
+        if self.kind == 'line':
+            return start + r'[^\n]*', True
+        
+        if self.kind == 'string' and self.pattern.pattern:
+            return self.pattern.pattern, True
+        
+        end = re.escape(self.end)
+        if self.kind == 'block':
+            if self.pattern.nested:
+                return start, False
+            return start + r'[\s\S]*?(?:' + end + r'|\Z)', True
+        
+        escape = self.pattern.escape
+        if len(self.end) > 1:
+            if escape or self.pattern.doubled:
+                return start, False
+            return start + r'[\s\S]*?(?:' + end + r'|\Z)', True
+        
+        # Single-character delimiter: unrolled loop over plain characters
+        plain = '[^' + re.escape(self.end + (escape or '')) + ']*'
+        specials = []
+        if escape:
+            specials.append(re.escape(escape) + r'[\s\S]?')
+        if self.pattern.doubled:
+            specials.append(end + end)
+        body = plain
+        if specials:
+            body += '(?:(?:' + '|'.join(specials) + ')' + plain + ')*'
+        return start + body + '(?:' + end + r'|\Z)', True
+    
+    def applies_at(self, content: str, pos: int) -> bool:
+        """
+        Check the context conditions for an opening delimiter.
+        
+        Args:
+            content: Source code being scanned
+            pos: Index of the opening delimiter
+            
+        Returns:
+            True if the delimiter really opens this construct
+        """
+        if self.line_start and pos > 0 and content[pos - 1] != '\n':
+            return False
+        if self.not_after and pos > 0 and self.not_after.match(content, pos - 1):
+            return False
+        return True
+    
+    def find_end(self, content: str, pos: int) -> int:
+        """
+        Find the end of a construct whose regex only matched the opening delimiter.
+        
+        Args:
+            content: Source code being scanned
+            pos: Index just past the opening delimiter
+            
+        Returns:
+            Index just past the construct, or the content length if it is unterminated
+        """
+        n = len(content)
+        if self.kind == 'block':
+            # Nested block comments: track depth
+            depth = 1
+            while True:
+                match = self.stops.search(content, pos)
+                if match is None:
+                    return n
+                pos = match.end()
+                if match.group() == self.start:
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return pos
+        
+        escape = self.pattern.escape
+        doubled = self.pattern.doubled
+        while True:
+            match = self.stops.search(content, pos)
+            if match is None:
+                return n
+            token = match.group()
+            pos = match.end()
+            if token == escape:
+                pos += 1  # Skip the escaped character
+            elif doubled and content.startswith(self.end, pos):
+                pos += len(self.end)  # Doubled delimiter stands for itself
+            else:
+                return min(pos, n)
+
+
+class LexerTable:
+    """
+    Compiled scanning table for one language.
+    
+    Built once per language from COMMENT_PATTERNS and STRING_PATTERNS and
+    shared by every handler instance that scans that language.
+    """
+    
+    _tables: Dict[str, 'LexerTable'] = {}
+    
+    def __init__(self, language_key: str):
+        """
+        Compile the lexer table for a language.
+        
+        Args:
+            language_key: Key to look up patterns from the registries
+        """
+        self.language_key = language_key
+        rules = []
+        for pattern in COMMENT_PATTERNS.get(language_key, {}).values():
+            if pattern.start:
+                rules.append(LexerRule('block' if pattern.is_block else 'line', pattern))
+        for pattern in STRING_PATTERNS.get(language_key, []):
+            rules.append(LexerRule('string', pattern))
+        
+        # Longest delimiters first so that e.g. '--[[' wins over '--'
+        self.rules: List[LexerRule] = sorted(rules, key=lambda rule: len(rule.start), reverse=True)
+        self.scanner: Optional[Pattern] = None
+        # Characters a chunked scan must hold back: a cut-off opening delimiter,
+        # or a whole literal of a rule that only matches complete literals
+        self.lookback = max((rule.max_length for rule in self.rules), default=0)
+        if self.rules:
+            # The leading lookahead lets the regex engine skip ahead using a
+            # character set instead of trying every alternative at each position
+            first_chars = ''.join(sorted(set(rule.start[0] for rule in self.rules)))
+            alternatives = '|'.join('(' + rule.regex + ')' for rule in self.rules)
+            self.scanner = re.compile('(?=[' + re.escape(first_chars) + '])(?:' + alternatives + ')')
+    
+    @classmethod
+    def for_language(cls, language_key: str) -> 'LexerTable':
+        """
+        Get the compiled table for a language, compiling it on first use.
+        
+        Args:
+            language_key: Key to look up patterns from the registries
+            
+        Returns:
+            The shared LexerTable for the language
+        """
+        table = cls._tables.get(language_key)
+        if table is None:
+            table = cls._tables[language_key] = cls(language_key)
+        return table
+
+
+class LexerCommentHandler(ScanningCommentHandler):
+    """
+    Handler driven by a compiled lexer table.
+    
+    Scans the content once, skipping over string literals and removing
+    line and block comments as they are found.
+    """
+    
+    # Line comment prefixes that are always kept when they start a line
+    shebang_prefixes: Tuple[str, ...] = ()
+    
+    def __init__(self, language_key: str):
+        super().__init__(language_key)
+        self.table = LexerTable.for_language(language_key)
+        self.byte_view_safe = all(rule.ascii_context for rule in self.table.rules)
+    
+    def scan(self, content: str, start: int, final: bool, keep_doc_comments: bool,
+             matcher: PreservationMatcher, stats: Optional[CommentStats] = None) -> Tuple[EditPlan, int]:
+        """
+        Plan comment removals in a single pass over the content.
+        
+        Args:
+            content: Source code to scan
+            start: Index to start scanning at
+            final: Whether the content runs to the end of the file
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            stats: Statistics object that removed and preserved comments are recorded in
+            
+        Returns:
+            Tuple of (plan, stop) as described in ScanningCommentHandler.scan
+        """
+        plan = EditPlan()
+        n = len(content)
+        scanner = self.table.scanner
+        if scanner is None:
+            return plan, n
+        
+        rules = self.table.rules
+        pos = start
+        
+        while True:
+            match = scanner.search(content, pos)
+            if match is None:
+                break
+            begin = match.start()
+            rule = rules[match.lastindex - 1]
+            
+            if rule.contextual and not rule.applies_at(content, begin):
+                pos = begin + 1
+                continue
+            
+            end = match.end() if rule.complete else rule.find_end(content, match.end())
+            if end >= n and not final:
+                # The construct may continue in the next chunk, and so may a
+                # complete-literal rule that failed to match just before it
+                return plan, min(begin, max(pos, n - self.table.lookback + 1))
+            pos = end
+            if rule.kind == 'string':
+                continue
+            
+            comment = content[begin:end]
+            if not self._keep_comment(rule, content, begin, comment, keep_doc_comments, matcher, stats):
+                plan.remove(begin, end)
+        
+        if final:
+            return plan, n
+        # Leave room for an opening delimiter cut off at the end
+        return plan, max(pos, n - self.table.lookback + 1)
+    
+    def _keep_comment(self, rule: LexerRule, content: str, start: int, comment: str,
+                      keep_doc_comments: bool, matcher: PreservationMatcher,
+                      stats: Optional[CommentStats]) -> bool:
+        """
+        Decide whether a comment found by the lexer stays in the output.
+        
+        Args:
+            rule: Lexer rule that matched the comment
+            content: Source code being scanned
+            start: Index where the comment starts
+            comment: The comment text
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            stats: Statistics object to record the outcome in, if any
+            
+        Returns:
+            True if the comment should be kept
+        """
+        if rule.is_doc and keep_doc_comments:
+            return True
+        if (rule.kind == 'line' and self.shebang_prefixes
+                and comment.startswith(self.shebang_prefixes)):
+            line_start = content.rfind('\n', 0, start) + 1
+            if not content[line_start:start].strip():
+                return True
+        kind = 'doc' if rule.is_doc else rule.kind
+        return self.keep_comment(comment, kind, matcher, stats)
+
+
+class SqlCommentHandler(LexerCommentHandler):
+    """Handler for SQL comments."""
+    
+    def __init__(self):
+        super().__init__('sql')
+
+
+class HashCommentHandler(ScanningCommentHandler):
+    """Handler for languages that use # for line comments."""
+    
+    def __init__(self, language_key: str = 'bash', preserve_shebang: bool = False):
+        super().__init__(language_key)
+        self.preserve_shebang = preserve_shebang
+    
+    def scan(self, content: str, start: int, final: bool, keep_doc_comments: bool,
+             matcher: PreservationMatcher, stats: Optional[CommentStats] = None) -> Tuple[EditPlan, int]:
+        """
+        Plan the removal of # comments; everything from the first # on a line is a comment.
+        
+        Args:
+            content: Source code to scan
+            start: Index to start scanning at
+            final: Whether the content runs to the end of the file
+            keep_doc_comments: Not applicable to # comments, ignored
+            matcher: Compiled preservation rules
+            stats: Statistics object that removed and preserved comments are recorded in
+            
+        Returns:
+            Tuple of (plan, stop) as described in ScanningCommentHandler.scan
+        """
+        plan = EditPlan()
+        n = len(content)
+        pos = start
+        
+        while True:
+            comment_pos = content.find('#', pos)
+            if comment_pos == -1:
+                break
+            line_end = content.find('\n', comment_pos)
+            if line_end == -1:
+                if not final:
+                    return plan, comment_pos
+                line_end = n
+            comment = content[comment_pos:line_end]
+            
+            # Optionally preserve shebang lines
+            if self.preserve_shebang and comment.startswith('#!'):
+                pass
+            # Preserve TODOs and pattern matches if requested
+            elif not self.keep_comment(comment, 'line', matcher, stats):
+                plan.remove(comment_pos, line_end)
+            pos = line_end + 1
+        
+        return plan, n
+
+
+class LuaCommentHandler(LexerCommentHandler):
+    """Handler for Lua comments."""
+    
+    def __init__(self):
+        super().__init__('lua')
+
+
+class HaskellCommentHandler(LexerCommentHandler):
+    """Handler for Haskell comments."""
+    
+    def __init__(self):
+        super().__init__('haskell')
+
+
+class MatlabCommentHandler(LexerCommentHandler):
+    """Handler for MATLAB comments."""
+    
+    def __init__(self):
+        super().__init__('matlab')
+
+
+class PowerShellCommentHandler(LexerCommentHandler):
+    """Handler for PowerShell comments."""
+    
+    def __init__(self):
+        super().__init__('powershell')
+
+
+class RubyCommentHandler(LexerCommentHandler):
+    """Handler for Ruby comments."""
+    
+    # Shebang lines (both #! and # ! formats) are always kept
+    shebang_prefixes = ('#!', '# !')
+    
+    def __init__(self):
+        super().__init__('ruby')
+
+
+class PerlCommentHandler(LexerCommentHandler):
+    """Handler for Perl comments."""
+    
+    # Shebang lines are always kept
+    shebang_prefixes = ('#!',)
+    
+    def __init__(self):
+        super().__init__('perl')
+
+
+class PhpCommentHandler(LexerCommentHandler):
+    """Handler for PHP comments."""
+    
+    def __init__(self):
+        super().__init__('php')
+
+
+class CSharpCommentHandler(LexerCommentHandler):
+    """Handler for C# comments."""
+    
+    def __init__(self):
+        super().__init__('csharp')
+
+
+class ResultCache:
+    """
+    On-disk cache of cleaning results, keyed by file content.
+    
+    Entries map a hash of (engine version, language, options, file bytes)
+    to the SHA-256 of the cleaned output, its statistics and the path it
+    was last written to. A file whose cleaned output is its own content
+    needs no work at all, and a copy of a file cleaned before can take the
+    output from that path instead of being cleaned again.
+    
+    The cache is an SQLite database in WAL mode, so threads and processes
+    can read it while one of them writes. Each thread opens its own
+    connection. Entries beyond the size limit are evicted least recently
+    used first.
+    """
+    
+    # Bump whenever a change to the handlers or post-processing changes output
+    ENGINE_VERSION = '1'
+    MAX_ENTRIES = 100000
+    # Seconds to wait for another process holding the write lock
+    BUSY_TIMEOUT = 30
+    HASH_CHUNK_SIZE = 1024 * 1024
+    # Statistics that describe one run rather than the cleaned output
+    RUN_KEYS = frozenset(('seconds', 'phases', 'trace', 'rewritten', 'cached', 'mtimeNs', 'inode'))
+    
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+        """
+        Open or create the cache database.
+        
+        Args:
+            path: Path of the database file
+            max_entries: Number of entries to keep
+        """
+        if sqlite3 is None:
+            raise RuntimeError('The result cache needs Python built with sqlite3')
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._inflight_lock = threading.Lock()
+        # Entries added since the last count; other processes add entries too,
+        # so the table is counted again before evicting
+        self._count_lock = threading.Lock()
+        self._count = self._connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+    
+    def __getstate__(self) -> Dict[str, Any]:
+        # Connections stay with the process that opened them
+        return {'path': self.path, 'max_entries': self.max_entries}
+    
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state['path'], state['max_entries'])
+    
+    def key(self, content_hash: str, language: str, options: Any) -> str:
+        """
+        Build the cache key for a file.
+        
+        Args:
+            content_hash: SHA-256 of the file's bytes
+            language: Language the file is cleaned as
+            options: JSON-serializable options that affect the output
+            
+        Returns:
+            Hex digest identifying the cleaning result
+        """
+        parts = [self.ENGINE_VERSION, language, json.dumps(options, sort_keys=True), content_hash]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def hash_file(cls, file_path: str) -> str:
+        """
+        Hash a file's bytes without reading it into memory at once.
+        
+        Args:
+            file_path: Path to the file
+            
+        Returns:
+            SHA-256 hex digest of the file
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any], str]]:
+        """
+        Look up a result and mark it as recently used.
+        
+        Args:
+            key: Cache key from key()
+            
+        Returns:
+            Tuple of (output_hash, stats, source_path), or None on a miss;
+            stats leave out the RUN_KEYS of the run that stored them
+        """
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT output, stats, source FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        stats = {name: value for name, value in json.loads(row[1]).items() if name not in self.RUN_KEYS}
+        return row[0], stats, row[2]
+    
+    def put(self, key: str, output_hash: str, stats: Dict[str, Any], source: str) -> None:
+        """
+        Store a result, evicting the least recently used entries over the limit.
+        
+        Args:
+            key: Cache key from key()
+            output_hash: SHA-256 of the cleaned output
+            stats: Statistics of the cleaning run
+            source: Path the cleaned output was written to
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results (key, output, stats, source, used) VALUES (?, ?, ?, ?, ?)',
+                (key, output_hash,
+                 json.dumps({name: value for name, value in stats.items() if name not in self.RUN_KEYS}),
+                 source, time.time()))
+        with self._count_lock:
+            self._count += 1
+            if self._count <= self.max_entries:
+                return
+            # Trim to 90% of the limit so that eviction runs once per batch of entries
+            count = connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            excess = count - int(self.max_entries * 0.9)
+            if count > self.max_entries:
+                with connection:
+                    connection.execute(
+                        'DELETE FROM results WHERE key IN '
+                        '(SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+                count -= excess
+            self._count = count
+    
+    def claim(self, key: str) -> bool:
+        """
+        Claim a key for processing, so that identical files in this process
+        are cleaned once.
+        
+        If another thread holds the key, this waits until it calls release().
+        
+        Args:
+            key: Cache key from key()
+            
+        Returns:
+            True if the caller should process the file and then call release(),
+            False if another thread just finished it and the cache should be
+            checked again
+        """
+        with self._inflight_lock:
+            event = self._inflight.get(key)
+            if event is None:
+                self._inflight[key] = threading.Event()
+                return True
+        event.wait()
+        return False
+    
+    def release(self, key: str) -> None:
+        """
+        Release a key claimed with claim().
+        
+        Args:
+            key: Cache key from key()
+        """
+        with self._inflight_lock:
+            event = self._inflight.pop(key)
+        event.set()
+    
+    def _connection(self) -> Any:
+        """
+        Get this thread's connection, opening it on first use.
+        
+        Returns:
+            sqlite3 connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS results '
+                    '(key TEXT PRIMARY KEY, output TEXT, stats TEXT, source TEXT, used REAL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._local.connection = connection
+        return connection
+
+
+class Manifest:
+    """
+    Record of files cleaned by earlier runs, for incremental runs.
+    
+    Each entry holds the size, mtime_ns and inode a file had right after it
+    was cleaned, and a hash of the options it was cleaned with. A file whose
+    stat still matches needs no work and is not opened.
+    
+    Timestamps have limited resolution, so an edit made in the same clock
+    tick as the cleaning can leave mtime unchanged. Entries modified too
+    close to saving the manifest are dropped for that reason, and those
+    files are checked again by the next run.
+    """
+    
+    VERSION = 1
+    # Longer than a clock tick for filesystems with sub-second timestamps,
+    # and for those with whole seconds (2 s resolution on FAT)
+    RACY_WINDOW_NS = 100 * 10 ** 6
+    COARSE_RACY_WINDOW_NS = 2 * 10 ** 9
+    
+    def __init__(self, path: str):
+        """
+        Load the manifest, or start an empty one if it is missing or unreadable.
+        
+        Args:
+            path: Path of the manifest file
+        """
+        self.path = path
+        self.saved_ns = 0
+        self.entries: Dict[str, List[Any]] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.saved_ns = data['saved']
+                self.entries = data['files']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable manifest {path}: {e}")
+    
+    @staticmethod
+    def options_hash(options: Any) -> str:
+        """
+        Hash the options that affect cleaned output.
+        
+        Args:
+            options: JSON-serializable options
+            
+        Returns:
+            Short hex digest
+        """
+        text = json.dumps([ResultCache.ENGINE_VERSION, options], sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    
+    def unchanged(self, file_path: str, stat: os.stat_result, options_hash: str) -> bool:
+        """
+        Check whether a file is as an earlier run left it.
+        
+        Args:
+            file_path: Path to the file
+            stat: Current stat of the file
+            options_hash: Hash of the options for this run
+            
+        Returns:
+            True if the file needs no work
+        """
+        entry = self.entries.get(os.path.abspath(file_path))
+        return (entry is not None
+                and entry == [stat.st_size, stat.st_mtime_ns, stat.st_ino, options_hash]
+                and not self._racy(stat.st_mtime_ns))
+    
+    def record(self, file_path: str, size: int, mtime_ns: int, inode: int, options_hash: str) -> None:
+        """
+        Record a file as cleaned.
+        
+        Args:
+            file_path: Path to the file
+            size: Size of the file right after cleaning
+            mtime_ns: Modification time of the file right after cleaning
+            inode: Inode number of the file
+            options_hash: Hash of the options it was cleaned with
+        """
+        self.entries[os.path.abspath(file_path)] = [size, mtime_ns, inode, options_hash]
+    
+    def forget(self, file_path: str) -> None:
+        """
+        Remove a file's entry, e.g. after it failed to clean.
+        
+        Args:
+            file_path: Path to the file
+        """
+        self.entries.pop(os.path.abspath(file_path), None)
+    
+    def save(self) -> None:
+        """Write the manifest to a temporary file and move it into place."""
+        self.saved_ns = int(time.time() * 10 ** 9)
+        self.entries = {path: entry for path, entry in self.entries.items() if not self._racy(entry[1])}
+        
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.ccp-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'saved': self.saved_ns, 'files': self.entries},
+                          f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file private to the owner; keep the old
+            # manifest's mode, or give a new one the usual mode for new files
+            try:
+                mode = os.stat(self.path).st_mode & 0o7777
+            except FileNotFoundError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _racy(self, mtime_ns: int) -> bool:
+        """
+        Check whether a modification time is too close to the save time to trust.
+        
+        Args:
+            mtime_ns: Modification time of a file
+            
+        Returns:
+            True if an edit could have kept this mtime
+        """
+        window = self.COARSE_RACY_WINDOW_NS if mtime_ns % 10 ** 9 == 0 else self.RACY_WINDOW_NS
+        return mtime_ns >= self.saved_ns - window
+
+
+class BackupStore:
+    """
+    Content-addressed store of original files, in place of per-file .bak copies.
+    
+    Each distinct original is stored once under objects/, named by its
+    SHA-256. Where the filesystem allows, the blob is a reflink (a
+    copy-on-write clone) or a hard link of the original, which costs no
+    data I/O: cleaned files are moved into place under the original name,
+    so the original's inode is never written to. Otherwise the blob is a
+    gzip-compressed copy. Every run appends (path, hash) records to its own
+    file under runs/, one JSON object per line, so threads and worker
+    processes can record backups without coordinating.
+    """
+    
+    # Linux ioctl that clones a file's extents (Btrfs, XFS, OCFS2, ...)
+    FICLONE = 0x40049409
+    COMPRESS_LEVEL = 6
+    
+    def __init__(self, path: str, run_id: Optional[str] = None):
+        """
+        Open or create the store.
+        
+        Args:
+            path: Directory of the store
+            run_id: Name of the run to record backups under (default: the
+                current time and process ID)
+        """
+        self.path = path
+        self.objects = os.path.join(path, 'objects')
+        self.runs = os.path.join(path, 'runs')
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.runs, exist_ok=True)
+        self.run_id = run_id or time.strftime('%Y%m%dT%H%M%S') + f'-{os.getpid()}'
+    
+    def save(self, file_path: str, content: Any = None) -> str:
+        """
+        Store a file's current content and record it for this run.
+        
+        Must be called before the file is replaced, and only for files that
+        are about to change.
+        
+        Args:
+            file_path: Path to the file
+            content: The file's bytes, if already in memory, to hash them
+                without reading the file again
+            
+        Returns:
+            SHA-256 of the stored content
+        """
+        # Back up the file a symbolic link points to, not the link
+        file_path = os.path.realpath(file_path)
+        if content is not None:
+            digest = hashlib.sha256(content).hexdigest()
+        else:
+            digest = ResultCache.hash_file(file_path)
+        blob = self._blob_path(digest)
+        if not (os.path.exists(blob) or os.path.exists(blob + '.gz')):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if not self._clone(file_path, blob):
+                self._compress(file_path, blob + '.gz')
+        
+        record = json.dumps({'path': os.path.abspath(file_path), 'blob': digest}) + '\n'
+        # One O_APPEND write per record, so concurrent writers don't interleave
+        fd = os.open(os.path.join(self.runs, self.run_id + '.ndjson'),
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, record.encode('utf-8'))
+        finally:
+            os.close(fd)
+        return digest
+    
+    def restore(self, run_id: Optional[str] = None) -> int:
+        """
+        Put back the originals of every file backed up in a run.
+        
+        Args:
+            run_id: Run to restore (default: the latest one)
+            
+        Returns:
+            Number of files restored
+        """
+        if run_id is None:
+            runs = sorted(name for name in os.listdir(self.runs) if name.endswith('.ndjson'))
+            if not runs:
+                logger.warning(f"No runs recorded in {self.path}")
+                return 0
+            run_id = runs[-1][:-len('.ndjson')]
+        
+        originals: Dict[str, str] = {}
+        with open(os.path.join(self.runs, run_id + '.ndjson'), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A record cut short by an interrupted run
+                # The first record of a path holds its content before the run
+                originals.setdefault(entry['path'], entry['blob'])
+        
+        restored = 0
+        for file_path, digest in originals.items():
+            try:
+                self._extract(digest, file_path)
+                restored += 1
+                logger.info(f"Restored {file_path}")
+            except OSError as e:
+                logger.error(f"Failed to restore {file_path}: {e}")
+        return restored
+    
+    def _blob_path(self, digest: str) -> str:
+        """
+        Get the path of a blob, without the .gz suffix of compressed blobs.
+        
+        Args:
+            digest: SHA-256 of the content
+            
+        Returns:
+            Path under objects/, fanned out by the first two hex digits
+        """
+        return os.path.join(self.objects, digest[:2], digest[2:])
+    
+    def _clone(self, file_path: str, blob: str) -> bool:
+        """
+        Store a file as a reflink or, failing that, a hard link.
+        
+        A hard link is only used for a file with no other links, which
+        nothing else could modify in place.
+        
+        Args:
+            file_path: Path to the file
+            blob: Path to store it at
+            
+        Returns:
+            True if the file was stored, False if it has to be copied
+        """
+        if fcntl is not None and sys.platform.startswith('linux'):
+            try:
+                with open(file_path, 'rb') as src, open(blob, 'xb') as dst:
+                    try:
+                        fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+                        return True
+                    except OSError:
+                        pass
+                os.remove(blob)
+            except FileExistsError:
+                return True  # Stored by another worker
+        try:
+            if os.stat(file_path).st_nlink == 1:
+                os.link(file_path, blob)
+                return True
+        except FileExistsError:
+            return True
+        except OSError:
+            pass
+        return False
+    
+    def _compress(self, file_path: str, blob: str) -> None:
+        """
+        Store a gzip-compressed copy of a file.
+        
+        Args:
+            file_path: Path to the file
+            blob: Path of the compressed blob
+        """
+        directory = os.path.dirname(blob)
+        fd, temp_path = tempfile.mkstemp(prefix='.ccp-', suffix='.tmp', dir=directory)
+        try:
+            with open(file_path, 'rb') as src, open(fd, 'wb') as raw, \
+                    gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.COMPRESS_LEVEL, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, ResultCache.HASH_CHUNK_SIZE)
+            os.replace(temp_path, blob)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _extract(self, digest: str, file_path: str) -> None:
+        """
+        Replace a file with a stored blob.
+        
+        Args:
+            digest: SHA-256 of the blob
+            file_path: Path to write it to
+        """
+        blob = self._blob_path(digest)
+        compressed = not os.path.exists(blob)
+        # Runs recorded before links were resolved may hold a link's path
+        file_path = os.path.realpath(file_path)
+        directory = os.path.dirname(file_path)
+        fd, temp_path = tempfile.mkstemp(prefix='.ccp-', suffix='.tmp', dir=directory)
+        try:
+            with open(fd, 'wb') as dst:
+                with (gzip.open(blob + '.gz', 'rb') if compressed else open(blob, 'rb')) as src:
+                    shutil.copyfileobj(src, dst, ResultCache.HASH_CHUNK_SIZE)
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temp_path)
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class CommentRemover:
+    """
+    Main class to orchestrate comment removal across different languages.
+    
+    Manages language detection and delegates to appropriate handlers.
+    """
+    
+    # Files larger than this are cleaned chunk by chunk instead of in memory
+    STREAM_THRESHOLD = 64 * 1024 * 1024
+    STREAM_CHUNK_SIZE = 1024 * 1024
+    # Characters kept before the resume point of a chunk, so that scanners can
+    # look back at the previous character and the start of the line
+    STREAM_CONTEXT = 1024
+    
+    _NON_ASCII_BYTES = re.compile(rb'[\x80-\xff]')
+    
+    # Encodings tried in order for files without a byte order mark; the last
+    # one decodes any bytes. All of them keep ASCII characters as they are.
+    ENCODINGS = ('utf-8', 'cp1252', 'latin-1')
+    BOMS = (
+        (codecs.BOM_UTF32_LE, 'utf-32-le'),
+        (codecs.BOM_UTF32_BE, 'utf-32-be'),
+        (codecs.BOM_UTF8, 'utf-8'),
+        (codecs.BOM_UTF16_LE, 'utf-16-le'),
+        (codecs.BOM_UTF16_BE, 'utf-16-be'),
+    )
+    # Chunk size for validating encodings without decoding the whole file
+    VALIDATE_CHUNK_SIZE = 1024 * 1024
+    # Characters of an offending comment quoted by check_file
+    CHECK_EXCERPT = 80
+    
+    def __init__(self, post_processor: Optional[PostProcessor] = None,
+                 stream_threshold: Optional[int] = STREAM_THRESHOLD,
+                 chunk_size: int = STREAM_CHUNK_SIZE,
+                 bytes_engine: bool = True,
+                 cache: Optional[ResultCache] = None,
+                 backup_store: Optional[BackupStore] = None,
+                 profile: bool = False,
+                 trace: bool = False):
+        """
+        Initialize with handlers for each supported language.
+        
+        Args:
+            post_processor: Whitespace clean-up applied to handler output
+            stream_threshold: File size in bytes above which files are streamed
+                (None or 0 to always clean in memory)
+            chunk_size: Number of characters read per chunk when streaming
+            bytes_engine: Whether to scan memory-mapped bytes where that gives
+                the same output as decoding the file
+            cache: Result cache to skip files cleaned before, or None
+            backup_store: Store to back originals up to, or None for .bak files
+            profile: Whether to time the phases of processing each file and
+                report them in the file's statistics as 'phases'
+            trace: Whether to also report when each phase ran, as 'trace' in
+                the file's statistics; implies profile
+        """
+        self.post_processor = post_processor or PostProcessor()
+        self.stream_threshold = stream_threshold
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.backup_store = backup_store
+        self.profile = profile or trace
+        self.trace = trace
+        # Phase timings of the file each thread is processing
+        self._local = threading.local()
+        # Writing kept regions straight from the mapping needs os.writev, and
+        # matching the text path's output needs '\n' as the platform newline
+        self.bytes_engine = bytes_engine and hasattr(os, 'writev') and os.linesep == '\n'
+        self._handlers = {
+            'python': PythonCommentHandler(),
+            'html': HtmlCommentHandler(),
+            'javascript': CStyleCommentHandler('javascript'),
+            'typescript': CStyleCommentHandler('typescript'),
+            'c': CStyleCommentHandler('c'),
+            'cpp': CStyleCommentHandler('cpp'),
+            'java': CStyleCommentHandler('java'),
+            'css': CStyleCommentHandler('css'),
+            'go': CStyleCommentHandler('go'),
+            'swift': CStyleCommentHandler('swift'),
+            'rust': CStyleCommentHandler('rust'),
+            'kotlin': CStyleCommentHandler('kotlin'),
+            'dart': CStyleCommentHandler('dart'),
+            'bash': HashCommentHandler('bash', preserve_shebang=True),
+            'yaml': HashCommentHandler('yaml'),
+            'r': HashCommentHandler('r'),
+            'powershell': PowerShellCommentHandler(),
+            'lua': LuaCommentHandler(),
+            'perl': PerlCommentHandler(),
+            'ruby': RubyCommentHandler(),
+            'php': PhpCommentHandler(),
+            'sql': SqlCommentHandler(),
+            'haskell': HaskellCommentHandler(),
+            'matlab': MatlabCommentHandler(),
+            'csharp': CSharpCommentHandler(),
+        }
+        
+        # Map file extensions to language types
+        self._extension_map = {
+            '.py': 'python',
+            '.html': 'html', '.htm': 'html',
+            '.css': 'css',
+            '.js': 'javascript',
+            '.jsx': 'javascript',
+            '.ts': 'typescript',
+            '.tsx': 'typescript',
+            '.c': 'c', '.h': 'c',
+            '.cpp': 'cpp', '.hpp': 'cpp', '.cc': 'cpp', '.cxx': 'cpp',
+            '.java': 'java',
+            '.rb': 'ruby',
+            '.go': 'go',
+            '.php': 'php',
+            '.sql': 'sql',    
+            '.swift': 'swift',
+            '.rs': 'rust',
+            '.kt': 'kotlin',
+            '.sh': 'bash', '.bash': 'bash',
+            '.ps1': 'powershell',
+            '.lua': 'lua',
+            '.pl': 'perl', '.pm': 'perl',
+            '.yaml': 'yaml', '.yml': 'yaml',
+            '.hs': 'haskell',
+            '.dart': 'dart',
+            '.m': 'matlab',
+            '.r': 'r', '.R': 'r',
+            '.cs': 'csharp'
+        }
+    
+    def settings(self) -> Dict[str, Any]:
+        """
+        Get the constructor arguments that reproduce this remover.
+        
+        Returns:
+            Keyword arguments for CommentRemover, e.g. to build one in a worker process
+        """
+        return {
+            'post_processor': PostProcessor(self.post_processor.strip_trailing_whitespace,
+                                            self.post_processor.collapse_blank_lines),
+            'stream_threshold': self.stream_threshold,
+            'chunk_size': self.chunk_size,
+            'bytes_engine': self.bytes_engine,
+            'cache': self.cache,
+            'backup_store': self.backup_store,
+            'profile': self.profile,
+            'trace': self.trace,
+        }
+    
+    def identify_language(self, file_path: str) -> str:
+        """
+        Determine language type based on file extension.
+        
+        Args:
+            file_path: Path to the file to analyze
+            
+        Returns:
+            Language identifier string or 'unknown' if not recognized
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+        return self._extension_map.get(ext, 'unknown')
+    
+    def remove_comments(self, content: str, language: str, 
+                   preserve_todo: bool = False, 
+                   preserve_patterns: Optional[List[str]] = None,
+                   keep_doc_comments: bool = False,
+                   matcher: Optional[PreservationMatcher] = None,
+                   stats: Optional[CommentStats] = None,
+                   post_processor: Optional[PostProcessor] = None) -> str:
+        """
+        Remove comments from code based on language syntax rules.
+        
+        Args:
+            content: Source code content to process
+            language: Language identifier for appropriate handler selection
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules shared across files
+            stats: Statistics object the handler records comments in
+            post_processor: Whitespace clean-up to apply; defaults to the remover's own
+            
+        Returns:
+            Processed content with comments removed according to settings
+        """
+        if language == 'unknown' or language not in self._handlers:
+            return content
+            
+        # Get the appropriate handler for this language
+        handler = self._handlers[language]
+        
+        # Process the content with all parameters
+        cleaned = handler.remove_comments(
+            content, 
+            keep_doc_comments=keep_doc_comments,
+            preserve_todo=preserve_todo,
+            preserve_patterns=preserve_patterns,
+            matcher=matcher,
+            stats=stats
+        )
+        self._lap('handler')
+        
+        # Strip trailing whitespace and collapse blank lines in the same pass
+        if post_processor is None:
+            post_processor = self.post_processor
+        cleaned = post_processor.process(cleaned)
+        self._lap('post_process')
+        return cleaned
+    
+    def clean_stream(self, reader: Any, writer: Any, language: str,
+                     keep_doc_comments: bool = False,
+                     matcher: Optional[PreservationMatcher] = None,
+                     stats: Optional[CommentStats] = None,
+                     post_processor: Optional[PostProcessor] = None) -> Tuple[int, int]:
+        """
+        Remove comments from a text stream, one chunk at a time.
+        
+        Memory use is bounded by the chunk size plus the longest single
+        comment or literal, whatever the size of the input.
+        
+        Args:
+            reader: Text stream to read the source code from
+            writer: Text stream to write the cleaned code to
+            language: Language identifier; its handler must support streaming
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules shared across files
+            stats: Statistics object the handler records comments in
+            post_processor: Whitespace clean-up settings; defaults to the remover's own
+            
+        Returns:
+            Tuple of (original_lines, cleaned_lines)
+        """
+        handler = self._handlers[language]
+        matcher = handler.get_matcher(matcher=matcher)
+        settings = post_processor or self.post_processor
+        # A fresh instance, since feeding it keeps state between chunks
+        post = PostProcessor(settings.strip_trailing_whitespace, settings.collapse_blank_lines)
+        
+        original_lines = cleaned_lines = 1
+        buffer = ''
+        start = 0
+        read_size = self.chunk_size
+        
+        while True:
+            chunk = reader.read(read_size)
+            final = not chunk
+            original_lines += chunk.count('\n')
+            buffer += chunk
+            
+            plan, stop = handler.scan(buffer, start, final, keep_doc_comments, matcher, stats)
+            output = post.feed(plan.apply(buffer, start, stop))
+            if final:
+                output += post.flush()
+            cleaned_lines += output.count('\n')
+            writer.write(output)
+            if final:
+                break
+            
+            # Carry the unscanned tail over, with a little context before it
+            context_start = max(stop - self.STREAM_CONTEXT, 0)
+            line_start = buffer.rfind('\n', context_start, stop)
+            keep_from = line_start + 1 if line_start != -1 else context_start
+            buffer = buffer[keep_from:]
+            start = stop - keep_from
+            
+            # Read at least as much as is carried over, so a construct spanning
+            # many chunks is not rescanned once per chunk
+            read_size = max(self.chunk_size, len(buffer) - start)
+        
+        return original_lines, cleaned_lines
+    
+    def detect_encoding(self, data: Any) -> Tuple[str, int]:
+        """
+        Detect the encoding of a file's bytes without keeping a decoded copy.
+        
+        Byte order marks are checked first. Otherwise the bytes are validated
+        as UTF-8 a chunk at a time, then as Windows-1252, and Latin-1 is used
+        if neither fits.
+        
+        Args:
+            data: The file's bytes, e.g. a memory map
+            
+        Returns:
+            Tuple of (encoding, bom_length)
+        """
+        for bom, encoding in self.BOMS:
+            if data[:len(bom)] == bom and self._validates(data, encoding, len(bom)):
+                return encoding, len(bom)
+        for encoding in self.ENCODINGS[:-1]:
+            if self._validates(data, encoding, 0):
+                return encoding, 0
+        return self.ENCODINGS[-1], 0
+    
+    def decode(self, data: bytes) -> Tuple[str, str, int]:
+        """
+        Decode a file's bytes with the first encoding that fits.
+        
+        Args:
+            data: The file's bytes
+            
+        Returns:
+            Tuple of (content, encoding, bom_length); the byte order mark is
+            not part of the content
+        """
+        for bom, encoding in self.BOMS:
+            if data.startswith(bom):
+                try:
+                    return data[len(bom):].decode(encoding), encoding, len(bom)
+                except UnicodeDecodeError:
+                    break
+        for encoding in self.ENCODINGS[:-1]:
+            try:
+                return data.decode(encoding), encoding, 0
+            except UnicodeDecodeError:
+                continue
+        encoding = self.ENCODINGS[-1]
+        return data.decode(encoding), encoding, 0
+    
+    def _validates(self, data: Any, encoding: str, start: int) -> bool:
+        """
+        Check whether bytes decode with an encoding, a chunk at a time.
+        
+        Args:
+            data: The bytes to check
+            encoding: Encoding to check against
+            start: Offset to start at
+            
+        Returns:
+            True if data[start:] decodes without errors
+        """
+        decoder = codecs.getincrementaldecoder(encoding)()
+        # ASCII chunks are valid UTF-8 whenever no multi-byte sequence is pending
+        skip_ascii = encoding == 'utf-8'
+        size = len(data)
+        try:
+            for offset in range(start, size, self.VALIDATE_CHUNK_SIZE):
+                end = offset + self.VALIDATE_CHUNK_SIZE
+                chunk = data[offset:end]
+                if skip_ascii and chunk.isascii() and not decoder.getstate()[0]:
+                    continue
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return False
+        return True
+    
+    def _stream_file(self, file_path: str, original_size: int, language: str, encoding: str,
+                     bom_length: int, keep_doc_comments: bool, matcher: PreservationMatcher,
+                     backup: bool) -> Tuple[CommentStats, int, int, int, Optional[os.stat_result]]:
+        """
+        Clean a file in streaming mode, replacing it once the output is complete.
+        
+        Output of the original size is compared with the file, and the file
+        is only replaced if they differ.
+        
+        Args:
+            file_path: Path to the file to process
+            original_size: Size of the file in bytes
+            language: Language identifier of the file
+            encoding: Encoding of the file
+            bom_length: Length of the byte order mark at the start of the file
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules shared across files
+            backup: Whether to back the original up before replacing it
+            
+        Returns:
+            Tuple of (stats, original_lines, cleaned_lines, new_size, new_stat),
+            where new_stat is None if the file was left as it was
+        """
+        fd, temp_path = self._temp_file(file_path)
+        try:
+            stats = CommentStats(encoding)
+            with open(file_path, 'rb') as raw, open(fd, 'w', encoding=encoding) as writer:
+                raw.seek(bom_length)
+                reader = io.TextIOWrapper(raw, encoding=encoding)
+                if bom_length:
+                    writer.write('\ufeff')
+                original_lines, cleaned_lines = self.clean_stream(
+                    reader, writer, language, keep_doc_comments, matcher, stats
+                )
+                writer.flush()
+                new_stat = os.fstat(writer.fileno())
+            self._lap('stream')
+            if new_stat.st_size == original_size and filecmp.cmp(file_path, temp_path, shallow=False):
+                new_stat = None
+            else:
+                new_stat = self._replace(file_path, temp_path, backup)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        new_size = new_stat.st_size if new_stat is not None else original_size
+        return stats, original_lines, cleaned_lines, new_size, new_stat
+    
+    def _clean_mapped(self, file_path: str, mapped: mmap.mmap, encoding: str, language: str,
+                      keep_doc_comments: bool, matcher: PreservationMatcher,
+                      backup: bool) -> Optional[Tuple[CommentStats, int, int, int, Optional[os.stat_result]]]:
+        """
+        Clean a file by scanning its memory-mapped bytes a window at a time.
+        
+        Each window is scanned through a Latin-1 view, in which every byte is
+        one character, so the planned removals are byte offsets into the
+        mapping and only one window is ever copied. Without whitespace
+        clean-up the kept regions are written out as slices of the mapping;
+        with it, each window's output is cleaned up as bytes, never decoded
+        with the file's encoding. Nothing is written until the output first
+        differs from the file.
+        
+        Args:
+            file_path: Path to the file to process
+            mapped: The mapped file, without a byte order mark
+            encoding: Encoding of the file; ASCII characters must stand for themselves
+            language: Language identifier; its handler must support streaming
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules shared across files
+            backup: Whether to back the original up before replacing it
+            
+        Returns:
+            Tuple of (stats, original_lines, cleaned_lines, new_size, new_stat)
+            as for _stream_file, or None if the file has to be cleaned as
+            decoded text instead
+        """
+        handler = self._handlers[language]
+        settings = self.post_processor
+        
+        # The text path reads with universal newlines, which rewrites '\r'
+        if mapped.find(b'\r') != -1:
+            return None
+        # Stripping bytes only gives the same result as stripping text for ASCII whitespace
+        if settings.enabled:
+            wide_whitespace = PostProcessor.wide_whitespace(encoding)
+            if wide_whitespace is not None and wide_whitespace.search(mapped):
+                return None
+        if encoding != 'latin-1' and self._NON_ASCII_BYTES.search(mapped):
+            if not handler.byte_view_safe:
+                return None
+            matcher = ByteViewMatcher(matcher, encoding)
+        
+        # Byte counts are exact when every character is one byte
+        stats = CommentStats('latin-1')
+        post = PostProcessor(settings.strip_trailing_whitespace, settings.collapse_blank_lines)
+        size = len(mapped)
+        buffer = memoryview(mapped)
+        original_lines = cleaned_lines = 1
+        fd = -1
+        temp_path = None
+        try:
+            base = start = counted = 0
+            limit = min(size, self.chunk_size)
+            output_size = 0
+            while True:
+                final = limit >= size
+                window = buffer[base:limit]
+                view = codecs.latin_1_decode(window)[0]
+                original_lines += view.count('\n', counted - base)
+                counted = limit
+                
+                plan, stop = handler.scan(view, start - base, final, keep_doc_comments, matcher, stats)
+                self._lap('handler')
+                if post.enabled:
+                    # Clean-up needs the output in one piece; the view encodes
+                    # back to the same bytes as slicing the window would give
+                    output = post.feed(plan.apply(view, start - base, stop).encode('latin-1'))
+                    if final:
+                        output += post.flush()
+                    cleaned_lines += output.count(b'\n')
+                    pieces = [output] if output else []
+                    self._lap('post_process')
+                else:
+                    pieces = plan.buffer_slices(window, start - base, stop, encoding)
+                    cleaned_lines += view.count('\n', start - base, stop) - sum(
+                        view.count('\n', span_start, span_end) - replacement.count('\n')
+                        for span_start, span_end, replacement in plan.edits
+                    )
+                del view
+                
+                if fd == -1:
+                    # Compare with the file until the output first differs from it
+                    offset = output_size
+                    for piece in pieces:
+                        if buffer[offset:offset + len(piece)] != piece:
+                            fd, temp_path = self._temp_file(file_path)
+                            self._write_pieces(fd, [buffer[:output_size]] + pieces)
+                            break
+                        offset += len(piece)
+                else:
+                    self._write_pieces(fd, pieces)
+                output_size += sum(len(piece) for piece in pieces)
+                pieces = window = None
+                self._lap('write')
+                if final:
+                    break
+                
+                # Carry the unscanned tail over, with a little context before it
+                start = base + stop
+                context_start = max(start - self.STREAM_CONTEXT, 0)
+                line_start = mapped.rfind(b'\n', context_start, start)
+                base = line_start + 1 if line_start != -1 else context_start
+                # Read at least as much as is carried over, as clean_stream does
+                limit = min(size, limit + max(self.chunk_size, limit - start))
+            
+            if fd == -1 and output_size < size:
+                # The output is a proper prefix of the file
+                fd, temp_path = self._temp_file(file_path)
+                self._write_pieces(fd, [buffer[:output_size]])
+            new_stat = None
+            if fd != -1:
+                os.close(fd)
+                fd = -1
+                new_stat = self._replace(file_path, temp_path, backup)
+        finally:
+            buffer.release()
+            if fd != -1:
+                os.close(fd)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        return stats, original_lines, cleaned_lines, output_size, new_stat
+    
+    def _temp_file(self, file_path: str) -> Tuple[int, str]:
+        """
+        Create the temporary file that new content for a file is written to.
+        
+        Args:
+            file_path: Path to the file that will be replaced
+            
+        Returns:
+            Tuple of (file_descriptor, temp_path); the file is in the same
+            directory as the file a symbolic link points to, so it can be
+            renamed over it
+        """
+        directory = os.path.dirname(os.path.abspath(self._target(file_path)))
+        return tempfile.mkstemp(prefix='.ccp-', suffix='.tmp', dir=directory)
+    
+    @staticmethod
+    def _target(file_path: str) -> str:
+        """
+        Resolve the file that writing to a path changes.
+        
+        Args:
+            file_path: Path to a file, or to a symbolic link to one
+            
+        Returns:
+            The path itself, or the link's resolved target
+        """
+        return os.path.realpath(file_path) if os.path.islink(file_path) else file_path
+    
+    @staticmethod
+    def _write_pieces(fd: int, pieces: List[Any]) -> None:
+        """
+        Write bytes-like pieces to a file descriptor, with as few system calls as possible.
+        
+        Args:
+            fd: File descriptor to write to
+            pieces: Bytes-like objects to write, in order
+        """
+        if not pieces:
+            return
+        if not hasattr(os, 'writev'):
+            pieces = [b''.join(pieces)]
+        try:
+            batch_size = os.sysconf('SC_IOV_MAX')
+        except (ValueError, OSError, AttributeError):
+            batch_size = 1024
+        for offset in range(0, len(pieces), batch_size):
+            batch = pieces[offset:offset + batch_size]
+            written = os.writev(fd, batch) if len(batch) > 1 else os.write(fd, batch[0])
+            if written < sum(len(piece) for piece in batch):
+                # Short write: finish the rest of the batch piece by piece
+                for piece in batch:
+                    piece = memoryview(piece)
+                    if written >= len(piece):
+                        written -= len(piece)
+                        continue
+                    piece = piece[written:]
+                    written = 0
+                    while piece:
+                        piece = piece[os.write(fd, piece):]
+    
+    def _write_replacement(self, file_path: str, pieces: List[Any], backup: bool = False,
+                           original: Any = None) -> os.stat_result:
+        """
+        Write new content for a file to a temporary file and move it into place.
+        
+        The file is replaced in one rename, so it never holds partial output.
+        
+        Args:
+            file_path: Path to the file to replace
+            pieces: Bytes-like objects that make up the new content, in order
+            backup: Whether to back the original up before replacing it
+            original: The file's current bytes, if in memory, for the backup
+            
+        Returns:
+            Status of the new file
+        """
+        fd, temp_path = self._temp_file(file_path)
+        try:
+            self._write_pieces(fd, pieces)
+            os.close(fd)
+            fd = -1
+            new_stat = self._replace(file_path, temp_path, backup, original)
+        finally:
+            if fd != -1:
+                os.close(fd)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return new_stat
+    
+    def _replace(self, file_path: str, temp_path: str, backup: bool,
+                 original: Any = None) -> os.stat_result:
+        """
+        Move a finished temporary file over a file, backing the original up first.
+        
+        A symbolic link is left in place and the file it points to is
+        replaced. A file with other hard links is overwritten in place
+        instead, so that all its names keep sharing the new content; unlike
+        a rename, that is not atomic.
+        
+        Args:
+            file_path: Path to the file to replace
+            temp_path: Path of the new content, from _temp_file()
+            backup: Whether to back the original up
+            original: The file's current bytes, if in memory, for the backup
+            
+        Returns:
+            Status of the file after replacing it
+        """
+        target = self._target(file_path)
+        old_stat = os.stat(target)
+        if old_stat.st_nlink == 1:
+            # Ownership first: changing it can clear set-user-ID bits
+            try:
+                os.chown(temp_path, old_stat.st_uid, old_stat.st_gid)
+            except (AttributeError, PermissionError):
+                pass  # No os.chown on Windows; only root can give files away
+            os.chmod(temp_path, old_stat.st_mode & 0o7777)
+        if backup:
+            self._lap('write')
+            self.back_up(file_path, original)
+            self._lap('backup')
+        if old_stat.st_nlink == 1:
+            os.replace(temp_path, target)
+        else:
+            logger.info(f"  {old_stat.st_nlink} hard links; overwriting in place")
+            with open(temp_path, 'rb') as src, open(target, 'r+b') as dst:
+                shutil.copyfileobj(src, dst, ResultCache.HASH_CHUNK_SIZE)
+                dst.truncate()
+        self._lap('write')
+        return os.stat(target)
+    
+    def back_up(self, file_path: str, original: Any = None) -> None:
+        """
+        Back up a file that is about to be replaced.
+        
+        Args:
+            file_path: Path to the file
+            original: The file's current bytes, if in memory
+        """
+        if self.backup_store is not None:
+            digest = self.backup_store.save(file_path, original)
+            logger.info(f"  Backed up as {digest[:12]}")
+        else:
+            backup_path = file_path + '.bak'
+            shutil.copy2(file_path, backup_path)
+            logger.info(f"  Backup created: {backup_path}")
+    
+    def process_file(self, file_path: str, backup: bool = True, 
+                force: bool = False, preserve_todo: bool = False,
+                preserve_patterns: Optional[List[str]] = None,
+                keep_doc_comments: bool = False, check: bool = False,
+                matcher: Optional[PreservationMatcher] = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Process a single file to remove comments.
+        
+        Args:
+            file_path: Path to the file to process
+            backup: Whether to create a backup before modifying
+            force: Whether to process unknown file types
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
+            keep_doc_comments: Whether to preserve documentation comments
+            check: Whether to only look for removable comments, without writing
+                anything (see check_file)
+            matcher: Compiled preservation rules shared across files
+            
+        Returns:
+            Tuple of (success_flag, statistics_dict); on failure the dict only
+            holds the language and an error message, and it is None for
+            skipped files
+        """
+        started = time.perf_counter()
+        language = self.identify_language(file_path)
+        
+        # Skip unknown file types unless forced
+        if language == 'unknown' and not force:
+            logger.info(f"Skipping {file_path}: Unknown file type. Use --force to process anyway.")
+            return (False, None)
+        
+        if matcher is None:
+            matcher = PreservationMatcher.cached(preserve_todo, preserve_patterns)
+        if self.profile:
+            self._local.phases = {}
+            self._local.spans = [] if self.trace else None
+            self._local.lap = started
+        
+        if check:
+            result = self.check_file(file_path, language, keep_doc_comments, matcher, started)
+        else:
+            logger.info(f"Processing: {file_path} (detected as {language})")
+            if self.cache is not None:
+                result = self._clean_cached(file_path, language, backup, keep_doc_comments, matcher, started)
+            else:
+                result = self._clean_file(file_path, language, backup, keep_doc_comments, matcher, started)
+        
+        if self.profile:
+            self._lap('other')
+            phases = self._local.phases
+            self._local.phases = None
+            if result[1] is not None:
+                result[1]['phases'] = phases
+                if self.trace:
+                    # perf_counter is system-wide, so workers' times line up
+                    result[1]['trace'] = {
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                        'start': started,
+                        'end': self._local.lap,
+                        'spans': self._local.spans,
+                    }
+        return result
+    
+    def _lap(self, phase: str) -> None:
+        """
+        Charge the time since the previous lap to a phase of the current file.
+        
+        Does nothing unless profiling, or outside process_file.
+        
+        Args:
+            phase: Phase name, one of PhaseProfile.PHASES
+        """
+        if not self.profile:
+            return
+        phases = getattr(self._local, 'phases', None)
+        if phases is not None:
+            now = time.perf_counter()
+            phases[phase] = phases.get(phase, 0.0) + now - self._local.lap
+            if self._local.spans is not None:
+                self._local.spans.append((phase, self._local.lap, now))
+            self._local.lap = now
+    
+    def check_file(self, file_path: str, language: str, keep_doc_comments: bool,
+                   matcher: PreservationMatcher, started: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Look for a removable comment in a file without modifying it.
+        
+        The file is read and decoded once and scanned in memory only until
+        the first comment the current options would remove.
+        
+        Args:
+            file_path: Path to the file to check
+            language: Language identifier of the file
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            started: perf_counter() value when processing of the file started
+            
+        Returns:
+            Tuple of (success_flag, statistics_dict); the dict's 'offending'
+            entry tells whether a removable comment was found, and 'line',
+            'column' and 'comment' locate the first one
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            self._lap('read')
+            content, used_encoding, _ = self.decode(data)
+            if '\r' in content:
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
+            self._lap('decode')
+            
+            handler = self._handlers.get(language)
+            span = handler.first_removal(content, keep_doc_comments, matcher) if handler else None
+            self._lap('handler')
+        except PermissionError:
+            logger.error(f"  Error: Permission denied for {file_path}. Check file permissions.")
+            return False, {'language': language, 'error': 'Permission denied'}
+        except Exception as e:
+            logger.error(f"  Error checking {file_path}: {e}")
+            return False, {'language': language, 'error': str(e)}
+        
+        result = {
+            'language': language,
+            'encoding': used_encoding,
+            'offending': span is not None,
+            'seconds': time.perf_counter() - started
+        }
+        if span is not None:
+            start, end = span
+            line_start = content.rfind('\n', 0, start) + 1
+            result['line'] = content.count('\n', 0, start) + 1
+            result['column'] = start - line_start + 1
+            # First line of the comment, enough to recognise it in a report
+            comment = content[start:end]
+            result['comment'] = comment.split('\n', 1)[0][:self.CHECK_EXCERPT]
+            logger.warning(f"{file_path}:{result['line']}:{result['column']}: "
+                           f"removable comment: {result['comment']}")
+        return True, result
+    
+    def _clean_file(self, file_path: str, language: str, backup: bool, keep_doc_comments: bool,
+                    matcher: PreservationMatcher, started: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Clean a file of a known language in place.
+        
+        Args:
+            file_path: Path to the file to process
+            language: Language identifier of the file
+            backup: Whether to create a backup before modifying
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            started: perf_counter() value when processing of the file started
+            
+        Returns:
+            Tuple of (success_flag, statistics_dict), as for process_file
+        """
+        try:
+            # Statistics tracking
+            original_stat = os.stat(file_path)
+            original_size = original_stat.st_size
+            
+            handler = self._handlers.get(language)
+            streams = handler is not None and handler.supports_streaming
+            streaming = bool(self.stream_threshold and original_size > self.stream_threshold and streams)
+            
+            cleaned_by = None
+            mapped_scan = streams and self.bytes_engine
+            if original_size and (streaming or mapped_scan):
+                with open(file_path, 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    self._lap('read')
+                    used_encoding, bom_length = self.detect_encoding(mapped)
+                    self._lap('decode')
+                    if mapped_scan and not bom_length and used_encoding in self.ENCODINGS:
+                        # Scan the raw bytes where that gives the same output as decoding
+                        cleaned_by = self._clean_mapped(file_path, mapped, used_encoding, language,
+                                                        keep_doc_comments, matcher, backup)
+                    if cleaned_by is None and streaming:
+                        # Large file: clean it chunk by chunk into a temporary file
+                        logger.info(f"  Streaming {original_size} bytes in chunks of {self.chunk_size} characters")
+                        cleaned_by = self._stream_file(file_path, original_size, language, used_encoding,
+                                                       bom_length, keep_doc_comments, matcher, backup)
+            
+            if cleaned_by is not None:
+                stats, original_lines, cleaned_lines, new_size, new_stat = cleaned_by
+            else:
+                # Read the bytes once and decode them with the first encoding that fits
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                self._lap('read')
+                content, used_encoding, bom_length = self.decode(data)
+                if '\r' in content:
+                    # Same newline handling as reading the file in text mode
+                    content = content.replace('\r\n', '\n').replace('\r', '\n')
+                self._lap('decode')
+                
+                # Count original lines
+                original_lines = content.count('\n') + 1
+                
+                # Process content to remove comments, collecting exact statistics
+                stats = CommentStats(used_encoding)
+                cleaned = self.remove_comments(
+                    content, language, keep_doc_comments=keep_doc_comments, matcher=matcher, stats=stats
+                )
+                
+                # Count cleaned lines
+                cleaned_lines = cleaned.count('\n') + 1
+                
+                # Encode with the same encoding and newlines as text mode would
+                if os.linesep != '\n':
+                    cleaned = cleaned.replace('\n', os.linesep)
+                if bom_length:
+                    cleaned = '\ufeff' + cleaned
+                output = cleaned.encode(used_encoding)
+                new_size = len(output)
+                if output == data:
+                    new_stat = None
+                else:
+                    new_stat = self._write_replacement(file_path, [output], backup, data)
+            
+            lines_removed = original_lines - cleaned_lines
+            
+            # Calculate statistics
+            rewritten = new_stat is not None
+            if not rewritten:
+                logger.info("  Output unchanged; file not rewritten")
+                new_stat = original_stat
+            size_reduction = original_size - new_size
+            percentage = (size_reduction / original_size) * 100 if original_size > 0 else 0
+            
+            logger.info(f"  Removed {stats.removed} comments ({lines_removed} lines)")
+            if stats.preserved:
+                logger.info(f"  Preserved {stats.preserved} comments")
+            logger.info(f"  File size reduced by {size_reduction} bytes ({percentage:.1f}%)")
+            
+            return True, {
+                'language': language,
+                'encoding': used_encoding,
+                'bom': bool(bom_length),
+                'commentCount': stats.removed,
+                'commentsPreserved': stats.preserved,
+                'commentsByKind': stats.to_dict()['byKind'],
+                'linesRemoved': lines_removed,
+                'sizeReduction': size_reduction,
+                'sizePercentage': percentage,
+                'originalSize': original_size,
+                'newSize': new_size,
+                'rewritten': rewritten,
+                'mtimeNs': new_stat.st_mtime_ns,
+                'inode': new_stat.st_ino,
+                'seconds': time.perf_counter() - started
+            }
+        except UnicodeDecodeError as e:
+            logger.error(f"  Error: Unable to decode {file_path}. File may use unsupported encoding: {e}")
+            return False, {'language': language, 'error': f"Unable to decode: {e}"}
+        except PermissionError:
+            logger.error(f"  Error: Permission denied for {file_path}. Check file permissions.")
+            return False, {'language': language, 'error': 'Permission denied'}
+        except Exception as e:
+            # Files are only ever replaced whole, so the original is intact
+            logger.error(f"  Error processing {file_path}: {e}")
+            return False, {'language': language, 'error': str(e)}
+    
+    def output_options(self, matcher: PreservationMatcher, keep_doc_comments: bool) -> List[Any]:
+        """
+        List the options that affect cleaned output, for cache keys and manifests.
+        
+        Args:
+            matcher: Compiled preservation rules
+            keep_doc_comments: Whether to preserve documentation comments
+            
+        Returns:
+            JSON-serializable list of option values
+        """
+        return [
+            matcher.preserve_todo,
+            [p for p in matcher.preserve_patterns if p not in matcher.invalid_patterns],
+            keep_doc_comments,
+            self.post_processor.strip_trailing_whitespace,
+            self.post_processor.collapse_blank_lines,
+        ]
+    
+    def _clean_cached(self, file_path: str, language: str, backup: bool, keep_doc_comments: bool,
+                      matcher: PreservationMatcher, started: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Clean a file through the result cache.
+        
+        A file whose cleaned output is its own content is left untouched. A
+        copy of a file cleaned before takes the cleaned output from that
+        file. Anything else is cleaned, and the result is recorded. Threads
+        cleaning identical files wait for the first one instead of repeating
+        its work.
+        
+        Args:
+            file_path: Path to the file to process
+            language: Language identifier of the file
+            backup: Whether to create a backup before modifying
+            keep_doc_comments: Whether to preserve documentation comments
+            matcher: Compiled preservation rules
+            started: perf_counter() value when processing of the file started
+            
+        Returns:
+            Tuple of (success_flag, statistics_dict), as for process_file
+        """
+        try:
+            content_hash = ResultCache.hash_file(file_path)
+        except OSError:
+            # Report the error the same way as without a cache
+            return self._clean_file(file_path, language, backup, keep_doc_comments, matcher, started)
+        
+        key = self.cache.key(content_hash, language, self.output_options(matcher, keep_doc_comments))
+        claimed = self.cache.claim(key)
+        try:
+            hit = self.cache.get(key)
+            self._lap('cache')
+            if hit is not None:
+                stats = self._reuse_cached(file_path, content_hash, hit, backup)
+                if stats is not None:
+                    new_stat = os.stat(file_path)
+                    stats['mtimeNs'] = new_stat.st_mtime_ns
+                    stats['inode'] = new_stat.st_ino
+                    stats['seconds'] = time.perf_counter() - started
+                    return True, stats
+            
+            success, stats = self._clean_file(file_path, language, backup, keep_doc_comments, matcher, started)
+            if success:
+                self.cache.put(key, ResultCache.hash_file(file_path), stats, os.path.abspath(file_path))
+                self._lap('cache')
+            return success, stats
+        finally:
+            if claimed:
+                self.cache.release(key)
+    
+    def _reuse_cached(self, file_path: str, content_hash: str, hit: Tuple[str, Dict[str, Any], str],
+                      backup: bool) -> Optional[Dict[str, Any]]:
+        """
+        Apply a cached result to a file without cleaning it.
+        
+        Args:
+            file_path: Path to the file to process
+            content_hash: SHA-256 of the file's current bytes
+            hit: Tuple of (output_hash, stats, source_path) from the cache
+            backup: Whether to create a backup before modifying
+            
+        Returns:
+            Statistics of the cached run, with 'cached' set and 'rewritten'
+            telling whether this run wrote the file, or None if the cleaned
+            output is no longer available and the file has to be cleaned
+        """
+        output_hash, stats, source = hit
+        stats['rewritten'] = output_hash != content_hash
+        if output_hash == content_hash:
+            logger.info(f"  Already clean (cached); nothing to write")
+        else:
+            # Copy the cleaned output next to the file and check that the
+            # source still holds it before moving it into place
+            fd, temp_path = self._temp_file(file_path)
+            os.close(fd)
+            try:
+                try:
+                    shutil.copyfile(source, temp_path)
+                except OSError:
+                    return None
+                if ResultCache.hash_file(temp_path) != output_hash:
+                    return None
+                self._replace(file_path, temp_path, backup)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            logger.info(f"  Reused cleaned output of {source}")
+        
+        logger.info(f"  Removed {stats['commentCount']} comments ({stats['linesRemoved']} lines)")
+        stats['cached'] = True
+        return stats
+
+
+class PhaseProfile:
+    """
+    Per-phase timings of a batch, by language.
+    
+    Built from the 'phases' entry of each file's statistics, so timings
+    from worker processes come back with the results and need no shared
+    state. report() prints totals, percentiles and a log-scale histogram
+    for every phase.
+    """
+    
+    PHASES = ('read', 'decode', 'cache', 'handler', 'post_process', 'stream', 'backup', 'write', 'other')
+    # Upper bounds of the histogram buckets in seconds: 10 us, then each 4x the last
+    BUCKETS = tuple(1e-5 * 4 ** i for i in range(9))
+    BARS = ' ▁▂▃▄▅▆▇█'
+    
+    def __init__(self):
+        """Initialize empty timings."""
+        self.samples: Dict[str, Dict[str, List[float]]] = {}
+    
+    def add(self, language: str, phases: Dict[str, float]) -> None:
+        """
+        Add one file's phase timings.
+        
+        Args:
+            language: Language identifier of the file
+            phases: Seconds spent in each phase
+        """
+        by_phase = self.samples.setdefault(language, {})
+        for phase, seconds in phases.items():
+            by_phase.setdefault(phase, []).append(seconds)
+    
+    def report(self) -> None:
+        """Log the timings of every language, then of all files together."""
+        if not self.samples:
+            return
+        combined: Dict[str, List[float]] = {}
+        for by_phase in self.samples.values():
+            for phase, values in by_phase.items():
+                combined.setdefault(phase, []).extend(values)
+        
+        labels = ' '.join(f"<{self._duration(bound):>5}" for bound in self.BUCKETS)
+        logger.info(f"\nPhase timings (histogram buckets: {labels} >=)")
+        for language in sorted(self.samples):
+            self._report_group(language, self.samples[language])
+        if len(self.samples) > 1:
+            self._report_group('all languages', combined)
+    
+    def _report_group(self, name: str, by_phase: Dict[str, List[float]]) -> None:
+        """
+        Log the timings of one group of files.
+        
+        Args:
+            name: Name of the group
+            by_phase: Samples of each phase
+        """
+        files = max(len(values) for values in by_phase.values())
+        logger.info(f"{name} ({files} files):")
+        for phase in self.PHASES:
+            values = sorted(by_phase.get(phase, ()))
+            if not values:
+                continue
+            counts = [0] * (len(self.BUCKETS) + 1)
+            for value in values:
+                index = 0
+                while index < len(self.BUCKETS) and value >= self.BUCKETS[index]:
+                    index += 1
+                counts[index] += 1
+            peak = max(counts)
+            bars = ''.join(self.BARS[(count * (len(self.BARS) - 1) + peak - 1) // peak] for count in counts)
+            p50 = values[(len(values) - 1) // 2]
+            p99 = values[min(len(values) - 1, len(values) * 99 // 100)]
+            logger.info(f"  {phase:<13} total {sum(values):8.3f} s  p50 {self._duration(p50):>6}  "
+                        f"p99 {self._duration(p99):>6}  max {self._duration(values[-1]):>6}  |{bars}|")
+    
+    @staticmethod
+    def _duration(seconds: float) -> str:
+        """
+        Format a duration compactly.
+        
+        Args:
+            seconds: Duration in seconds
+            
+        Returns:
+            The duration in us, ms or s
+        """
+        if seconds < 1e-3:
+            return f"{seconds * 1e6:.0f}us"
+        if seconds < 1:
+            return f"{seconds * 1e3:.3g}ms"
+        return f"{seconds:.3g}s"
+
+
+class TraceRecorder:
+    """
+    Timeline of a batch in Chrome's trace event format.
+    
+    Built from the 'trace' entry of each file's statistics, like
+    PhaseProfile, and written as JSON that chrome://tracing and Perfetto
+    load. Every worker thread or process gets a track with a span for each
+    file and, nested in it, a span for each phase; the main thread's track
+    holds the whole batch and counters of the files still queued and the
+    bytes being processed.
+    """
+    
+    def __init__(self, sizes: Dict[str, int], executor: str):
+        """
+        Start recording; times are relative to now.
+        
+        Args:
+            sizes: Size in bytes of each file in the batch
+            executor: 'thread' or 'process', to name the worker tracks
+        """
+        self.origin = time.perf_counter()
+        self.sizes = sizes
+        self.executor = executor
+        self.pid = os.getpid()
+        self.tracks: Dict[Tuple[int, int], int] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.files: List[Tuple[float, float, int]] = []
+    
+    def add(self, file_path: str, language: str, trace: Dict[str, Any]) -> None:
+        """
+        Add one file's spans.
+        
+        Args:
+            file_path: Path to the file
+            language: Language identifier of the file
+            trace: The file's 'trace' statistics: pid and tid of the worker,
+                start and end times and (phase, start, end) spans
+        """
+        worker = (trace['pid'], trace['tid'])
+        tid = self.tracks.get(worker)
+        if tid is None:
+            tid = self.tracks[worker] = len(self.tracks) + 1
+            name = f"worker {tid}"
+            if self.executor == 'process':
+                name += f" (pid {trace['pid']})"
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                'args': {'name': name}})
+        
+        size = self.sizes.get(file_path, 0)
+        self.files.append((trace['start'], trace['end'], size))
+        self.events.append(self._span(os.path.basename(file_path), 'file', tid, trace['start'],
+                                      trace['end'], {'path': file_path, 'language': language,
+                                                     'bytes': size}))
+        for phase, start, end in trace['spans']:
+            self.events.append(self._span(phase, 'phase', tid, start, end))
+    
+    def save(self, path: str) -> None:
+        """
+        Write the trace, adding the batch span and the counters.
+        
+        Args:
+            path: File to write the trace to
+        """
+        end = time.perf_counter()
+        events = [
+            {'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'ccp'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'main'}},
+            self._span('batch', 'batch', 0, self.origin, end, {'files': len(self.sizes)}),
+        ]
+        events.extend(self.events)
+        
+        # A file leaves the queue when a worker starts it and is in flight until
+        # it is done; files skipped before they were opened have no times
+        changes = []
+        for start, finish, size in self.files:
+            changes.append((start, -1, size))
+            changes.append((finish, 0, -size))
+        changes.sort(key=lambda change: change[0])
+        queued = len(self.files)
+        in_flight = 0
+        events.extend(self._counters(self.origin, queued, in_flight))
+        for when, dequeued, size in changes:
+            queued += dequeued
+            in_flight += size
+            events.extend(self._counters(when, queued, in_flight))
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, separators=(',', ':'))
+        logger.info(f"Wrote a trace of {len(self.files)} files to {path}")
+    
+    def _span(self, name: str, category: str, tid: int, start: float, end: float,
+              args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Build a complete event.
+        
+        Args:
+            name: Name of the span
+            category: Category of the span
+            tid: Track to put the span on
+            start: perf_counter() time the span started
+            end: perf_counter() time the span ended
+            args: Details shown with the span, or None
+            
+        Returns:
+            The trace event
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                 'ts': self._timestamp(start), 'dur': round((end - start) * 1e6, 3)}
+        if args:
+            event['args'] = args
+        return event
+    
+    def _counters(self, when: float, queued: int, in_flight: int) -> List[Dict[str, Any]]:
+        """
+        Build the counter events for one point in time.
+        
+        Args:
+            when: perf_counter() time of the values
+            queued: Files not yet started
+            in_flight: Bytes of the files being processed
+            
+        Returns:
+            The trace events
+        """
+        ts = self._timestamp(when)
+        return [{'name': 'queued files', 'ph': 'C', 'pid': self.pid, 'tid': 0, 'ts': ts,
+                 'args': {'files': queued}},
+                {'name': 'bytes in flight', 'ph': 'C', 'pid': self.pid, 'tid': 0, 'ts': ts,
+                 'args': {'bytes': in_flight}}]
+    
+    def _timestamp(self, when: float) -> float:
+        """
+        Convert a perf_counter() time to microseconds since recording started.
+        
+        Args:
+            when: perf_counter() time
+            
+        Returns:
+            Trace timestamp
+        """
+        return round((when - self.origin) * 1e6, 3)
+
+
+class BatchProcessor:
+    """
+    Handles batch processing of multiple files with progress tracking.
+    
+    Manages parallel execution and aggregates results.
+    """
+    
+    EXECUTORS = ('thread', 'process')
+    
+    # Batches per worker to aim for, so that workers finishing early can pick
+    # up more work, and a cap on the number of small files in one batch
+    BATCHES_PER_WORKER = 4
+    MAX_BATCH_FILES = 256
+    
+    # Seconds to wait for a record before checking for finished batches, and
+    # for records from worker processes still in transit once every batch is done
+    RESULT_POLL_INTERVAL = 0.05
+    RESULT_DRAIN_TIMEOUT = 1.0
+    
+    # Automatic worker sizing: number of files timed to estimate the ratio of
+    # I/O time to CPU time, bytes read from the start of each, and an upper
+    # bound on the worker count
+    SAMPLE_FILES = 8
+    SAMPLE_BYTES = 256 * 1024
+    MAX_AUTO_WORKERS = 64
+    # Fewest threads chosen automatically; the fixed thread count before sizing was automatic
+    MIN_AUTO_THREADS = 4
+    
+    def __init__(self, remover: CommentRemover, max_workers: Optional[int] = None,
+                 executor: str = 'thread', profile: bool = False,
+                 profile_output: Optional[str] = None, trace_output: Optional[str] = None):
+        """
+        Initialize the batch processor.
+        
+        Args:
+            remover: CommentRemover instance to use for processing
+            max_workers: Maximum number of parallel workers, or None to choose
+                from the CPU count and the measured I/O-to-CPU time ratio
+            executor: 'thread' to share one remover between threads, or 'process'
+                to run workers in separate processes, each with its own remover
+            profile: Whether to time the phases of every file and log
+                histograms of them per language after the batch; turns on
+                the remover's profiling
+            profile_output: File to write cProfile data, collected in every
+                worker and merged, to in pstats format, or None
+            trace_output: File to write a timeline of the batch to in Chrome's
+                trace event format, or None; turns on the remover's tracing
+        """
+        if executor not in self.EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+        self.remover = remover
+        self.max_workers = max_workers
+        self.executor = executor
+        self.profile = profile
+        self.profile_output = profile_output
+        self.trace_output = trace_output
+        if profile:
+            remover.profile = True
+        if trace_output:
+            remover.profile = True
+            remover.trace = True
+    
+    def process_files(self, files: List[str], backup: bool = True, force: bool = False,
+                    preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None,
+                    keep_doc_comments: bool = False,
+                    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    manifest: Optional[Manifest] = None,
+                    check: bool = False,
+                    cancel: Optional[threading.Event] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Process multiple files in parallel.
+        
+        Files are dispatched largest first, with small files grouped into
+        batches, so that no large file is left to run alone at the end.
+        
+        Args:
+            files: List of file paths to process
+            backup: Whether to create backup files
+            force: Whether to process unknown file types
+            preserve_todo: Whether to preserve TODO and FIXME comments
+            preserve_patterns: List of regex patterns for comments to preserve
+            keep_doc_comments: Whether to preserve documentation comments
+            on_result: Called in this thread with each file's record as soon as
+                the file is done: path, status ('cleaned', 'skipped', 'error'
+                or 'unchanged') and the statistics or error message
+            manifest: Manifest of an incremental run; files it lists as
+                unchanged are skipped without being opened, and it is updated
+                with the results (the caller saves it)
+            check: Whether to only report files with removable comments,
+                without writing anything; records then have the status
+                'offending' or 'clean' instead of 'cleaned'
+            cancel: Event that stops the batch once set: batches not yet
+                started are dropped, and threads stop before their next
+                file. Files left out this way get no record.
+            
+        Returns:
+            Tuple of (success_count, results_list)
+        """
+        if not files:
+            return (0, [])
+            
+        success_count = 0
+        results = []
+        
+        total_files = len(files)
+        
+        # Compile the preservation rules once for the whole batch
+        matcher = PreservationMatcher.cached(preserve_todo, preserve_patterns)
+        options = (backup, force, preserve_todo, preserve_patterns, keep_doc_comments, check)
+        
+        if manifest is not None:
+            options_hash = Manifest.options_hash(
+                self.remover.output_options(matcher, keep_doc_comments) + [force])
+            pending = []
+            for file_path in files:
+                try:
+                    unchanged = manifest.unchanged(file_path, os.stat(file_path), options_hash)
+                except OSError:
+                    unchanged = False  # process_file reports the error
+                if not unchanged:
+                    pending.append(file_path)
+                elif on_result is not None:
+                    on_result({'path': file_path, 'status': 'unchanged'})
+            if len(pending) < len(files):
+                logger.info(f"Skipping {len(files) - len(pending)} files unchanged since the last run")
+            files = pending
+            total_files = len(files)
+            if not files:
+                logger.info("Done! No files changed since the last run.")
+                return (0, [])
+        
+        sizes = self._file_sizes(files)
+        workers = self.max_workers
+        if workers is None:
+            workers = self.auto_workers(files, sizes, matcher, keep_doc_comments, check)
+        batches = self.schedule(files, sizes, workers)
+        workers = max(1, min(workers, len(batches)))
+        
+        unit = 'processes' if self.executor == 'process' else 'threads'
+        logger.info(f"Processing {total_files} files with {workers} {unit}")
+        
+        phase_profile = PhaseProfile() if self.profile else None
+        recorder = TraceRecorder(dict(zip(files, sizes)), self.executor) if self.trace_output else None
+        profiles: Optional[List[Dict[Any, Any]]] = [] if self.profile_output else None
+        # Since Python 3.12 one profiler sees every thread, and only one can be active
+        shared_profiler = None
+        if profiles is not None and self.executor == 'thread' and sys.version_info >= (3, 12):
+            shared_profiler = cProfile.Profile()
+            shared_profiler.enable()
+        
+        if self.executor == 'process':
+            outcomes = self._run_in_processes(batches, workers, options, matcher, profiles, cancel)
+        else:
+            outcomes = self._run_in_threads(batches, workers, options, matcher,
+                                            profiles if shared_profiler is None else None, cancel)
+        
+        # Process as they complete
+        processed = 0
+        
+        for file_path, success, stats, error in outcomes:
+            processed += 1
+            
+            if phase_profile is not None and stats and 'phases' in stats:
+                phase_profile.add(stats['language'], stats['phases'])
+            if stats and 'trace' in stats:
+                trace = stats.pop('trace')
+                if recorder is not None:
+                    recorder.add(file_path, stats['language'], trace)
+            
+            if on_result is not None:
+                if success and check:
+                    status = 'offending' if stats['offending'] else 'clean'
+                elif success:
+                    status = 'cleaned'
+                elif error is not None or (stats and 'error' in stats):
+                    status = 'error'
+                else:
+                    status = 'skipped'
+                record = {'path': file_path, 'status': status}
+                record.update(stats or {})
+                if error is not None:
+                    record['error'] = error
+                on_result(record)
+            
+            if error is not None:
+                logger.error(f"Error processing {file_path}: {error}")
+                continue
+            
+            if success:
+                success_count += 1
+                results.append(stats)
+            
+            if manifest is not None:
+                if success:
+                    manifest.record(file_path, stats['newSize'], stats['mtimeNs'], stats['inode'], options_hash)
+                else:
+                    manifest.forget(file_path)
+            
+            # Show progress
+            logger.info(f"Progress: {processed}/{total_files} files ({(processed/total_files)*100:.1f}%)")
+        
+        if shared_profiler is not None:
+            shared_profiler.disable()
+            shared_profiler.create_stats()
+            profiles.append(shared_profiler.stats)
+        if phase_profile is not None:
+            phase_profile.report()
+        if profiles:
+            self._save_profile(profiles)
+        if recorder is not None:
+            recorder.save(self.trace_output)
+        
+        if check:
+            offending = sum(1 for r in results if r['offending'])
+            logger.info(f"\nChecked {success_count} of {len(files)} files: "
+                        f"{offending} with removable comments")
+            return (success_count, results)
+        
+        # Show summary statistics
+        if results:
+            total_comments = sum(r['commentCount'] for r in results)
+            total_lines = sum(r['linesRemoved'] for r in results)
+            total_reduction = sum(r['sizeReduction'] for r in results)
+            total_preserved = sum(r.get('commentsPreserved', 0) for r in results)
+            logger.info(f"\nSummary:")
+            logger.info(f"- Removed {total_comments} comments")
+            if total_preserved:
+                logger.info(f"- Preserved {total_preserved} comments")
+            logger.info(f"- Removed {total_lines} lines of comments")
+            logger.info(f"- Reduced file sizes by {total_reduction} bytes")
+        
+        logger.info(f"Done! Successfully processed {success_count} of {len(files)} files.")
+        
+        return (success_count, results)
+    
+    def schedule(self, files: List[str], sizes: List[int], workers: int) -> List[List[str]]:
+        """
+        Order files largest first and group small files into batches.
+        
+        Files at least as large as the per-batch share of the total size run
+        as batches of their own; smaller files are packed into batches of up
+        to that size. Handing batches to workers in this order is the
+        longest-processing-time-first rule, which keeps the slowest worker
+        close to the average.
+        
+        Args:
+            files: List of file paths
+            sizes: Size of each file in bytes
+            workers: Number of workers the batches are for
+            
+        Returns:
+            List of batches of file paths, in dispatch order
+        """
+        order = sorted(range(len(files)), key=lambda index: sizes[index], reverse=True)
+        target = max(sum(sizes) / (workers * self.BATCHES_PER_WORKER), 1)
+        
+        batches = []
+        batch: List[str] = []
+        batch_size = 0
+        for index in order:
+            size = sizes[index]
+            if size >= target:
+                batches.append([files[index]])
+                continue
+            if batch and (batch_size + size > target or len(batch) >= self.MAX_BATCH_FILES):
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+            batch.append(files[index])
+            batch_size += size
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def auto_workers(self, files: List[str], sizes: List[int], matcher: PreservationMatcher,
+                     keep_doc_comments: bool = False, check: bool = False) -> int:
+        """
+        Choose a worker count from the CPU count and a timed sample of files.
+        
+        The first SAMPLE_BYTES of a few files are read and cleaned in memory,
+        without writing anything, to measure how long a file spends waiting
+        on I/O compared to running on the CPU. While one worker waits,
+        another can run, so the count is cores * (1 + io_time / cpu_time).
+        Threads share one core for the handlers' Python code, so for threads
+        only the waiting overlaps, and at least MIN_AUTO_THREADS are used.
+        Files that would be streamed are not sampled, and batches too small
+        to share out are not sampled at all.
+        
+        Args:
+            files: List of file paths
+            sizes: Size of each file in bytes
+            matcher: Compiled preservation rules for the batch
+            keep_doc_comments: Whether to preserve documentation comments
+            check: Whether the files are only read, not written back
+            
+        Returns:
+            Number of workers to use
+        """
+        cores = os.cpu_count() or 1
+        parallel = cores if self.executor == 'process' else 1
+        limit = min(self.MAX_AUTO_WORKERS, cores * 4)
+        floor = 1 if self.executor == 'process' else min(self.MIN_AUTO_THREADS, limit)
+        
+        # Sampling costs about as much as the work it would spread out
+        if len(files) <= self.SAMPLE_FILES or len(self.schedule(files, sizes, limit)) <= 1:
+            return max(floor, min(parallel, limit))
+        
+        # Spread the sample over the size range, leaving out streamed files
+        threshold = self.remover.stream_threshold
+        order = sorted((index for index in range(len(files)) if not threshold or sizes[index] <= threshold),
+                       key=lambda index: sizes[index])
+        step = max(len(order) // self.SAMPLE_FILES, 1)
+        io_time = cpu_time = 0.0
+        for index in order[::step][:self.SAMPLE_FILES]:
+            language = self.remover.identify_language(files[index])
+            if language == 'unknown':
+                continue
+            try:
+                started = time.perf_counter()
+                with open(files[index], 'rb') as f:
+                    data = f.read(self.SAMPLE_BYTES)
+                read = time.perf_counter()
+                content = self.remover.decode(data)[0]
+                self.remover.remove_comments(content, language, matcher=matcher,
+                                             keep_doc_comments=keep_doc_comments)
+                cleaned = time.perf_counter()
+            except (OSError, ValueError):
+                continue
+            # Writing the result back costs about as much as reading it
+            io_time += (1 if check else 2) * (read - started)
+            cpu_time += cleaned - read
+        
+        ratio = io_time / cpu_time if cpu_time > 0 else 0.0
+        workers = int(parallel * (1 + ratio) + 0.5)
+        return max(floor, min(workers, limit))
+    
+    def _file_sizes(self, files: List[str]) -> List[int]:
+        """
+        Stat the files up front for scheduling.
+        
+        Args:
+            files: List of file paths
+            
+        Returns:
+            Size of each file in bytes, 0 if it cannot be read
+        """
+        sizes = []
+        for file_path in files:
+            try:
+                sizes.append(os.path.getsize(file_path))
+            except OSError:
+                sizes.append(0)  # process_file reports the error
+        return sizes
+    
+    def _run_in_threads(self, batches: List[List[str]], workers: int, options: Tuple[Any, ...],
+                        matcher: PreservationMatcher, profiles: Optional[List[Dict[Any, Any]]] = None,
+                        cancel: Optional[threading.Event] = None):
+        """
+        Process batches on a thread pool that shares this processor's remover.
+        
+        Args:
+            batches: Batches of file paths, in dispatch order
+            workers: Number of threads
+            options: Positional process_file options after the file path
+            matcher: Compiled preservation rules for the batch
+            profiles: List to add the cProfile statistics of every batch to,
+                or None not to profile the threads
+            cancel: Event that stops the threads before their next file, or None
+            
+        Yields:
+            Tuple of (file_path, success, stats, error) per file, as files complete
+        """
+        results: 'queue.Queue[Any]' = queue.Queue()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Submit all batches, largest first
+            future_to_batch = {
+                executor.submit(_process_batch, self.remover, matcher, batch, options, results,
+                                profiles is not None, cancel): batch
+                for batch in batches
+            }
+            # A thread puts every record before its batch is done, so nothing is in transit
+            yield from self._collect(future_to_batch, results, profiles, cancel, drain_timeout=0)
+    
+    def _run_in_processes(self, batches: List[List[str]], workers: int, options: Tuple[Any, ...],
+                          matcher: PreservationMatcher, profiles: Optional[List[Dict[Any, Any]]] = None,
+                          cancel: Optional[threading.Event] = None):
+        """
+        Process batches on a process pool.
+        
+        Each worker builds its own remover and preservation rules once, in the
+        pool initializer. Only file paths go to the workers and only result
+        records come back; file contents never cross process boundaries.
+        
+        Args:
+            batches: Batches of file paths, in dispatch order
+            workers: Number of processes
+            options: Positional process_file options after the file path
+            matcher: Compiled preservation rules for the batch
+            profiles: List to add the cProfile statistics of every batch to,
+                or None not to profile the workers
+            cancel: Event that drops the batches not yet started, or None
+            
+        Yields:
+            Tuple of (file_path, success, stats, error) per file, as files complete
+        """
+        # Patterns were already validated here; don't warn again in every worker
+        valid_patterns = [p for p in matcher.preserve_patterns if p not in matcher.invalid_patterns]
+        # The results queue is inherited by the workers when they start
+        context = multiprocessing.get_context()
+        results = context.Queue()
+        initargs = (self.remover.settings(), matcher.preserve_todo, valid_patterns, logger.level, results)
+        
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                        initializer=_init_process_worker,
+                                                        initargs=initargs) as executor:
+                future_to_batch = {
+                    executor.submit(_process_worker_batch, batch, options, profiles is not None): batch
+                    for batch in batches
+                }
+                yield from self._collect(future_to_batch, results, profiles, cancel,
+                                         self.RESULT_DRAIN_TIMEOUT)
+        finally:
+            results.close()
+    
+    def _collect(self, future_to_batch: Dict[Any, List[str]], results: Any,
+                 profiles: Optional[List[Dict[Any, Any]]], cancel: Optional[threading.Event],
+                 drain_timeout: float):
+        """
+        Yield the records workers put on the results queue, as each file is done.
+        
+        Args:
+            future_to_batch: Batch of file paths of each submitted future
+            results: Queue the workers put a record on per file
+            profiles: List to add the cProfile statistics of every batch to, or None
+            cancel: Event on which batches not yet started are cancelled, or None
+            drain_timeout: Seconds to wait for records still in transit once
+                every batch is done
+            
+        Yields:
+            Tuple of (file_path, success, stats, error) per file
+        """
+        pending = set(future_to_batch)
+        expected = sum(len(batch) for batch in future_to_batch.values())
+        received = 0
+        seen: Set[str] = set()
+        failed = []
+        
+        while received < expected:
+            try:
+                # Records of finished batches may still be in transit, so only
+                # stop waiting for them once every batch is done
+                record = results.get(timeout=self.RESULT_POLL_INTERVAL if pending else drain_timeout)
+            except queue.Empty:
+                if not pending:
+                    break
+                record = None
+            if record is not None:
+                received += 1
+                seen.add(record[0])
+                yield record
+                continue
+            
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+            for future in [future for future in pending if future.done()]:
+                pending.discard(future)
+                if future.cancelled():
+                    continue
+                try:
+                    profile_stats = future.result()
+                    if profile_stats is not None and profiles is not None:
+                        profiles.append(profile_stats)
+                except Exception as e:
+                    # The worker died; the files it did not get to are reported below
+                    failed.append((future_to_batch[future], str(e)))
+        
+        for batch, error in failed:
+            for file_path in batch:
+                if file_path not in seen:
+                    yield (file_path, False, None, error)
+    
+    def _save_profile(self, profiles: List[Dict[Any, Any]]) -> None:
+        """
+        Merge the cProfile statistics of all workers into one pstats file.
+        
+        Args:
+            profiles: Raw statistics of each profiled batch
+        """
+        merged = pstats.Stats(_ProfileData(profiles[0]))
+        for profile_stats in profiles[1:]:
+            merged.add(_ProfileData(profile_stats))
+        merged.dump_stats(self.profile_output)
+        logger.info(f"Wrote cProfile data of {len(profiles)} batches to {self.profile_output}")
+
+
+class _ProfileData:
+    """Raw cProfile statistics in the form pstats.Stats loads them from a profiler."""
+    
+    def __init__(self, stats: Dict[Any, Any]):
+        self.stats = stats
+    
+    def create_stats(self) -> None:
+        pass
+
+
+# Per-process state for BatchProcessor's process pool, set by _init_process_worker
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_process_worker(settings: Dict[str, Any], preserve_todo: bool,
+                         preserve_patterns: List[str], log_level: int, results: Any) -> None:
     """
+    Build the remover and preservation rules once per worker process.
     
-    def __init__(self):
-        """Initialize with handlers for each supported language."""
-        self._handlers = {
-            'python': PythonCommentHandler(),
-            'html': HtmlCommentHandler(),
-            'javascript': CStyleCommentHandler('javascript'),
-            'typescript': CStyleCommentHandler('typescript'),
-            'c': CStyleCommentHandler('c'),
-            'cpp': CStyleCommentHandler('cpp'),
-            'java': CStyleCommentHandler('java'),
-            'css': CStyleCommentHandler('css'),
-            'go': CStyleCommentHandler('go'),
-            'swift': CStyleCommentHandler('swift'),
-            'rust': CStyleCommentHandler('rust'),
-            'kotlin': CStyleCommentHandler('kotlin'),
-            'dart': CStyleCommentHandler('dart'),
-            'bash': HashCommentHandler('bash', preserve_shebang=True),
-            'yaml': HashCommentHandler('yaml'),
-            'r': HashCommentHandler('r'),
-            'powershell': PowerShellCommentHandler(),
-            'lua': LuaCommentHandler(),
-            'perl': PerlCommentHandler(),
-            'ruby': RubyCommentHandler(),
-            'php': PhpCommentHandler(),
-            'sql': SqlCommentHandler(),
-            'haskell': HaskellCommentHandler(),
-            'matlab': MatlabCommentHandler(),
-            'csharp': CSharpCommentHandler(),
+    Args:
+        settings: CommentRemover constructor arguments
+        preserve_todo: Whether to preserve TODO and FIXME comments
+        preserve_patterns: List of regex patterns for comments to preserve
+        log_level: Logging level of the parent process
+        results: Queue to put each file's record on
+    """
+    logger.setLevel(log_level)
+    _WORKER_STATE['remover'] = CommentRemover(**settings)
+    _WORKER_STATE['matcher'] = PreservationMatcher.cached(preserve_todo, preserve_patterns)
+    _WORKER_STATE['results'] = results
+
+
+def _process_worker_batch(files: List[str], options: Tuple[Any, ...],
+                          profile: bool = False) -> Optional[Dict[Any, Any]]:
+    """
+    Process a batch of files in a worker process.
+    
+    Args:
+        files: File paths to process
+        options: Positional process_file options after the file path
+        profile: Whether to run the batch under cProfile
+        
+    Returns:
+        The raw cProfile statistics or None, as for _process_batch
+    """
+    return _process_batch(_WORKER_STATE['remover'], _WORKER_STATE['matcher'], files, options,
+                          _WORKER_STATE['results'], profile)
+
+
+def _process_batch(remover: CommentRemover, matcher: PreservationMatcher, files: List[str],
+                   options: Tuple[Any, ...], results: Any, profile: bool = False,
+                   cancel: Optional[threading.Event] = None) -> Optional[Dict[Any, Any]]:
+    """
+    Process a batch of files one after another.
+    
+    Args:
+        remover: CommentRemover to process the files with
+        matcher: Compiled preservation rules
+        files: File paths to process
+        options: Positional process_file options after the file path
+        results: Queue to put a (file_path, success, stats, error) record on
+            as soon as each file is done
+        profile: Whether to run the batch under cProfile
+        cancel: Event that stops the batch before its next file, or None
+        
+    Returns:
+        The raw cProfile statistics of the batch, or None
+    """
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    try:
+        for file_path in files:
+            if cancel is not None and cancel.is_set():
+                break
+            try:
+                success, stats = remover.process_file(file_path, *options, matcher=matcher)
+                record = (file_path, success, stats, None)
+            except Exception as e:
+                record = (file_path, False, None, str(e))
+            results.put(record)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    
+    if profiler is None:
+        return None
+    profiler.create_stats()
+    return profiler.stats
+
+
+class CleanServer:
+    """
+    Long-running worker that serves cleaning requests over stdin/stdout.
+    
+    Reads one JSON-RPC 2.0 request per line from stdin and writes one
+    response per line to stdout; log output goes to stderr. Removers,
+    lexer tables and preservation rules stay compiled between requests,
+    so each request only pays for the work itself.
+    
+    Methods:
+        clean: Clean files in place. Params: files, backup, force,
+            preserveTodo, preservePatterns, keepDocComments,
+            keepTrailingWhitespace, keepBlankLines
+        cleanBuffer: Clean text without touching the disk. Params: content,
+            language or path, and the comment and whitespace options above
+        cancel: Stop a running clean request after the current file. Params: id
+        ping: Check that the server is alive
+        shutdown: Exit once the response is sent
+    
+    Clean requests run on a BatchProcessor kept for their whitespace
+    settings. While one runs, a 'progress' notification reports each file's
+    result as soon as the file is done, with the number of files done.
+    """
+    
+    PARSE_ERROR = -32700
+    INVALID_REQUEST = -32600
+    METHOD_NOT_FOUND = -32601
+    INVALID_PARAMS = -32602
+    SERVER_ERROR = -32000
+    
+    def __init__(self, remover_settings: Optional[Dict[str, Any]] = None,
+                 idle_timeout: Optional[float] = 600, memory_limit: Optional[int] = 1024):
+        """
+        Initialize the server.
+        
+        Args:
+            remover_settings: CommentRemover arguments other than the post-processor
+            idle_timeout: Seconds without a request after which the server exits
+                (None to wait forever)
+            memory_limit: Resident memory in MiB above which the server exits once
+                the current request is answered (None for no limit)
+        """
+        self.remover_settings = dict(remover_settings or {})
+        self.idle_timeout = idle_timeout
+        self.memory_limit = memory_limit
+        self._removers: Dict[Tuple[bool, bool], CommentRemover] = {}
+        self._processors: Dict[Tuple[bool, bool], BatchProcessor] = {}
+        self._requests: 'queue.Queue[Any]' = queue.Queue()
+        # Set by the reader thread as soon as a cancel request arrives
+        self._cancelled: Dict[Any, threading.Event] = {}
+        self._output = None
+        self.methods = {
+            'clean': self.clean,
+            'cleanBuffer': self.clean_buffer,
+            'ping': lambda params, request_id: {'pid': os.getpid()},
         }
+    
+    def serve(self, input_fd: Optional[int] = None, output_stream: Any = None) -> int:
+        """
+        Answer requests until shutdown, end of input, idle timeout or memory limit.
         
-        # Map file extensions to language types
-        self._extension_map = {
-            '.py': 'python',
-            '.html': 'html', '.htm': 'html',
-            '.css': 'css',
-            '.js': 'javascript',
-            '.jsx': 'javascript',
-            '.ts': 'typescript',
-            '.tsx': 'typescript',
-            '.c': 'c', '.h': 'c',
-            '.cpp': 'cpp', '.hpp': 'cpp', '.cc': 'cpp', '.cxx': 'cpp',
-            '.java': 'java',
-            '.rb': 'ruby',
-            '.go': 'go',
-            '.php': 'php',
-            '.sql': 'sql',    
-            '.swift': 'swift',
-            '.rs': 'rust',
-            '.kt': 'kotlin',
-            '.sh': 'bash', '.bash': 'bash',
-            '.ps1': 'powershell',
-            '.lua': 'lua',
-            '.pl': 'perl', '.pm': 'perl',
-            '.yaml': 'yaml', '.yml': 'yaml',
-            '.hs': 'haskell',
-            '.dart': 'dart',
-            '.m': 'matlab',
-            '.r': 'r', '.R': 'r',
-            '.cs': 'csharp'
+        Args:
+            input_fd: File descriptor to read UTF-8 requests from (default: stdin)
+            output_stream: Text stream to write responses to (default: stdout)
+            
+        Returns:
+            Process exit code
+        """
+        if input_fd is None:
+            input_fd = sys.stdin.fileno()
+        self._output = output_stream or sys.stdout
+        
+        reader = threading.Thread(target=self._read_requests, args=(input_fd,), daemon=True)
+        reader.start()
+        logger.info(f"Serving requests (pid {os.getpid()})")
+        
+        while True:
+            try:
+                message = self._requests.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                logger.info(f"No requests for {self.idle_timeout} seconds, exiting")
+                return 0
+            if message is None:
+                return 0  # End of input
+            
+            if isinstance(message, Exception):
+                self._send({'jsonrpc': '2.0', 'id': None,
+                            'error': {'code': self.PARSE_ERROR, 'message': str(message)}})
+                continue
+            
+            request_id = message.get('id')
+            if message.get('method') == 'shutdown':
+                self._send({'jsonrpc': '2.0', 'id': request_id, 'result': None})
+                return 0
+            
+            response = self.handle(message)
+            if request_id is not None:
+                self._send(response)
+            self._cancelled.pop(request_id, None)
+            
+            resident = self._resident_memory_mib() if self.memory_limit else None
+            if resident is not None and resident > self.memory_limit:
+                logger.warning(f"Memory use {resident:.0f} MiB is over the {self.memory_limit} MiB limit, exiting")
+                return 0
+    
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run a single request.
+        
+        Args:
+            message: Decoded JSON-RPC request
+            
+        Returns:
+            JSON-RPC response
+        """
+        request_id = message.get('id')
+        method = self.methods.get(message.get('method'))
+        params = message.get('params') or {}
+        if method is None:
+            return self._error(request_id, self.METHOD_NOT_FOUND, f"Unknown method: {message.get('method')}")
+        if not isinstance(params, dict):
+            return self._error(request_id, self.INVALID_PARAMS, 'Params must be an object')
+        
+        try:
+            result = method(params, request_id)
+        except (KeyError, TypeError, ValueError) as e:
+            return self._error(request_id, self.INVALID_PARAMS, f"Invalid params: {e}")
+        except Exception as e:
+            logger.error(f"Error handling {message.get('method')}: {e}")
+            return self._error(request_id, self.SERVER_ERROR, str(e))
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+    
+    def clean(self, params: Dict[str, Any], request_id: Any) -> Dict[str, Any]:
+        """
+        Clean files in place, in parallel, on the warm batch processor.
+        
+        Args:
+            params: Request parameters
+            request_id: Id of the request, for progress and cancellation
+            
+        Returns:
+            Per-file results, the number of files cleaned and whether the
+            request was cancelled
+        """
+        files = params['files']
+        if not isinstance(files, list):
+            raise TypeError('files must be a list')
+        processor = self._processor(params)
+        cancel = self._cancel_event(request_id)
+        
+        results = []
+        
+        def on_result(record: Dict[str, Any]) -> None:
+            record['success'] = record['status'] == 'cleaned'
+            results.append(record)
+            if request_id is not None:
+                self._send({'jsonrpc': '2.0', 'method': 'progress',
+                            'params': {'id': request_id, 'done': len(results), 'total': len(files),
+                                       'file': record}})
+        
+        success_count, _ = processor.process_files(
+            files,
+            backup=params.get('backup', True),
+            force=bool(params.get('force')),
+            preserve_todo=bool(params.get('preserveTodo')),
+            preserve_patterns=params.get('preservePatterns'),
+            keep_doc_comments=bool(params.get('keepDocComments')),
+            on_result=on_result,
+            cancel=cancel
+        )
+        return {'files': results, 'successCount': success_count, 'cancelled': cancel.is_set()}
+    
+    def clean_buffer(self, params: Dict[str, Any], request_id: Any) -> Dict[str, Any]:
+        """
+        Clean text without touching the disk.
+        
+        Args:
+            params: Request parameters
+            request_id: Id of the request
+            
+        Returns:
+            Cleaned content with its statistics
+        """
+        content = params['content']
+        if not isinstance(content, str):
+            raise TypeError('content must be a string')
+        remover = self._remover(params)
+        language = params.get('language') or remover.identify_language(params.get('path', ''))
+        
+        stats = CommentStats()
+        cleaned = remover.remove_comments(
+            content, language,
+            preserve_todo=bool(params.get('preserveTodo')),
+            preserve_patterns=params.get('preservePatterns'),
+            keep_doc_comments=bool(params.get('keepDocComments')),
+            stats=stats
+        )
+        return {
+            'content': cleaned,
+            'language': language,
+            'commentCount': stats.removed,
+            'commentsPreserved': stats.preserved,
+            'commentsByKind': stats.to_dict()['byKind'],
+            'linesRemoved': content.count('\n') - cleaned.count('\n'),
         }
     
-    def identify_language(self, file_path: str) -> str:
+    def _remover(self, params: Dict[str, Any]) -> CommentRemover:
+        """
+        Get the warm remover for a request's whitespace settings.
+        
+        Args:
+            params: Request parameters
+            
+        Returns:
+            A CommentRemover kept for these settings
+        """
+        key = (not params.get('keepTrailingWhitespace'), not params.get('keepBlankLines'))
+        remover = self._removers.get(key)
+        if remover is None:
+            remover = self._removers[key] = CommentRemover(PostProcessor(*key), **self.remover_settings)
+        return remover
+    
+    def _processor(self, params: Dict[str, Any]) -> BatchProcessor:
+        """
+        Get the warm batch processor for a request's whitespace settings.
+        
+        Args:
+            params: Request parameters
+            
+        Returns:
+            A thread-pool BatchProcessor around the remover for these settings
+        """
+        key = (not params.get('keepTrailingWhitespace'), not params.get('keepBlankLines'))
+        processor = self._processors.get(key)
+        if processor is None:
+            processor = self._processors[key] = BatchProcessor(self._remover(params))
+        return processor
+    
+    def _cancel_event(self, request_id: Any) -> threading.Event:
+        """
+        Get the event that cancels a request, which may arrive before the request runs.
+        
+        Args:
+            request_id: Id of the request
+            
+        Returns:
+            The request's cancellation event
+        """
+        return self._cancelled.setdefault(request_id, threading.Event())
+    
+    def _read_requests(self, input_fd: int) -> None:
+        """
+        Read requests on a background thread, handling cancellation straight away.
+        
+        Reads the descriptor directly rather than through a buffered stream, so
+        the process can exit while this thread is still waiting for input.
+        
+        Args:
+            input_fd: File descriptor to read requests from
+        """
+        pending = b''
+        while True:
+            data = os.read(input_fd, 65536)
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b'\n')
+            for line in lines:
+                self._queue_request(line)
+        self._queue_request(pending)
+        self._requests.put(None)
+    
+    def _queue_request(self, line: bytes) -> None:
+        """
+        Decode one request line and queue it, or record a cancellation.
+        
+        Args:
+            line: Raw request line
+        """
+        if not line.strip():
+            return
+        try:
+            message = json.loads(line.decode('utf-8'))
+            if not isinstance(message, dict):
+                raise ValueError('Request must be a JSON object')
+        except ValueError as e:
+            self._requests.put(e)
+            return
+        if message.get('method') == 'cancel':
+            self._cancel_event((message.get('params') or {}).get('id')).set()
+            return
+        self._requests.put(message)
+    
+    def _send(self, message: Dict[str, Any]) -> None:
+        """
+        Write one message as a line of JSON.
+        
+        Args:
+            message: JSON-RPC response or notification
+        """
+        self._output.write(json.dumps(message) + '\n')
+        self._output.flush()
+    
+    def _error(self, request_id: Any, code: int, message: str) -> Dict[str, Any]:
         """
-        Determine language type based on file extension.
+        Build an error response.
         
         Args:
-            file_path: Path to the file to analyze
+            request_id: Id of the failed request
+            code: JSON-RPC error code
+            message: Error description
             
         Returns:
-            Language identifier string or 'unknown' if not recognized
+            JSON-RPC error response
         """
-        ext = os.path.splitext(file_path)[1].lower()
-        return self._extension_map.get(ext, 'unknown')
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
     
-    def count_comments(self, content: str) -> int:
+    def _resident_memory_mib(self) -> Optional[float]:
         """
-        Count comments (approximate) in the content.
+        Get the current memory use of the process.
+        
+        Unlike the peak, this goes down again once a large request's
+        memory is freed.
         
-        Args:
-            content: Source code content to analyze
-            
         Returns:
-            Estimated number of comments in the content
+            Resident set size in MiB, or None if it cannot be measured
         """
-        count = 0
-        patterns = [
-            r'//.*$',                # JavaScript/C/C++/Java line comments 
-            r'/\*[\s\S]*?\*/',       # Block comments
-            r'#.*$',                 # Python/Perl/Ruby/Shell comments
-            r'--.*$',                # SQL/Lua comments
-            r'%.*$',                 # MATLAB comments
-            r'"""[\s\S]*?"""',       # Python docstrings (double quotes)
-            r"'''[\s\S]*?'''",       # Python docstrings (single quotes)
-            r'<!--[\s\S]*?-->',      # HTML/XML comments - standard pattern
-            r'(?s)<!--.*?-->',       # HTML comments with dotall flag for multi-line
-            r'<#[\s\S]*?#>',         # PowerShell comments
-            r'\{-[\s\S]*?-\}',       # Haskell comments
-            r'=begin[\s\S]*?=end',   # Ruby block comments
-            r'=begin[\s\S]*?=cut'    # Perl block comments
-        ]
+        try:
+            with open('/proc/self/statm') as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+        except (OSError, ValueError, IndexError, AttributeError):
+            pass
+        if psutil is not None:
+            return psutil.Process().memory_info().rss / (1024 * 1024)
+        return None
+
+
+class NdjsonReporter:
+    """
+    Writes batch results as newline-delimited JSON.
+    
+    Each processed file gives one {"type": "file", ...} object, written as
+    soon as the file is done, and finish() writes one {"type": "summary", ...}
+    object with the totals. Log output stays on stderr, so the stream can be
+    parsed line by line however many files there are.
+    """
+    
+    TOTALS = ('commentCount', 'commentsPreserved', 'linesRemoved', 'sizeReduction',
+              'originalSize', 'newSize')
+    
+    def __init__(self, stream: Any = None):
+        """
+        Initialize the reporter.
         
-        # Run each pattern and see if it matches
-        for pattern in patterns:
-            matches = re.findall(pattern, content, re.MULTILINE)
-            count += len(matches)
-            if matches and len(matches) > 0:
-                logger.info(f"Found {len(matches)} comments with pattern '{pattern}'")
-                if len(matches) > 0 and logger.level <= logging.INFO:
-                    # Log the first match to help debugging (truncated for readability)
-                    first_match = matches[0][:50] + "..." if len(matches[0]) > 50 else matches[0]
-                    logger.info(f"  Example: {first_match}")
-                
-        return count
+        Args:
+            stream: Text stream to write to (default: sys.stdout)
+        """
+        self.stream = stream or sys.stdout
+        self.started = time.perf_counter()
+        self.counts = {'cleaned': 0, 'skipped': 0, 'error': 0, 'unchanged': 0,
+                       'offending': 0, 'clean': 0}
+        self.totals = dict.fromkeys(self.TOTALS, 0)
     
-    def remove_comments(self, content: str, language: str, 
-                   preserve_todo: bool = False, 
-                   preserve_patterns: Optional[List[str]] = None,
-                   keep_doc_comments: bool = False) -> str:
+    def __call__(self, record: Dict[str, Any]) -> None:
         """
-        Remove comments from code based on language syntax rules.
+        Write one file's record and add it to the totals.
         
         Args:
-            content: Source code content to process
-            language: Language identifier for appropriate handler selection
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
-            keep_doc_comments: Whether to preserve documentation comments
-            
-        Returns:
-            Processed content with comments removed according to settings
+            record: Record from BatchProcessor.process_files
         """
-        if language == 'unknown' or language not in self._handlers:
-            return content
-            
-        # Get the appropriate handler for this language
-        handler = self._handlers[language]
+        self.counts[record['status']] += 1
+        for key in self.TOTALS:
+            self.totals[key] += record.get(key, 0)
+        self._write({'type': 'file', **record})
+    
+    def finish(self) -> None:
+        """Write the summary object."""
+        summary = {'type': 'summary', 'files': sum(self.counts.values())}
+        summary.update(self.counts)
+        summary.update(self.totals)
+        summary['seconds'] = time.perf_counter() - self.started
+        self._write(summary)
+    
+    def _write(self, message: Dict[str, Any]) -> None:
+        """
+        Write one JSON object as a line and flush it.
         
-        # Process the content with all parameters
-        cleaned = handler.remove_comments(
-            content, 
-            keep_doc_comments=keep_doc_comments,
-            preserve_todo=preserve_todo,
-            preserve_patterns=preserve_patterns
-        )
+        Args:
+            message: Object to write
+        """
+        self.stream.write(json.dumps(message) + '\n')
+        self.stream.flush()
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    
+    Returns:
+        Parsed arguments object
+    """
+    parser = argparse.ArgumentParser(description='Remove comments from code files.')
+    parser.add_argument('file_patterns', nargs='*', metavar='file_pattern',
+                      help='Files or file patterns to match (e.g., *.py, src/*.js)')
+    parser.add_argument('--files-from', metavar='FILE',
+                      help="Read exact file paths from FILE ('-' for stdin), one per line")
+    parser.add_argument('-0', '--null', action='store_true',
+                      help='Paths read with --files-from are separated by NUL characters')
+    parser.add_argument('--no-backup', action='store_true', help='Skip creating backup files')
+    parser.add_argument('--backup-store', metavar='DIR',
+                      help='Back up changed files once per distinct content into this directory '
+                           'instead of writing .bak files next to them')
+    parser.add_argument('--restore', nargs='?', const='', metavar='RUN',
+                      help='Put back the originals backed up to --backup-store by a run '
+                           '(default: the latest run) instead of cleaning files')
+    parser.add_argument('--force', action='store_true', help='Process unknown file types')
+    parser.add_argument('--recursive', action='store_true', help='Process files recursively')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                      help='Skip files and directories matching this .gitignore-style pattern '
+                           '(can be repeated)')
+    parser.add_argument('--no-ignore', action='store_true',
+                      help='Do not skip files listed in .gitignore files')
+    parser.add_argument('--preserve-todo', action='store_true', help='Preserve TODO and FIXME comments')
+    parser.add_argument('--preserve-patterns', type=str, help='JSON array of regex patterns to preserve')
+    parser.add_argument('--check', action='store_true',
+                      help='Report files with comments that would be removed, without modifying '
+                           'anything, and exit with status 1 if there are any, or 2 if any file '
+                           'could not be checked')
+    parser.add_argument('--keep-doc-comments', action='store_true', 
+                   help='Preserve documentation comments')
+    parser.add_argument('--keep-trailing-whitespace', action='store_true',
+                      help='Do not strip trailing whitespace from lines')
+    parser.add_argument('--keep-blank-lines', action='store_true',
+                      help='Do not collapse runs of blank lines')
+    parser.add_argument('--stream-threshold', type=float, default=CommentRemover.STREAM_THRESHOLD / (1024 * 1024),
+                      help='Clean files larger than this many MiB in bounded-memory chunks (0 to disable)')
+    parser.add_argument('--text-engine', action='store_true',
+                      help='Always decode files to text instead of scanning memory-mapped bytes')
+    parser.add_argument('--cache', metavar='FILE',
+                      help='Cache results by file content in this SQLite database, so files '
+                           'cleaned before are skipped or copied instead of cleaned again')
+    parser.add_argument('--cache-size', type=int, default=ResultCache.MAX_ENTRIES,
+                      help='Number of cache entries to keep, least recently used evicted first')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Skip files whose size, mtime and inode match the manifest of an earlier run')
+    parser.add_argument('--manifest', default='.ccp-manifest.json', metavar='FILE',
+                      help='Manifest file for --incremental (default: .ccp-manifest.json)')
+    parser.add_argument('--threads', type=int, default=None, 
+                      help='Number of threads (or processes) for parallel processing '
+                           '(default: chosen from the CPU count and measured I/O time, '
+                           'but at least 4 threads)')
+    parser.add_argument('--executor', choices=BatchProcessor.EXECUTORS, default=None,
+                      help='Run workers as threads, or as processes to use several CPU cores '
+                           '(default: processes with --check, threads otherwise)')
+    parser.add_argument('--quiet', action='store_true', help='Reduce output verbosity')
+    parser.add_argument('--profile', action='store_true',
+                      help='Time the phases of processing each file and print histograms per language')
+    parser.add_argument('--profile-output', metavar='FILE',
+                      help='Also run every worker under cProfile and write the merged data to FILE '
+                           '(pstats format)')
+    parser.add_argument('--trace', metavar='FILE',
+                      help='Write a timeline of the run to FILE in Chrome trace event format, '
+                           'for chrome://tracing or Perfetto')
+    parser.add_argument('--format', choices=('text', 'ndjson'), default='text',
+                      help='With ndjson, write one JSON object per file and a summary to stdout '
+                           '(log output goes to stderr)')
+    parser.add_argument('--serve', action='store_true',
+                      help='Serve JSON-RPC requests on stdin/stdout instead of processing a file pattern')
+    parser.add_argument('--idle-timeout', type=float, default=600,
+                      help='With --serve, exit after this many seconds without a request (0 to wait forever)')
+    parser.add_argument('--memory-limit', type=int, default=1024,
+                      help='With --serve, exit after a request once memory use exceeds this many MiB (0 for no limit)')
+    
+    args = parser.parse_args()
+    if args.restore is not None and not args.backup_store:
+        parser.error('--restore needs --backup-store')
+    if not args.serve and args.restore is None and not args.file_patterns and not args.files_from:
+        parser.error('give file patterns or --files-from unless --serve or --restore is given')
+    if args.check and args.incremental:
+        parser.error('--check cannot be combined with --incremental')
+    if args.executor is None:
+        # Checking only reads files, so it is bound by the handlers' CPU time
+        args.executor = 'process' if args.check else 'thread'
+    return args
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate a '/'-separated glob pattern into a regular expression.
+    
+    '*' and '?' do not match '/', '[...]' is a character class, and a '**'
+    path component matches any number of directories, including none.
+    
+    Args:
+        pattern: Glob pattern
         
-        # Clean up the result by removing trailing whitespace and excessive newlines
-        cleaned = '\n'.join(line.rstrip() for line in cleaned.split('\n'))
-        cleaned = re.sub(r'\n\s*\n\s*\n', '\n\n', cleaned)
+    Returns:
+        Regular expression source matching the whole path
+    """
+    parts = []
+    components = pattern.split('/')
+    for index, component in enumerate(components):
+        last = index == len(components) - 1
+        if component == '**':
+            parts.append('.*' if last else '(?:[^/]*/)*')
+            continue
+        i = 0
+        while i < len(component):
+            char = component[i]
+            if char == '*':
+                parts.append('[^/]*')
+            elif char == '?':
+                parts.append('[^/]')
+            elif char == '[' and component.find(']', i + 2) != -1:
+                close = component.find(']', i + 2)
+                body = component[i + 1:close]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append('[' + body.replace('\\', '\\\\') + ']')
+                i = close
+            else:
+                parts.append(re.escape(char))
+            i += 1
+        if not last:
+            parts.append('/')
+    return ''.join(parts) + r'\Z'
+
+
+class IgnoreRules:
+    """
+    Exclusion rules in .gitignore syntax.
+    
+    Patterns without a '/' (other than a trailing one) match a name at any
+    depth; others are anchored to the rules' base directory. A trailing '/'
+    matches directories only, '!' re-includes, and the last matching rule
+    wins.
+    """
+    
+    def __init__(self, lines: List[str]):
+        """
+        Compile the rules.
         
-        return cleaned
+        Args:
+            lines: Lines of a .gitignore file, or individual patterns
+        """
+        self.rules: List[Tuple[Pattern, bool, bool]] = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip('\r')
+            if not line.strip() or line.startswith('#'):
+                continue
+            line = line.rstrip(' ')
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            anchored = '/' in line
+            regex = glob_to_regex(line.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            self.rules.append((re.compile(regex, re.DOTALL), dir_only, negate))
     
-    def process_file(self, file_path: str, backup: bool = True, 
-                force: bool = False, preserve_todo: bool = False,
-                preserve_patterns: Optional[List[str]] = None,
-                keep_doc_comments: bool = False) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    @classmethod
+    def from_file(cls, path: str) -> 'IgnoreRules':
         """
-        Process a single file to remove comments.
+        Read rules from a .gitignore file.
         
         Args:
-            file_path: Path to the file to process
-            backup: Whether to create a backup before modifying
-            force: Whether to process unknown file types
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
-            keep_doc_comments: Whether to preserve documentation comments
+            path: Path of the file
             
         Returns:
-            Tuple of (success_flag, statistics_dict)
+            Compiled rules; empty if the file cannot be read
         """
-        language = self.identify_language(file_path)
-        
-        # Skip unknown file types unless forced
-        if language == 'unknown' and not force:
-            logger.info(f"Skipping {file_path}: Unknown file type. Use --force to process anyway.")
-            return (False, None)
-        
-        logger.info(f"Processing: {file_path} (detected as {language})")
-
-        # Create backup if requested
-        backup_path = None
-        if backup:
-            backup_path = file_path + '.bak'
-            shutil.copy2(file_path, backup_path)
-            logger.info(f"  Backup created: {backup_path}")
-
         try:
-            # Statistics tracking
-            original_size = os.path.getsize(file_path)
-            
-            # Try multiple encodings to read the file
-            encodings_to_try = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
-            content = None
-            
-            for encoding in encodings_to_try:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                        used_encoding = encoding
-                    break  # Stop if successful
-                except UnicodeDecodeError:
-                    continue
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return cls(f.readlines())
+        except OSError as e:
+            logger.warning(f"Failed to read {path}: {e}")
+            return cls([])
+    
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Match a path against the rules.
         
-            if content is None:
-                logger.error(f"  Error: Unable to decode {file_path} with supported encodings.")
-                return (False, None)
-            
-            # Count original lines
-            original_lines = content.count('\n') + 1
-            
-            # Count comments (approximate)
-            comment_count = self.count_comments(content)
-            
-            # Process content to remove comments
-            cleaned = self.remove_comments(
-                content, language, preserve_todo, preserve_patterns, keep_doc_comments
-            )
-            
-            # Count cleaned lines
-            cleaned_lines = cleaned.count('\n') + 1
-            lines_removed = original_lines - cleaned_lines
-            
-            # Write cleaned content back to file using the same encoding
-            with open(file_path, 'w', encoding=used_encoding) as f:
-                f.write(cleaned)
-            
-            # Calculate statistics
-            new_size = os.path.getsize(file_path)
-            size_reduction = original_size - new_size
-            percentage = (size_reduction / original_size) * 100 if original_size > 0 else 0
-            
-            logger.info(f"  Removed approximately {comment_count} comments ({lines_removed} lines)")
-            logger.info(f"  File size reduced by {size_reduction} bytes ({percentage:.1f}%)")
+        Args:
+            path: '/'-separated path relative to the rules' base directory
+            is_dir: Whether the path is a directory
             
-            return True, {
-                'commentCount': comment_count,
-                'linesRemoved': lines_removed,
-                'sizeReduction': size_reduction,
-                'sizePercentage': percentage
-            }
-        except UnicodeDecodeError as e:
-            logger.error(f"  Error: Unable to decode {file_path}. File may use unsupported encoding: {e}")
-            return (False, None)
-        except PermissionError:
-            logger.error(f"  Error: Permission denied for {file_path}. Check file permissions.")
-            return (False, None)
-        except Exception as e:
-            logger.error(f"  Error processing {file_path}: {e}")
-            # Restore from backup if available
-            if backup and backup_path:
-                try:
-                    shutil.copy2(backup_path, file_path)
-                    logger.info(f"  Restored from backup due to error")
-                except Exception as restore_error:
-                    logger.error(f"  Failed to restore from backup: {restore_error}")
-            return (False, None)
+        Returns:
+            True if excluded, False if re-included, None if no rule matches
+        """
+        result = None
+        for regex, dir_only, negate in self.rules:
+            if (is_dir or not dir_only) and regex.match(path):
+                result = not negate
+        return result
 
 
-class BatchProcessor:
+class FileFinder:
     """
-    Handles batch processing of multiple files with progress tracking.
+    Finds the files matching glob patterns with os.scandir.
     
-    Manages parallel execution and aggregates results.
+    Directories excluded by .gitignore files or by exclude patterns are
+    not entered, files are filtered by name before anything else is looked
+    at, and a file reached through several links is found once. Hidden
+    files and directories are skipped, as glob does. Paths are yielded as
+    they are found, except that names reached through symbolic links wait
+    until the rest of the walk is done, so that a file whose target is in
+    the tree is found under its own name rather than the link's.
     """
     
-    def __init__(self, remover: CommentRemover, max_workers: int = 4):
+    _MAGIC = re.compile(r'[*?[]')
+    
+    def __init__(self, accept: Optional[Callable[[str], bool]] = None,
+                 excludes: Optional[List[str]] = None, use_gitignore: bool = True):
         """
-        Initialize the batch processor.
+        Initialize the finder.
         
         Args:
-            remover: CommentRemover instance to use for processing
-            max_workers: Maximum number of parallel worker threads
+            accept: Called with each file name; files it returns False for are
+                skipped (None to accept every file)
+            excludes: Patterns in .gitignore syntax, relative to the current
+                directory, for files and directories to skip
+            use_gitignore: Whether to honour .gitignore files in the searched
+                directories and their parents up to the repository root
         """
-        self.remover = remover
-        self.max_workers = max_workers
+        self.accept = accept
+        self.excludes = IgnoreRules(excludes or [])
+        self.use_gitignore = use_gitignore
+        self._seen: Set[Tuple[int, int]] = set()
     
-    def process_files(self, files: List[str], backup: bool = True, force: bool = False,
-                    preserve_todo: bool = False, preserve_patterns: Optional[List[str]] = None,
-                    keep_doc_comments: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+    def first_visit(self, file_path: str) -> bool:
         """
-        Process multiple files in parallel.
+        Check whether a file was not found before under any name.
         
         Args:
-            files: List of file paths to process
-            backup: Whether to create backup files
-            force: Whether to process unknown file types
-            preserve_todo: Whether to preserve TODO and FIXME comments
-            preserve_patterns: List of regex patterns for comments to preserve
-            keep_doc_comments: Whether to preserve documentation comments
+            file_path: Path to the file
             
         Returns:
-            Tuple of (success_count, results_list)
+            True the first time a file is seen
         """
-        if not files:
-            return (0, [])
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return True  # process_file reports the error
+        key = (stat.st_dev, stat.st_ino)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+    
+    def find(self, pattern: str, recursive: bool = False):
+        """
+        Find the files matching a glob pattern.
+        
+        Args:
+            pattern: Glob pattern; '**' matches any number of directories
+            recursive: Whether to match the pattern in subdirectories too
             
-        success_count = 0
-        results = []
+        Yields:
+            Paths of matching files, not yet yielded by this finder
+        """
+        if recursive and '**' not in pattern:
+            pattern = os.path.join('**', pattern)
+        if os.sep != '/':
+            pattern = pattern.replace(os.sep, '/')
         
-        total_files = len(files)
-        logger.info(f"Processing {total_files} files with {self.max_workers} threads")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all files for processing
-            future_to_file = {
-                executor.submit(
-                    self.remover.process_file, 
-                    file_path, 
-                    backup, 
-                    force,
-                    preserve_todo,
-                    preserve_patterns,
-                    keep_doc_comments
-                ): file_path for file_path in files
-            }
+        if not self._MAGIC.search(pattern):
+            if os.path.isfile(pattern) and self.first_visit(pattern):
+                yield pattern
+            return
+        
+        # Walk from the longest leading part without wildcards
+        components = pattern.split('/')
+        split = 0
+        while split < len(components) - 1 and not self._MAGIC.search(components[split]):
+            split += 1
+        base = '/'.join(components[:split])
+        if components[:split] == ['']:
+            base = '/'
+        rest = '/'.join(components[split:])
+        regex = re.compile(glob_to_regex(rest), re.DOTALL)
+        max_depth = None if '**' in components[split:] else len(components) - split
+        if base and not os.path.isdir(base):
+            return
+        
+        # Rule sets as (rules, prefix, strip): a walk-relative path p is
+        # matched as prefix + p[strip:]
+        rule_sets = []
+        if self.use_gitignore:
+            rule_sets = self._parent_rules(base or '.')
+        relative_base = os.path.relpath(base or '.').replace(os.sep, '/')
+        exclude_prefix = '' if relative_base == '.' else relative_base + '/'
+        
+        root = os.stat(base or '.')
+        visited = {(root.st_dev, root.st_ino)}
+        # Linked directories and files, walked and yielded after everything
+        # reached without links
+        linked_directories = []
+        linked_files: Dict[Tuple[int, int], str] = {}
+        stack = [(base, '', 1, rule_sets, False)]
+        while stack or linked_directories:
+            if not stack:
+                key, item = linked_directories.pop(0)
+                if key not in visited:
+                    visited.add(key)
+                    stack.append(item)
+                continue
+            directory, relative, depth, rule_sets, linked = stack.pop()
+            try:
+                with os.scandir(directory or '.') as it:
+                    entries = list(it)
+            except OSError as e:
+                logger.warning(f"Cannot read directory {directory or '.'}: {e}")
+                continue
             
-            # Process as they complete
-            processed = 0
+            if self.use_gitignore and any(entry.name == '.gitignore' for entry in entries):
+                rules = IgnoreRules.from_file(os.path.join(directory, '.gitignore'))
+                rule_sets = rule_sets + [(rules, '', len(relative) + 1 if relative else 0)]
             
-            for future in concurrent.futures.as_completed(future_to_file):
-                file_path = future_to_file[future]
-                processed += 1
+            for entry in entries:
+                name = entry.name
+                if name.startswith('.'):
+                    continue
+                child = relative + '/' + name if relative else name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir and max_depth is not None and depth >= max_depth:
+                    continue
+                if not is_dir and self.accept is not None and not self.accept(name):
+                    continue
+                if not is_dir and not regex.match(child):
+                    continue
+                if self._ignored(child, is_dir, rule_sets, exclude_prefix):
+                    continue
                 
                 try:
-                    success, stats = future.result()
-                    if success:
-                        success_count += 1
-                        results.append(stats)
-                    
-                    # Show progress
-                    logger.info(f"Progress: {processed}/{total_files} files ({(processed/total_files)*100:.1f}%)")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing {file_path}: {e}")
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                key = (stat.st_dev, stat.st_ino)
+                path = os.path.join(directory, name)
+                is_link = linked or entry.is_symlink()
+                if is_dir:
+                    # Symbolic links can lead back to a directory already searched
+                    item = (path, child, depth + 1, rule_sets, is_link)
+                    if is_link:
+                        linked_directories.append((key, item))
+                    elif key not in visited:
+                        visited.add(key)
+                        stack.append(item)
+                elif entry.is_file() and key not in self._seen:
+                    if is_link:
+                        linked_files.setdefault(key, path)
+                    else:
+                        self._seen.add(key)
+                        yield path
         
-        # Show summary statistics
-        if results:
-            total_comments = sum(r['commentCount'] for r in results)
-            total_lines = sum(r['linesRemoved'] for r in results)
-            total_reduction = sum(r['sizeReduction'] for r in results)
-            logger.info(f"\nSummary:")
-            logger.info(f"- Removed approximately {total_comments} comments")
-            logger.info(f"- Removed {total_lines} lines of comments")
-            logger.info(f"- Reduced file sizes by {total_reduction} bytes")
+        for key, path in linked_files.items():
+            if key not in self._seen:
+                self._seen.add(key)
+                yield path
+    
+    def _ignored(self, path: str, is_dir: bool, rule_sets: List[Tuple[IgnoreRules, str, int]],
+                 exclude_prefix: str) -> bool:
+        """
+        Check a walk-relative path against the exclude patterns and .gitignore rules.
         
-        logger.info(f"Done! Successfully processed {success_count} of {len(files)} files.")
+        Args:
+            path: Path relative to the walk's base directory
+            is_dir: Whether the path is a directory
+            rule_sets: .gitignore rules in effect, outermost first
+            exclude_prefix: Path of the walk's base relative to the current directory
+            
+        Returns:
+            True if the path is excluded
+        """
+        if self.excludes.match(exclude_prefix + path, is_dir):
+            return True
+        ignored = None
+        for rules, prefix, strip in rule_sets:
+            result = rules.match(prefix + path[strip:], is_dir)
+            if result is not None:
+                ignored = result
+        return bool(ignored)
+    
+    def _parent_rules(self, base: str) -> List[Tuple[IgnoreRules, str, int]]:
+        """
+        Load .gitignore files from the parents of a directory up to the repository root.
         
-        return (success_count, results)
+        Args:
+            base: Directory the walk starts from
+            
+        Returns:
+            Rule sets, outermost first, with prefixes that make walk-relative
+            paths relative to each file's directory
+        """
+        base = os.path.abspath(base)
+        parents = []
+        directory = os.path.dirname(base)
+        while True:
+            parents.append(directory)
+            if os.path.exists(os.path.join(directory, '.git')):
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                # Not in a repository: parents' rules don't apply
+                return []
+            directory = parent
+        if os.path.exists(os.path.join(base, '.git')):
+            return []
+        
+        rule_sets = []
+        for directory in reversed(parents):
+            path = os.path.join(directory, '.gitignore')
+            if os.path.isfile(path):
+                prefix = os.path.relpath(base, directory).replace(os.sep, '/') + '/'
+                rule_sets.append((IgnoreRules.from_file(path), prefix, 0))
+        return rule_sets
 
 
-def parse_args():
+def collect_files(patterns: List[str], files_from: Optional[str] = None,
+                  null_separated: bool = False, recursive: bool = False,
+                  finder: Optional[FileFinder] = None) -> List[str]:
     """
-    Parse command line arguments.
+    Build the list of files to process from the command line.
     
+    Args:
+        patterns: Paths or glob patterns; existing paths are taken as they are
+        files_from: File to read exact paths from, '-' for stdin
+        null_separated: Whether the paths in files_from are separated by NUL
+            characters instead of newlines
+        recursive: Whether patterns match in subdirectories too
+        finder: FileFinder with the filters to apply to patterns
+        
     Returns:
-        Parsed arguments object
+        Unique file paths, in the order they were given
     """
-    parser = argparse.ArgumentParser(description='Remove comments from code files.')
-    parser.add_argument('file_pattern', help='File pattern to match (e.g., *.py, src/*.js)')
-    parser.add_argument('--no-backup', action='store_true', help='Skip creating backup files')
-    parser.add_argument('--force', action='store_true', help='Process unknown file types')
-    parser.add_argument('--recursive', action='store_true', help='Process files recursively')
-    parser.add_argument('--preserve-todo', action='store_true', help='Preserve TODO and FIXME comments')
-    parser.add_argument('--preserve-patterns', type=str, help='JSON array of regex patterns to preserve')
-    parser.add_argument('--keep-doc-comments', action='store_true', 
-                   help='Preserve documentation comments')
-    parser.add_argument('--threads', type=int, default=4, 
-                      help='Number of threads for parallel processing')
-    parser.add_argument('--quiet', action='store_true', help='Reduce output verbosity')
+    if finder is None:
+        finder = FileFinder()
+    files = []
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            # Exact paths may contain glob characters, e.g. '[id].tsx'
+            if finder.first_visit(pattern):
+                files.append(pattern)
+            continue
+        
+        found = len(files)
+        files.extend(finder.find(pattern, recursive))
+        if len(files) == found:
+            logger.warning(f"No files found matching pattern: {pattern}")
+    
+    if files_from:
+        if files_from == '-':
+            data = sys.stdin.buffer.read()
+        else:
+            with open(files_from, 'rb') as f:
+                data = f.read()
+        entries = data.split(b'\0') if null_separated else data.splitlines()
+        files.extend(os.fsdecode(entry) for entry in entries if entry)
     
-    return parser.parse_args()
+    return list(dict.fromkeys(files))
 
 
 def main():
@@ -1604,34 +5096,119 @@ def main():
         except json.JSONDecodeError:
             logger.error("Failed to parse preserve patterns JSON. Using no patterns.")
     
-    # Handle recursive directory traversal
-    if args.recursive and '**' not in args.file_pattern:
-        file_pattern = os.path.join('**', args.file_pattern)
-    else:
-        file_pattern = args.file_pattern
+    # Validate and compile the preservation rules once, before any file is read
+    PreservationMatcher.cached(args.preserve_todo, preserve_patterns)
+    
+    cache = None
+    if args.cache:
+        try:
+            cache = ResultCache(args.cache, args.cache_size)
+        except Exception as e:
+            logger.error(f"Failed to open cache {args.cache}: {e}")
+            sys.exit(1)
     
-    # Find matching files
-    files = glob.glob(file_pattern, recursive=args.recursive)
+    backup_store = None
+    if args.backup_store:
+        try:
+            backup_store = BackupStore(args.backup_store)
+        except OSError as e:
+            logger.error(f"Failed to open backup store {args.backup_store}: {e}")
+            sys.exit(1)
     
-    if not files:
-        logger.warning(f"No files found matching pattern: {args.file_pattern}")
+    if args.restore is not None:
+        try:
+            restored = backup_store.restore(args.restore or None)
+        except OSError as e:
+            logger.error(f"Failed to read run {args.restore or 'latest'}: {e}")
+            sys.exit(1)
+        logger.info(f"Restored {restored} files")
         return
     
-    logger.info(f"Found {len(files)} files matching {args.file_pattern}")
+    if args.serve:
+        server = CleanServer(
+            remover_settings={
+                'stream_threshold': int(args.stream_threshold * 1024 * 1024),
+                'bytes_engine': not args.text_engine,
+                'cache': cache,
+                'backup_store': backup_store,
+            },
+            idle_timeout=args.idle_timeout or None,
+            memory_limit=args.memory_limit or None
+        )
+        sys.exit(server.serve())
     
     # Create instances
-    remover = CommentRemover()
-    processor = BatchProcessor(remover, max_workers=args.threads)
+    remover = CommentRemover(
+        PostProcessor(
+            strip_trailing_whitespace=not args.keep_trailing_whitespace,
+            collapse_blank_lines=not args.keep_blank_lines
+        ),
+        stream_threshold=int(args.stream_threshold * 1024 * 1024),
+        bytes_engine=not args.text_engine,
+        cache=cache,
+        backup_store=backup_store
+    )
     
-    # Process files
-    processor.process_files(
-        files, 
-        backup=not args.no_backup, 
-        force=args.force,
-        preserve_todo=args.preserve_todo,
-        preserve_patterns=preserve_patterns,
-        keep_doc_comments=args.keep_doc_comments
+    # Find matching files, skipping unknown file types while searching
+    finder = FileFinder(
+        accept=None if args.force else lambda name: remover.identify_language(name) != 'unknown',
+        excludes=args.exclude,
+        use_gitignore=not args.no_ignore
     )
+    try:
+        files = collect_files(args.file_patterns, args.files_from, args.null, args.recursive, finder)
+    except OSError as e:
+        logger.error(f"Failed to read file list: {e}")
+        sys.exit(1)
+    
+    reporter = NdjsonReporter() if args.format == 'ndjson' else None
+    
+    if not files:
+        logger.warning("No files to process")
+        if reporter:
+            reporter.finish()
+        return
+    
+    logger.info(f"Found {len(files)} files to process")
+    
+    processor = BatchProcessor(remover, max_workers=args.threads, executor=args.executor,
+                               profile=args.profile or bool(args.profile_output),
+                               profile_output=args.profile_output, trace_output=args.trace)
+    manifest = Manifest(args.manifest) if args.incremental else None
+    
+    failures = []
+    
+    def on_result(record: Dict[str, Any]) -> None:
+        if record['status'] == 'error':
+            failures.append(record['path'])
+        if reporter:
+            reporter(record)
+    
+    # Process files
+    try:
+        success_count, results = processor.process_files(
+            files, 
+            backup=not args.no_backup, 
+            force=args.force,
+            preserve_todo=args.preserve_todo,
+            preserve_patterns=preserve_patterns,
+            keep_doc_comments=args.keep_doc_comments,
+            on_result=on_result,
+            manifest=manifest,
+            check=args.check
+        )
+    finally:
+        # Keep the results of the files that finished, even after an interruption
+        if manifest is not None:
+            manifest.save()
+    if reporter:
+        reporter.finish()
+    
+    if args.check and failures:
+        # A file that could not be read may hide comments too
+        sys.exit(2)
+    if args.check and any(r['offending'] for r in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,363 @@
+"""
+Regression tests for the Comment Cleaner Pro comment handlers.
+
+Run with:
+    python -m unittest discover test
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python'))
+
+import ccp  # noqa: E402
+
+
+class HaskellCharLiteralTest(unittest.TestCase):
+    """A quote in a character literal must not open a string."""
+    
+    SOURCE = (
+        "quote = '\"' -- first\n"
+        "escaped = '\\'' {- second -}\n"
+        "f a' b' = foldl' g a' b' -- third\n"
+        "t :: Proxy 'True -- fourth\n"
+        "s = \"not -- a comment\"\n"
+    )
+    EXPECTED = (
+        "quote = '\"'\n"
+        "escaped = '\\''\n"
+        "f a' b' = foldl' g a' b'\n"
+        "t :: Proxy 'True\n"
+        "s = \"not -- a comment\"\n"
+    )
+    
+    def test_comments_after_char_literal_are_removed(self):
+        remover = ccp.CommentRemover()
+        self.assertEqual(remover.remove_comments(self.SOURCE, 'haskell'), self.EXPECTED)
+    
+    def test_streaming_matches_whole_file(self):
+        # Chunks this small cut every character literal somewhere
+        for chunk_size in (1, 2, 3):
+            remover = ccp.CommentRemover(chunk_size=chunk_size)
+            output = io.StringIO()
+            remover.clean_stream(io.StringIO(self.SOURCE), output, 'haskell')
+            self.assertEqual(output.getvalue(), self.EXPECTED, f"chunk size {chunk_size}")
+
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Cache hits reuse the cleaned output but report this run."""
+    
+    SOURCE = "x = 1  # note\n# TODO: keep\n"
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = ccp.ResultCache(os.path.join(self.directory, 'cache.db'))
+        self.remover = ccp.CommentRemover(cache=self.cache, profile=True)
+    
+    def write(self, name, content=SOURCE):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+    
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+    
+    def test_copy_reuses_cleaned_output(self):
+        first = self.write('a.py')
+        success, stats = self.remover.process_file(first, backup=False)
+        self.assertTrue(success)
+        self.assertNotIn('cached', stats)
+        
+        copy = self.write('b.py')
+        success, stats = self.remover.process_file(copy, backup=False)
+        self.assertTrue(success)
+        self.assertTrue(stats['cached'])
+        self.assertTrue(stats['rewritten'])
+        self.assertEqual(self.read(copy), self.read(first))
+    
+    def test_clean_file_is_not_rewritten(self):
+        path = self.write('a.py', "x = 1\n")
+        self.remover.process_file(path, backup=False)
+        success, stats = self.remover.process_file(path, backup=False)
+        self.assertTrue(stats['cached'])
+        self.assertFalse(stats['rewritten'])
+    
+    def test_hit_reports_this_run(self):
+        self.remover.process_file(self.write('a.py'), backup=False)
+        (stored,), = self.cache._connection().execute('SELECT stats FROM results')
+        self.assertFalse(ccp.ResultCache.RUN_KEYS & set(json.loads(stored)))
+        
+        success, stats = self.remover.process_file(self.write('b.py'), backup=False)
+        self.assertTrue(stats['cached'])
+        self.assertIn('cache', stats['phases'])
+        self.assertNotIn('handler', stats['phases'])
+    
+    def test_changed_options_miss(self):
+        self.remover.process_file(self.write('a.py'), backup=False)
+        
+        path = self.write('b.py')
+        success, stats = self.remover.process_file(path, backup=False, preserve_todo=True)
+        self.assertTrue(success)
+        self.assertNotIn('cached', stats)
+        self.assertEqual(self.read(path), "x = 1\n# TODO: keep\n")
+
+
+
+class ManifestTest(unittest.TestCase):
+    """Incremental runs skip files left as the last run left them."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        self.path = os.path.join(self.directory, 'a.py')
+        with open(self.path, 'w') as f:
+            f.write("x = 1\n")
+        # Older than the window in which an edit could keep the same mtime
+        os.utime(self.path, (time.time() - 3600, time.time() - 3600))
+        self.processor = ccp.BatchProcessor(ccp.CommentRemover(), max_workers=1)
+    
+    def run_incremental(self, **options):
+        manifest = ccp.Manifest(self.manifest_path)
+        records = []
+        self.processor.process_files([self.path], backup=False, on_result=records.append,
+                                     manifest=manifest, **options)
+        manifest.save()
+        return [record['status'] for record in records]
+    
+    def test_unchanged_file_is_skipped(self):
+        self.assertEqual(self.run_incremental(), ['cleaned'])
+        self.assertEqual(self.run_incremental(), ['unchanged'])
+    
+    def test_edited_file_is_cleaned_again(self):
+        self.run_incremental()
+        with open(self.path, 'a') as f:
+            f.write("# comment\n")
+        self.assertEqual(self.run_incremental(), ['cleaned'])
+        with open(self.path) as f:
+            self.assertNotIn('#', f.read())
+    
+    def test_changed_options_clean_again(self):
+        self.run_incremental()
+        self.assertEqual(self.run_incremental(preserve_todo=True), ['cleaned'])
+    
+    def test_save_keeps_mode(self):
+        self.run_incremental()
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.manifest_path).st_mode & 0o777, 0o666 & ~umask)
+        
+        os.chmod(self.manifest_path, 0o640)
+        self.run_incremental()
+        self.assertEqual(os.stat(self.manifest_path).st_mode & 0o777, 0o640)
+
+
+
+class FileFinderTest(unittest.TestCase):
+    """The walk honours ignore rules and finds each file once."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+    
+    def write(self, *parts, content="x = 1\n"):
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+    
+    def find(self, finder=None):
+        finder = finder or ccp.FileFinder()
+        pattern = os.path.join(self.directory, '**', '*.py')
+        return sorted(os.path.relpath(path, self.directory) for path in finder.find(pattern))
+    
+    def test_gitignore_and_excludes(self):
+        self.write('keep.py')
+        self.write('build', 'skip.py')
+        self.write('src', 'generated.py')
+        self.write('src', 'main.py')
+        self.write('vendor', 'lib.py')
+        self.write('.gitignore', content="build/\n")
+        self.write('src', '.gitignore', content="generated.py\n")
+        
+        finder = ccp.FileFinder(excludes=['vendor'])
+        self.assertEqual(self.find(finder), ['keep.py', os.path.join('src', 'main.py')])
+    
+    def test_link_and_target_found_once_under_target_name(self):
+        target = self.write('z', 'real.py')
+        os.symlink(target, os.path.join(self.directory, 'a.py'))
+        os.symlink(os.path.dirname(target), os.path.join(self.directory, 'b'))
+        self.assertEqual(self.find(), [os.path.join('z', 'real.py')])
+    
+    def test_link_to_target_outside_tree(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        with open(os.path.join(outside, 'real.py'), 'w') as f:
+            f.write("x = 1\n")
+        os.symlink(os.path.join(outside, 'real.py'), os.path.join(self.directory, 'link.py'))
+        self.assertEqual(self.find(), ['link.py'])
+    
+    def test_symlink_loop_terminates(self):
+        self.write('a', 'b', 'c.py')
+        os.symlink(os.path.join(self.directory, 'a'), os.path.join(self.directory, 'a', 'b', 'up'))
+        os.symlink('loop', os.path.join(self.directory, 'loop'))
+        self.assertEqual(self.find(), [os.path.join('a', 'b', 'c.py')])
+
+
+
+class ReplaceTest(unittest.TestCase):
+    """Cleaning a file keeps its links, mode and owner."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'a.py')
+        with open(self.path, 'w') as f:
+            f.write("x = 1  # note\n")
+        self.remover = ccp.CommentRemover()
+    
+    def clean(self, path):
+        success, stats = self.remover.process_file(path, backup=False)
+        self.assertTrue(success)
+        self.assertTrue(stats['rewritten'])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "x = 1\n")
+    
+    def test_symlink_is_kept(self):
+        link = os.path.join(self.directory, 'link.py')
+        os.symlink('a.py', link)
+        self.clean(link)
+        self.assertEqual(os.readlink(link), 'a.py')
+    
+    def test_hard_links_share_new_content(self):
+        other = os.path.join(self.directory, 'b.py')
+        os.link(self.path, other)
+        self.clean(other)
+        self.assertTrue(os.path.samefile(self.path, other))
+    
+    def test_mode_is_kept(self):
+        os.chmod(self.path, 0o751)
+        self.clean(self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o751)
+    
+    @unittest.skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, 'needs root to give files away')
+    def test_owner_is_kept(self):
+        os.chown(self.path, 1234, 5678)
+        self.clean(self.path)
+        self.assertEqual((os.stat(self.path).st_uid, os.stat(self.path).st_gid), (1234, 5678))
+
+
+class BackupStoreTest(unittest.TestCase):
+    """Originals backed up by a run come back with restore()."""
+    
+    ORIGINAL = "x = 1  # note\n"
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store_path = os.path.join(self.directory, 'store')
+    
+    def write(self, name, content=ORIGINAL):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+    
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+    
+    def clean(self, paths, run_id):
+        remover = ccp.CommentRemover(backup_store=ccp.BackupStore(self.store_path, run_id))
+        for path in paths:
+            success, stats = remover.process_file(path)
+            self.assertTrue(success)
+    
+    def blobs(self):
+        objects = os.path.join(self.store_path, 'objects')
+        return [name for _, _, names in os.walk(objects) for name in names]
+    
+    def test_round_trip(self):
+        paths = [self.write('a.py'), self.write('b.py')]
+        self.clean(paths, 'run')
+        self.assertEqual([self.read(path) for path in paths], ["x = 1\n"] * 2)
+        self.assertEqual(len(self.blobs()), 1)
+        
+        self.assertEqual(ccp.BackupStore(self.store_path).restore('run'), 2)
+        self.assertEqual([self.read(path) for path in paths], [self.ORIGINAL] * 2)
+    
+    def test_compressed_round_trip(self):
+        path = self.write('a.py')
+        with unittest.mock.patch.object(ccp.BackupStore, '_clone', return_value=False):
+            self.clean([path], 'run')
+        self.assertTrue(self.blobs()[0].endswith('.gz'))
+        
+        ccp.BackupStore(self.store_path).restore('run')
+        self.assertEqual(self.read(path), self.ORIGINAL)
+    
+    def test_restore_latest_run_keeps_first_original(self):
+        path = self.write('a.py', "x = 1  # one\n# two\n")
+        self.clean([path], '1')
+        self.write('a.py', "y = 2  # three\n")
+        self.clean([path], '2')
+        
+        store = ccp.BackupStore(self.store_path)
+        store.restore()
+        self.assertEqual(self.read(path), "y = 2  # three\n")
+        store.restore('1')
+        self.assertEqual(self.read(path), "x = 1  # one\n# two\n")
+    
+    def test_restore_through_symlink(self):
+        self.write('a.py')
+        link = os.path.join(self.directory, 'link.py')
+        os.symlink('a.py', link)
+        self.clean([link], 'run')
+        
+        ccp.BackupStore(self.store_path).restore('run')
+        self.assertEqual(os.readlink(link), 'a.py')
+        self.assertEqual(self.read(link), self.ORIGINAL)
+
+
+class CheckExitStatusTest(unittest.TestCase):
+    """--check exits 0 when clean, 1 with comments and 2 on errors."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, content in (('clean.py', "x = 1\n"), ('commented.py', "x = 1  # note\n")):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(content)
+    
+    def check(self, *names):
+        paths = '\0'.join(os.path.join(self.directory, name) for name in names)
+        return subprocess.run([sys.executable, ccp.__file__, '--check', '--null', '--files-from', '-'],
+                              input=paths.encode(), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL).returncode
+    
+    def test_exit_status(self):
+        self.assertEqual(self.check('clean.py'), 0)
+        self.assertEqual(self.check('clean.py', 'commented.py'), 1)
+        self.assertEqual(self.check('clean.py', 'missing.py'), 2)
+        self.assertEqual(self.check('commented.py', 'missing.py'), 2)
+    
+    def test_files_are_not_modified(self):
+        self.check('commented.py')
+        with open(os.path.join(self.directory, 'commented.py')) as f:
+            self.assertEqual(f.read(), "x = 1  # note\n")
+
+
+if __name__ == '__main__':
+    unittest.main()